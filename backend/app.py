@@ -9,24 +9,168 @@ Flask 后端 - 用户最小闭环
 前端：直接双击打开 frontend/login.html / frontend/index.html，通过 http://127.0.0.1:5000 调用 API。
 """
 
+import atexit
+import base64
 import datetime
 import json
-from flask import Flask, request, jsonify
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from flask_compress import Compress  # 添加 gzip 压缩支持
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.wsgi import wrap_file
 import psycopg2
+from psycopg2.errors import QueryCanceled
 from psycopg2.extras import RealDictCursor
 
-from db import get_conn
+from db import get_conn, connection, pool_stats, query_log
+import log_queue
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics
+from password_hasher import HashQueueFullError, password_hasher
+from login_audit import create_writer as create_login_audit_writer
+from user_filter import UserExistenceFilter
+from station_search import StationSearchIndex
+from metro_repository import FileRepository
+from metro_cache import CITY_CODE_RE, MetroCache, encode_bytes, encode_payload
+from station_formats import (
+    MIMETYPES as STATION_MIMETYPES, STATION_COLUMNS, available_formats as available_station_formats,
+    build_columns, encode_arrow, encode_msgpack, negotiate_format as negotiate_station_format,
+)
+from shared_cache import SharedMetroCache
+from tile_cache import TileCache
+from geometry_utils import transform_geometry, zoom_to_tolerance
+from poi_index import PoiGridIndex, available as poi_index_available
+from route_planner import build_route_graph, clean_line_name, DEFAULT_K, MAX_K, DEFAULT_MAX_TRANSFERS
 
 
 app = Flask(__name__)
 CORS(app)  # 允许前端静态页跨域调用
 Compress(app)  # 启用 gzip 压缩，显著减少传输数据量
 
+# 日志经过队列由后台线程写出，请求线程不做同步 I/O（见 log_queue.py）
+log_queue.setup_logging()
+logger = logging.getLogger(__name__)
+
+# ========== 请求指标（GET /metrics）==========
+# endpoint 取路由规则（如 /api/metro/lines），不含具体参数，标签数量有限
+HTTP_REQUESTS = metrics.counter("http_requests_total", "请求数", ("endpoint", "method", "status"))
+HTTP_LATENCY = metrics.histogram("http_request_duration_seconds", "请求处理耗时（秒）", ("endpoint", "method"))
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "正在处理的请求数", ("endpoint",))
+
+
+def _record_request(status):
+    elapsed = time.perf_counter() - g._metrics_start
+    HTTP_LATENCY.observe(elapsed, endpoint=g._metrics_endpoint, method=request.method)
+    HTTP_REQUESTS.inc(endpoint=g._metrics_endpoint, method=request.method, status=status)
+    g._metrics_recorded = True
+
+
+@app.before_request
+def _metrics_before_request():
+    g._metrics_start = time.perf_counter()
+    g._metrics_endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g._metrics_recorded = False
+    HTTP_IN_FLIGHT.inc(endpoint=g._metrics_endpoint)
+
+
+@app.after_request
+def _metrics_after_request(resp):
+    if "_metrics_start" in g:
+        _record_request(resp.status_code)
+    return resp
+
+
+@app.teardown_request
+def _metrics_teardown_request(exc):
+    if "_metrics_start" not in g:
+        return
+    if not g._metrics_recorded:  # 未处理的异常不会经过 after_request
+        _record_request(500)
+    HTTP_IN_FLIGHT.dec(endpoint=g._metrics_endpoint)
+
+# ========== 数据来源 ==========
+# db：线路 / 站点 / POI 从 PostgreSQL 读取；file：从 frontend/data 中的文件读取（见 metro_repository.py），
+# 线路、站点、POI 列表和附近 POI 接口不访问数据库
+METRO_DATA_BACKEND = os.getenv("METRO_DATA_BACKEND", "db")
+METRO_DATA_DIR = os.getenv("METRO_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "..", "frontend", "data")
+file_repository = FileRepository(METRO_DATA_DIR) if METRO_DATA_BACKEND == "file" else None
+
 # ========== 数据缓存（提升性能）==========
-_metro_data_cache = {}
+# 数据集 -> 版本来源表；metro_line / metro_station / poi 有增删改时版本号变化，缓存自动刷新
+DATASET_TABLES = {"lines": "metro_line", "stations": "metro_station", "poi": "poi"}
+
+
+DATASET_VERSION_RECHECK = 60  # 秒，未建 dataset_version 表时隔多久再检查一次
+
+
+_dataset_version_table = {"ready": False, "checked_at": float("-inf")}
+
+
+def _run_version_query(sql, params, cur):
+    if cur is not None:
+        cur.execute(sql, params)
+        return cur.fetchone()
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as own_cur:
+        own_cur.execute(sql, params)
+        return own_cur.fetchone()
+
+
+def _has_dataset_version_table(cur):
+    state = _dataset_version_table
+    if state["ready"] or time.monotonic() - state["checked_at"] < DATASET_VERSION_RECHECK:
+        return state["ready"]
+    row = _run_version_query("SELECT to_regclass('dataset_version') IS NOT NULL AS ready", None, cur)
+    state["ready"], state["checked_at"] = bool(row["ready"]), time.monotonic()
+    if not state["ready"]:
+        logger.warning("[数据版本] 未找到 dataset_version 表，按行数和 xmin 计算版本（请执行 添加数据版本计数表.sql）")
+    return state["ready"]
+
+
+def fetch_dataset_version(dataset, city_code, cur=None):
+    """
+    读取某城市某数据集的版本号：dataset_version 表中由触发器维护的计数（见 添加数据版本计数表.sql），
+    单调递增，只读一行；该城市还没有数据时为 "0"。
+    未执行该脚本时退回 "行数:最大xmin"（xmin 会回绕、被 VACUUM FREEZE 改写，可能漏掉改动）。
+    文件模式下为数据文件的「修改时间:大小」。
+    """
+    if file_repository is not None:
+        return file_repository.version(dataset, city_code)
+    table = DATASET_TABLES[dataset]
+    if _has_dataset_version_table(cur):
+        row = _run_version_query(
+            "SELECT version FROM dataset_version WHERE table_name = %s AND city_code = %s",
+            (table, city_code), cur,
+        )
+        return str(row["version"]) if row else "0"
+    row = _run_version_query(
+        f"SELECT COUNT(*) AS n, COALESCE(MAX(xmin::text::bigint), 0) AS x FROM {table} WHERE city_code = %s",
+        (city_code,), cur,
+    )
+    return f"{row['n']}:{row['x']}"
+
+
+# (dataset, city, variant) -> EncodedPayload / RouteGraph；容量、过期时间、版本检查间隔可在 .env 配置
+# METRO_CACHE_BACKEND=shared 时预编码数据放在共享内存目录中，多个 worker 进程共用一份
+_cache_options = dict(
+    max_bytes=int(os.getenv("METRO_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=int(os.getenv("METRO_CACHE_TTL", "3600")),
+    version_interval=int(os.getenv("METRO_CACHE_VERSION_INTERVAL", "30")),
+    version_fn=fetch_dataset_version,
+)
+if os.getenv("METRO_CACHE_BACKEND", "memory") == "shared":
+    _metro_data_cache = SharedMetroCache(root=os.getenv("METRO_SHARED_CACHE_DIR") or None,
+                                         grace=int(os.getenv("METRO_SHARED_CACHE_GRACE", "60")), **_cache_options)
+else:
+    _metro_data_cache = MetroCache(**_cache_options)
 
 def format_ts(ts):
     """时间转字符串（本地时区，易读格式）。"""
@@ -37,6 +181,21 @@ def format_ts(ts):
     return str(ts)
 
 
+# 登录审计（last_login_at + user_login_log）异步批量写入，进程退出时写完队列中剩余的事件
+login_audit = create_login_audit_writer(connection)
+atexit.register(login_audit.close)
+
+PASSWORD_HASH_RETRY_AFTER = 2  # 哈希队列已满时建议客户端等待的秒数
+
+
+def hash_busy_response():
+    """密码哈希队列已满：快速返回 503，避免请求线程被堆积的哈希任务占满"""
+    resp = jsonify({"message": "登录请求较多，请稍后重试"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(PASSWORD_HASH_RETRY_AFTER)
+    return resp
+
+
 @app.route("/api/register", methods=["POST"])
 def register():
     data = request.get_json(silent=True) or {}
@@ -77,8 +236,8 @@ def register():
         if not safe_question:
             return jsonify({"message": "安全问题答案不能为空"}), 400
 
-        pwd_hash = generate_password_hash(password)
-        safe_question_hash = generate_password_hash(safe_question)  # 安全问题答案也加密存储
+        pwd_hash = password_hasher.hash(password)
+        safe_question_hash = password_hasher.hash(safe_question)  # 安全问题答案也加密存储
         cur.execute(
             """
             INSERT INTO app_user (username, password_hash, display_name, email, safe_question)
@@ -89,13 +248,16 @@ def register():
         )
         user = cur.fetchone()
         conn.commit()
+        user_filter.add(username, email)
 
         user["created_at"] = format_ts(user["created_at"])
         return jsonify({"message": "注册成功", **user}), 201
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[register] 错误: {e}")
+        logger.error(f"[register] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -131,27 +293,25 @@ def login():
         if not user or user["status"] != 1:
             return jsonify({"message": "用户不存在或已被停用"}), 401
 
-        if not check_password_hash(user["password_hash"], password):
+        if not password_hasher.verify(user["password_hash"], password):
             return jsonify({"message": "密码错误"}), 401
 
-        # 更新最后登录时间
-        cur.execute(
-            "UPDATE app_user SET last_login_at = NOW() WHERE user_id = %s",
-            (user["user_id"],),
-        )
+        # 存储的哈希使用的是旧算法 / 旧参数时，借这次登录的明文密码按当前配置重新哈希
+        if password_hasher.needs_rehash(user["password_hash"]):
+            try:
+                cur.execute(
+                    "UPDATE app_user SET password_hash = %s WHERE user_id = %s",
+                    (password_hasher.hash(password), user["user_id"]),
+                )
+                conn.commit()
+                password_hasher.mark_rehashed()
+            except HashQueueFullError:
+                pass  # 队列繁忙时不影响登录，下次登录再升级
 
-        # 记录登录日志
+        # 最后登录时间和登录日志交给后台线程批量写入，不占用本次请求的时间
         ip_addr = request.remote_addr
         ua = (request.headers.get("User-Agent") or "")[:500]
-        cur.execute(
-            """
-            INSERT INTO user_login_log (user_id, ip_address, user_agent)
-            VALUES (%s, %s, %s)
-            """,
-            (user["user_id"], ip_addr, ua),
-        )
-
-        conn.commit()
+        login_audit.record(user["user_id"], ip_addr, ua)
 
         resp = {
             "message": "登录成功",
@@ -161,10 +321,12 @@ def login():
             "email": user["email"],
         }
         return jsonify(resp), 200
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[login] 错误: {e}")
+        logger.error(f"[login] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -200,7 +362,7 @@ def profile():
         user["last_login_at"] = format_ts(user["last_login_at"])
         return jsonify(user), 200
     except Exception as e:
-        print(f"[profile] 错误: {e}")
+        logger.error(f"[profile] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -215,6 +377,31 @@ def logout():
     return jsonify({"message": "已退出登录"}), 200
 
 
+def load_user_identities(since_seconds=None):
+    """读取用户名和邮箱，供用户名 / 邮箱过滤器加载；since_seconds 时只读最近这么多秒内注册的用户"""
+    with connection() as conn, conn.cursor() as cur:
+        if since_seconds is None:
+            cur.execute("SELECT username, email FROM app_user")
+        else:
+            cur.execute(
+                "SELECT username, email FROM app_user WHERE created_at >= now() - make_interval(secs => %s)",
+                (since_seconds,),
+            )
+        return cur.fetchall()
+
+
+# 用户名 / 邮箱 Bloom filter：一定不存在时不查询数据库。
+# 只有一个进程写入用户时（USER_FILTER_SOLE_WRITER=1；python app.py 和单 worker 的 serve.py 自动设置）过滤器始终可用，
+# 否则距上次同步超过 USER_FILTER_MAX_STALENESS 秒时改为查询数据库
+user_filter = UserExistenceFilter(
+    load_user_identities,
+    fp_rate=float(os.getenv("USER_FILTER_FP_RATE", "0.01")),
+    refresh_interval=int(os.getenv("USER_FILTER_REFRESH", "300")),
+    sole_writer=os.getenv("USER_FILTER_SOLE_WRITER", "0") == "1",
+    max_staleness=float(os.getenv("USER_FILTER_MAX_STALENESS", "5")),
+)
+
+
 @app.route("/api/check_user", methods=["POST"])
 def check_user():
     """实时校验用户名 / 邮箱是否已存在，用于前端输入时提示。"""
@@ -225,6 +412,17 @@ def check_user():
     if not username and not email:
         return jsonify({"message": "缺少校验字段"}), 400
 
+    # 过滤器判断一定不存在的字段不再查询数据库
+    user_filter.ensure_loaded()
+    filter_used = user_filter.usable()
+    if filter_used:
+        if username and not user_filter.might_exist("u", username):
+            username = ""
+        if email and not user_filter.might_exist("e", email):
+            email = ""
+        if not username and not email:
+            return jsonify({"username_taken": False, "email_taken": False}), 200
+
     conn = cur = None
     try:
         conn = get_conn()
@@ -241,12 +439,15 @@ def check_user():
         rows = cur.fetchall()
         username_taken = any(r.get("username") == username for r in rows)
         email_taken = any(email and r.get("email") == email for r in rows)
+        if filter_used:
+            user_filter.record_false_positive(int(bool(username) and not username_taken)
+                                              + int(bool(email) and not email_taken))
         return jsonify({
-            "username_taken": username_taken,
-            "email_taken": email_taken
+            "username_taken": bool(username) and username_taken,
+            "email_taken": bool(email_taken)
         }), 200
     except Exception as e:
-        print(f"[check_user] 错误: {e}")
+        logger.error(f"[check_user] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -255,6 +456,12 @@ def check_user():
             conn.close()
 
 
+@app.route("/api/check_user/stats", methods=["GET"])
+def check_user_stats():
+    """用户名 / 邮箱过滤器状态（占用内存、估算误判率、实际观测的误判比例）"""
+    return jsonify(user_filter.stats()), 200
+
+
 @app.route("/api/get_security_question", methods=["GET"])
 def get_security_question():
     """获取用户的安全问题（用于忘记密码/修改密码页面）。"""
@@ -284,7 +491,7 @@ def get_security_question():
             "question": "你小学时期最喜欢的老师的名字是什么？"
         }), 200
     except Exception as e:
-        print(f"[get_security_question] 错误: {e}")
+        logger.error(f"[get_security_question] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -322,12 +529,14 @@ def verify_security_answer():
         if not user.get("safe_question"):
             return jsonify({"message": "用户未设置安全问题"}), 400
 
-        if not check_password_hash(user["safe_question"], answer):
+        if not password_hasher.verify(user["safe_question"], answer):
             return jsonify({"message": "安全问题答案错误"}), 401
 
         return jsonify({"message": "验证成功"}), 200
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
-        print(f"[verify_security_answer] 错误: {e}")
+        logger.error(f"[verify_security_answer] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -366,11 +575,11 @@ def reset_password():
         if not user.get("safe_question"):
             return jsonify({"message": "用户未设置安全问题"}), 400
 
-        if not check_password_hash(user["safe_question"], answer):
+        if not password_hasher.verify(user["safe_question"], answer):
             return jsonify({"message": "安全问题答案错误"}), 401
 
         # 更新密码
-        new_pwd_hash = generate_password_hash(new_password)
+        new_pwd_hash = password_hasher.hash(new_password)
         cur.execute(
             "UPDATE app_user SET password_hash = %s WHERE user_id = %s",
             (new_pwd_hash, user["user_id"]),
@@ -378,10 +587,12 @@ def reset_password():
         conn.commit()
 
         return jsonify({"message": "密码重置成功"}), 200
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[reset_password] 错误: {e}")
+        logger.error(f"[reset_password] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -420,11 +631,11 @@ def change_password():
         if not user.get("safe_question"):
             return jsonify({"message": "用户未设置安全问题"}), 400
 
-        if not check_password_hash(user["safe_question"], answer):
+        if not password_hasher.verify(user["safe_question"], answer):
             return jsonify({"message": "安全问题答案错误"}), 401
 
         # 更新密码
-        new_pwd_hash = generate_password_hash(new_password)
+        new_pwd_hash = password_hasher.hash(new_password)
         cur.execute(
             "UPDATE app_user SET password_hash = %s WHERE user_id = %s",
             (new_pwd_hash, user_id),
@@ -432,10 +643,12 @@ def change_password():
         conn.commit()
 
         return jsonify({"message": "密码修改成功"}), 200
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[change_password] 错误: {e}")
+        logger.error(f"[change_password] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -474,11 +687,11 @@ def change_security_answer():
         if not user.get("safe_question"):
             return jsonify({"message": "用户未设置安全问题"}), 400
 
-        if not check_password_hash(user["safe_question"], old_answer):
+        if not password_hasher.verify(user["safe_question"], old_answer):
             return jsonify({"message": "原安全问题答案错误"}), 401
 
         # 更新安全问题答案
-        new_answer_hash = generate_password_hash(new_answer)
+        new_answer_hash = password_hasher.hash(new_answer)
         cur.execute(
             "UPDATE app_user SET safe_question = %s WHERE user_id = %s",
             (new_answer_hash, user_id),
@@ -486,10 +699,12 @@ def change_security_answer():
         conn.commit()
 
         return jsonify({"message": "安全问题答案修改成功"}), 200
+    except HashQueueFullError:
+        return hash_busy_response()
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[change_security_answer] 错误: {e}")
+        logger.error(f"[change_security_answer] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -498,177 +713,590 @@ def change_security_answer():
             conn.close()
 
 
+METRO_CACHE_MAX_AGE = int(os.getenv("METRO_CACHE_MAX_AGE", "86400"))  # 浏览器缓存秒数
+
+# 多级细节：预热时按这些缩放级别生成简化后的线路（更大的缩放级别返回全精度几何）
+LINE_LOD_ZOOMS = tuple(sorted(int(z) for z in os.getenv("METRO_LINE_LOD_ZOOMS", "8,10,12").split(",") if z.strip()))
+LINE_PRECISION = int(os.getenv("METRO_LINE_PRECISION", "5"))  # 简化级别默认保留的小数位数（5 位约 1 米）
+LINE_MAX_PRECISION = 8
+LINE_MAX_ZOOM = 22  # zoom 参数的上限（2 ** zoom 过大时 zoom_to_tolerance 会溢出）
+
+# 查询线路数据（全精度），转换为 GeoJSON 格式；简化 / 量化在 build_lines_geojson 中完成
+METRO_LINES_SQL = """
+    SELECT 
+        line_id,
+        city_code,
+        line_name,
+        ST_AsGeoJSON(line_geom) as geometry,
+        properties
+    FROM metro_line
+    WHERE city_code = %s
+    ORDER BY line_name
+"""
+
+# 查询站点数据（包含line_number字段）
+METRO_STATIONS_SQL = """
+    SELECT 
+        station_id,
+        city_code,
+        station_name as name,
+        line_name as linename,
+        line_number,
+        lon,
+        lat,
+        station_num as num,
+        direction,
+        properties
+    FROM metro_station
+    WHERE city_code = %s
+    ORDER BY line_name, station_num
+"""
+
+
+@contextmanager
+def metro_cursor():
+    """读取线路 / 站点数据用的游标；文件模式下不需要数据库连接，得到 None"""
+    if file_repository is not None:
+        yield None
+        return
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        yield cur
+
+
+def fetch_metro_rows(cur, dataset, city_code):
+    """线路 / 站点的查询结果（METRO_LINES_SQL / METRO_STATIONS_SQL）；文件模式下为字段相同的行"""
+    if file_repository is not None:
+        return file_repository.lines(city_code) if dataset == "lines" else file_repository.stations(city_code)
+    cur.execute(METRO_LINES_SQL if dataset == "lines" else METRO_STATIONS_SQL, (city_code,))
+    return cur.fetchall()
+
+
+def extract_line_number(line_name):
+    """从线路名称提取编号，如 '1号线' -> 1, 'S1号线' -> 'S1'（line_number为空时使用）"""
+    if not line_name:
+        return 0
+    # 匹配 S1, S2 等
+    match = re.search(r'(S\d+)', line_name)
+    if match:
+        return match.group(1)
+    # 匹配普通数字
+    match = re.search(r'(\d+)', line_name)
+    if match:
+        return int(match.group(1))
+    return 0
+
+
+def build_lines_geojson(lines, tolerance=0.0, precision=None, compact=False):
+    """
+    metro_line 查询结果 -> GeoJSON FeatureCollection
+    precision 为 None 时原样输出全精度几何；否则按 tolerance 简化、保留 precision 位小数，
+    compact=True 时坐标为差分编码的整数数组（见 geometry_utils.delta_encode）
+    """
+    features = []
+    for line in lines:
+        geometry = json.loads(line["geometry"]) if line["geometry"] else None
+        if precision is not None:
+            geometry = transform_geometry(geometry, tolerance, precision, compact)
+        feature = {
+            "type": "Feature",
+            "properties": {
+                "name": line["line_name"],
+                "line_id": line["line_id"],
+                **(line["properties"] or {})
+            },
+            "geometry": geometry
+        }
+        features.append(feature)
+    result = {
+        "type": "FeatureCollection",
+        "features": features
+    }
+    if compact:
+        result["encoding"] = {"type": "delta", "precision": precision}
+    return result
+
+
+def _station_record(station):
+    """metro_station 查询结果的一行 -> 前端字段（name / linename / lon / lat / num / direction / x）"""
+    # 优先使用数据库中的line_number，否则从line_name提取
+    line_num = station.get("line_number")
+    if line_num:
+        # 尝试转为整数（如果是纯数字）
+        try:
+            x = int(line_num)
+        except (ValueError, TypeError):
+            x = line_num  # 保持字符串如 "S1"
+    else:
+        x = extract_line_number(station["linename"])
+    return {
+        "name": station["name"],
+        "linename": station["linename"],
+        "lon": float(station["lon"]),
+        "lat": float(station["lat"]),
+        "num": station["num"],
+        "direction": station["direction"],
+        "x": x,  # 线路编号（关键字段！用于路径规划）
+    }
+
+
+def build_stations_result(stations):
+    """metro_station 查询结果 -> 前端原格式（各字段按 str(idx * 2) 索引）"""
+    result = {col: {} for col in STATION_COLUMNS}
+    for idx, station in enumerate(stations):
+        str_idx = str(idx * 2)  # 保持原格式的索引方式
+        for col, value in _station_record(station).items():
+            result[col][str_idx] = value
+    return result
+
+
+def encode_station_format(stations, fmt):
+    """生成列式格式（columnar / msgpack / arrow）的站点数据，返回 EncodedPayload"""
+    data = build_columns([_station_record(s) for s in stations])
+    meta = {"count": len(stations), "format": fmt, "mimetype": STATION_MIMETYPES[fmt]}
+    if fmt == "columnar":
+        return encode_payload(data, meta=meta)
+    return encode_bytes(encode_msgpack(data) if fmt == "msgpack" else encode_arrow(data), meta=meta)
+
+
+def precompute_station_formats(stations, city_code, version):
+    """预热时用同一份查询结果生成所有可用的列式格式"""
+    for fmt in available_station_formats():
+        _metro_data_cache.put("stations", city_code, encode_station_format(stations, fmt),
+                              version=version, variant=fmt)
+
+
+def load_lines_payload(cur, city_code):
+    """查询并编码线路数据，返回 (EncodedPayload, 查询结果)"""
+    lines = fetch_metro_rows(cur, "lines", city_code)
+    return encode_payload(build_lines_geojson(lines), meta={"count": len(lines)}), lines
+
+
+def lines_variant(lod, precision, compact):
+    """线路缓存的 variant 名，如 "10:p6:compact"（不带参数的全精度数据 variant 为空串）"""
+    return f"{lod}:p{precision}:{'compact' if compact else 'geojson'}"
+
+
+def resolve_line_lod(zoom=None, tolerance=None):
+    """
+    缩放级别 / 容差 -> 预设的细节级别（LINE_LOD_ZOOMS 中的某一级或 "full"）。
+    取简化容差不超过所需容差的最粗一级，保证不会比请求的更粗糙。
+    """
+    if tolerance is None:
+        tolerance = zoom_to_tolerance(zoom)
+    for lod in LINE_LOD_ZOOMS:
+        if zoom_to_tolerance(lod) <= tolerance:
+            return lod
+    return "full"
+
+
+def encode_line_lod(lines, lod, precision, compact):
+    """生成某个细节级别的线路数据，返回 EncodedPayload"""
+    tolerance = 0.0 if lod == "full" else zoom_to_tolerance(lod)
+    data = build_lines_geojson(lines, tolerance, precision, compact)
+    return encode_payload(data, meta={"count": len(lines), "lod": lod, "precision": precision})
+
+
+def precompute_line_lods(lines, city_code, version):
+    """预热时用同一份查询结果生成所有细节级别（GeoJSON 和差分编码两种格式）"""
+    for lod in (*LINE_LOD_ZOOMS, "full"):
+        for compact in (False, True):
+            payload = encode_line_lod(lines, lod, LINE_PRECISION, compact)
+            _metro_data_cache.put("lines", city_code, payload, version=version,
+                                  variant=lines_variant(lod, LINE_PRECISION, compact))
+
+
+def load_stations_payload(cur, city_code):
+    """查询并编码站点数据，返回 (EncodedPayload, 查询结果)"""
+    stations = fetch_metro_rows(cur, "stations", city_code)
+    return encode_payload(build_stations_result(stations), meta={"count": len(stations)}), stations
+
+
+def payload_response(payload):
+    """
+    直接返回预编码的字节：
+    - If-None-Match 命中 -> 304；
+    - 否则按 Accept-Encoding 选择 br / gzip / identity，设置 Content-Encoding 后 Flask-Compress 不会再压缩。
+    """
+    encoding, body = payload.choose(request.headers.get("Accept-Encoding"))
+    mimetype = payload.meta.get("mimetype", "application/json")
+    if payload.matches(request.headers.get("If-None-Match")):
+        resp = Response(status=304)
+    else:
+        if isinstance(body, str):
+            # 共享缓存：body 是文件路径，交给 WSGI 服务器的 file_wrapper 发送（gunicorn 下为 sendfile）
+            resp = Response(wrap_file(request.environ, open(body, "rb")),
+                            mimetype=mimetype, direct_passthrough=True)
+            resp.content_length = payload.sizes[encoding]
+        else:
+            resp = Response(body, mimetype=mimetype)
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+    resp.headers["ETag"] = payload.etag_for(encoding)
+    resp.headers["Cache-Control"] = f"public, max-age={METRO_CACHE_MAX_AGE}"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+def _load_into_cache(cur, dataset, city_code):
+    """查询数据库并写入缓存（连同当时的数据版本），返回 EncodedPayload；线路数据同时生成各细节级别，站点数据同时生成各列式格式"""
+    version = fetch_dataset_version(dataset, city_code, cur)
+    if dataset == "lines":
+        payload, lines = load_lines_payload(cur, city_code)
+        precompute_line_lods(lines, city_code, version)
+    else:
+        payload, stations = load_stations_payload(cur, city_code)
+        precompute_station_formats(stations, city_code, version)
+    _metro_data_cache.put(dataset, city_code, payload, version=version)
+    logger.info(f"[缓存更新] {dataset}: {city_code}, 共{payload.meta['count']}条")
+    return payload
+
+
+# (dataset, city) -> 构建锁：同一份数据同时只有一个线程查库、压缩，其他线程等它完成后直接读缓存
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def _load_once(dataset, city_code, cur=None):
+    """
+    带单飞保护的 _load_into_cache：拿到锁的线程负责构建；
+    等过锁的线程先读缓存，别人刚构建好就直接返回，构建失败时再自己构建。
+    不传 cur 时拿到锁后才借数据库连接，等待期间不占连接池。
+    """
+    with _build_locks_guard:
+        lock = _build_locks.setdefault((dataset, city_code), threading.Lock())
+    waited = not lock.acquire(blocking=False)
+    if waited:
+        lock.acquire()
+    try:
+        if waited:
+            payload = _metro_data_cache.get(dataset, city_code)
+            if payload is not None:
+                return payload
+        if cur is not None:
+            return _load_into_cache(cur, dataset, city_code)
+        with metro_cursor() as own_cur:
+            return _load_into_cache(own_cur, dataset, city_code)
+    finally:
+        lock.release()
+
+
+def _cached_metro_payload(dataset, city_code):
+    """读缓存，未命中 / 过期 / 数据版本变化时查询数据库并写入缓存"""
+    payload = _metro_data_cache.get(dataset, city_code)
+    if payload is not None:
+        return payload
+    return _load_once(dataset, city_code)
+
+
+def _cached_line_lod(city_code, lod, precision, compact):
+    """读取某个细节级别的线路数据；未预计算的组合（如非默认小数位数）按需生成并缓存"""
+    variant = lines_variant(lod, precision, compact)
+    payload = _metro_data_cache.get("lines", city_code, variant)
+    if payload is not None:
+        return payload
+
+    if precision == LINE_PRECISION:
+        _load_once("lines", city_code)
+        payload = _metro_data_cache.get("lines", city_code, variant)
+        if payload is not None:
+            return payload
+    with metro_cursor() as cur:
+        version = fetch_dataset_version("lines", city_code, cur)
+        lines = fetch_metro_rows(cur, "lines", city_code)
+    payload = encode_line_lod(lines, lod, precision, compact)
+    _metro_data_cache.put("lines", city_code, payload, version=version, variant=variant)
+    return payload
+
+
 @app.route("/api/metro/lines", methods=["GET"])
 def get_metro_lines():
-    """获取地铁线路数据（GeoJSON格式，带缓存优化）"""
+    """
+    获取地铁线路数据（GeoJSON格式，缓存预编码字节 + ETag）
+
+    - 不带参数：全精度几何（兼容旧前端）
+    - ?zoom=N 或 ?tolerance=度：返回对应细节级别的简化几何
+    - ?precision=N：坐标小数位数（默认 METRO_LINE_PRECISION）
+    - ?format=compact：坐标差分编码为整数数组，前端用 decodeCompactLines 还原
+    """
     city_code = request.args.get("city", "nj")
-    
-    # 【性能优化】检查缓存
-    cache_key = f"lines_{city_code}"
-    if cache_key in _metro_data_cache:
-        print(f"[缓存命中] 线路数据: {city_code}")
-        return jsonify(_metro_data_cache[cache_key]), 200
-    
-    conn = cur = None
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    zoom = request.args.get("zoom", type=int)
+    tolerance = request.args.get("tolerance", type=float)
+    precision = request.args.get("precision", type=int)
+    line_format = request.args.get("format", "geojson")
+
+    if line_format not in ("geojson", "compact"):
+        return jsonify({"message": f"不支持的格式: {line_format}"}), 400
+    if precision is not None and not 0 <= precision <= LINE_MAX_PRECISION:
+        return jsonify({"message": f"precision 取值范围为 0-{LINE_MAX_PRECISION}"}), 400
+    if zoom is not None and not 0 <= zoom <= LINE_MAX_ZOOM:
+        return jsonify({"message": f"zoom 取值范围为 0-{LINE_MAX_ZOOM}"}), 400
+    if tolerance is not None and not (math.isfinite(tolerance) and tolerance >= 0):
+        return jsonify({"message": "tolerance 须为非负数"}), 400
+
     try:
-        conn = get_conn()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 查询线路数据，转换为 GeoJSON 格式
-        # 使用 ST_SimplifyPreserveTopology 简化复杂几何（可选，如需进一步优化可启用）
-        cur.execute("""
-            SELECT 
-                line_id,
-                city_code,
-                line_name,
-                ST_AsGeoJSON(line_geom) as geometry,
-                properties
-            FROM metro_line
-            WHERE city_code = %s
-            ORDER BY line_name
-        """, (city_code,))
-        
-        lines = cur.fetchall()
-        
-        # 构建 GeoJSON FeatureCollection
-        features = []
-        for line in lines:
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "name": line["line_name"],
-                    "line_id": line["line_id"],
-                    **(line["properties"] or {})
-                },
-                "geometry": json.loads(line["geometry"]) if line["geometry"] else None
-            }
-            features.append(feature)
-        
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features
-        }
-        
-        # 【性能优化】存入缓存
-        _metro_data_cache[cache_key] = geojson
-        print(f"[缓存更新] 线路数据: {city_code}, 共{len(lines)}条线路")
-        
-        return jsonify(geojson), 200
-        
+        if zoom is None and tolerance is None and precision is None and line_format == "geojson":
+            return payload_response(_cached_metro_payload("lines", city_code))
+
+        lod = "full" if zoom is None and tolerance is None else resolve_line_lod(zoom, tolerance)
+        precision = LINE_PRECISION if precision is None else precision
+        return payload_response(_cached_line_lod(city_code, lod, precision, line_format == "compact"))
     except Exception as e:
-        print(f"[get_metro_lines] 错误: {e}")
+        logger.error(f"[get_metro_lines] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+
+
+def _cached_station_format(city_code, fmt):
+    """读取某种列式格式的站点数据，未命中时重新加载站点数据（同时生成所有格式）"""
+    payload = _metro_data_cache.get("stations", city_code, fmt)
+    if payload is not None:
+        return payload
+
+    _load_once("stations", city_code)
+    payload = _metro_data_cache.get("stations", city_code, fmt)
+    if payload is not None:
+        return payload
+    # 缓存容量不足等情况下未能留在缓存中，直接生成
+    with metro_cursor() as cur:
+        return encode_station_format(fetch_metro_rows(cur, "stations", city_code), fmt)
 
 
 @app.route("/api/metro/stations", methods=["GET"])
 def get_metro_stations():
-    """获取地铁站点数据（带缓存优化）"""
+    """
+    获取地铁站点数据（缓存预编码字节 + ETag）
+
+    - 默认：旧格式，各字段按 str(idx * 2) 索引（兼容 formatStopData）
+    - ?format=columnar：每个字段一个数组，前端用 decodeColumnarStations 还原为旧格式
+    - ?format=msgpack / ?format=arrow，或 Accept: application/msgpack / application/vnd.apache.arrow.stream：
+      列式数据的二进制编码（需要安装 msgpack / pyarrow）
+    """
     city_code = request.args.get("city", "nj")
-    
-    # 【性能优化】检查缓存
-    cache_key = f"stations_{city_code}"
-    if cache_key in _metro_data_cache:
-        print(f"[缓存命中] 站点数据: {city_code}")
-        return jsonify(_metro_data_cache[cache_key]), 200
-    
-    conn = cur = None
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
     try:
-        conn = get_conn()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 查询站点数据（包含line_number字段）
-        cur.execute("""
-            SELECT 
-                station_id,
-                city_code,
-                station_name as name,
-                line_name as linename,
-                line_number,
-                lon,
-                lat,
-                station_num as num,
-                direction,
-                properties
-            FROM metro_station
-            WHERE city_code = %s
-            ORDER BY line_name, station_num
-        """, (city_code,))
-        
-        stations = cur.fetchall()
-        
-        # 从线路名称提取线路编号的辅助函数（备用，当line_number为空时使用）
-        def extract_line_number(line_name):
-            """从线路名称提取编号，如 '1号线' -> 1, 'S1号线' -> 'S1'"""
-            import re
-            if not line_name:
-                return 0
-            # 匹配 S1, S2 等
-            match = re.search(r'(S\d+)', line_name)
-            if match:
-                return match.group(1)
-            # 匹配普通数字
-            match = re.search(r'(\d+)', line_name)
-            if match:
-                return int(match.group(1))
-            return 0
-        
-        # 转换为原格式（兼容前端）
-        result = {
-            "name": {},
-            "linename": {},
-            "lon": {},
-            "lat": {},
-            "num": {},
-            "direction": {},
-            "x": {}  # 线路编号（关键字段！用于路径规划）
-        }
-        
-        for idx, station in enumerate(stations):
-            str_idx = str(idx * 2)  # 保持原格式的索引方式
-            result["name"][str_idx] = station["name"]
-            result["linename"][str_idx] = station["linename"]
-            result["lon"][str_idx] = float(station["lon"])
-            result["lat"][str_idx] = float(station["lat"])
-            result["num"][str_idx] = station["num"]
-            result["direction"][str_idx] = station["direction"]
-            # 优先使用数据库中的line_number，否则从line_name提取
-            line_num = station.get("line_number")
-            if line_num:
-                # 尝试转为整数（如果是纯数字）
-                try:
-                    result["x"][str_idx] = int(line_num)
-                except (ValueError, TypeError):
-                    result["x"][str_idx] = line_num  # 保持字符串如 "S1"
-            else:
-                result["x"][str_idx] = extract_line_number(station["linename"])
-        
-        # 【性能优化】存入缓存
-        _metro_data_cache[cache_key] = result
-        print(f"[缓存更新] 站点数据: {city_code}, 共{len(stations)}条")
-        
-        return jsonify(result), 200
-        
+        fmt = negotiate_station_format(request.args.get("format"), request.headers.get("Accept"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        if fmt is None:
+            resp = payload_response(_cached_metro_payload("stations", city_code))
+        else:
+            resp = payload_response(_cached_station_format(city_code, fmt))
+        # 同一 URL 可能按 Accept 返回不同格式
+        resp.headers["Vary"] = "Accept, Accept-Encoding"
+        return resp
     except Exception as e:
-        print(f"[get_metro_stations] 错误: {e}")
+        logger.error(f"[get_metro_stations] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+
+
+POI_COLUMNS = """
+    external_id as id,
+    poi_name as name,
+    poi_type as type,
+    type_code,
+    search_type,
+    lon,
+    lat,
+    address,
+    tel,
+    business_area,
+    properties
+"""
+POI_PAGE_MAX = 5000  # 分页模式单页上限
+POI_STREAM_BATCH = 2000  # 流式模式每批从服务端游标取出的行数
+
+
+def _poi_row(poi):
+    """POI 行转为前端格式（合并 properties 到主对象）"""
+    poi_dict = dict(poi)
+    if poi_dict.get('properties'):
+        props = poi_dict.pop('properties')
+        poi_dict.update(props)
+    return poi_dict
+
+
+def _json_default(value):
+    """json.dumps 兜底：Decimal 等数值类型转 float，其余转字符串"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _encode_poi_cursor(poi):
+    raw = json.dumps([poi["name"], poi["id"]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_poi_cursor(token):
+    name, poi_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    return name, poi_id
+
+
+def _get_poi_page(city_code, poi_type, limit, cursor):
+    """分页模式：按 (poi_name, external_id) 键集分页，每页只扫描 limit 行"""
+    where = ["city_code = %s"]
+    params = [city_code]
+    if poi_type:
+        where.append("poi_type = %s")
+        params.append(poi_type)
+    if cursor:
+        where.append("(poi_name, external_id) > (%s, %s)")
+        params.extend(_decode_poi_cursor(cursor))
+    params.append(limit + 1)
+
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT {POI_COLUMNS}
+            FROM poi
+            WHERE {" AND ".join(where)}
+            ORDER BY poi_name, external_id
+            LIMIT %s
+        """, params)
+        rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "pois": [_poi_row(r) for r in rows],
+        "next_cursor": _encode_poi_cursor(rows[-1]) if has_more else None,
+    }
+
+
+def _ndjson_chunks(batches, use_gzip):
+    """
+    每批 POI 行编码为 NDJSON，use_gzip 时压缩（每批同步刷新，客户端可以边收边解压）。
+    状态码在第一批数据之前就已发出，所以最后一行固定为结束标记：
+    成功时为 {"done": true, "count": N}，中途出错时为 {"error": "...", "count": 已输出条数}；
+    客户端没有收到 done 行即说明数据不完整。
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+
+    def encode(text):
+        chunk = text.encode("utf-8")
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    count = 0
+    try:
+        for rows in batches:
+            yield encode("".join(
+                json.dumps(_poi_row(r), ensure_ascii=False, default=_json_default) + "\n"
+                for r in rows
+            ))
+            count += len(rows)
+        tail = {"done": True, "count": count}
+    except Exception as e:
+        logger.error(f"[get_poi_data] 流式输出错误: {e}")
+        tail = {"error": "服务器错误，数据不完整", "count": count}
+    yield encode(json.dumps(tail, ensure_ascii=False) + "\n")
+    if compressor:
+        yield compressor.flush()
+
+
+def _stream_poi_ndjson(city_code, poi_type, use_gzip):
+    """流式模式：服务端命名游标分批取数，每行输出一个 JSON（NDJSON），内存占用与城市规模无关"""
+    def batches():
+        # 取连接、查询都在生成器里：出错时由 _ndjson_chunks 输出 error 结束行
+        with connection() as conn, conn.cursor(name="poi_stream", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = POI_STREAM_BATCH
+            sql = f"SELECT {POI_COLUMNS} FROM poi WHERE city_code = %s"
+            params = [city_code]
+            if poi_type:
+                sql += " AND poi_type = %s"
+                params.append(poi_type)
+            cur.execute(sql + " ORDER BY poi_name, external_id", params)
+            while True:
+                rows = cur.fetchmany(POI_STREAM_BATCH)
+                if not rows:
+                    return
+                yield rows
+
+    yield from _ndjson_chunks(batches(), use_gzip)
+
+
+def _poi_from_files(city_code, poi_type):
+    """文件模式下的 /api/poi：与数据库模式相同的三种返回方式，数据来自内存中已排序的 POI"""
+    index = file_repository.pois(city_code)
+    if request.args.get("format") == "ndjson":
+        rows = index.select(poi_type)
+        use_gzip = "gzip" in (request.headers.get("Accept-Encoding") or "")
+        batches = (rows[i:i + POI_STREAM_BATCH] for i in range(0, len(rows), POI_STREAM_BATCH))
+        resp = Response(_ndjson_chunks(batches, use_gzip), mimetype="application/x-ndjson")
+        if use_gzip:
+            resp.headers["Content-Encoding"] = "gzip"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    limit = request.args.get("limit", type=int)
+    if limit:
+        limit = min(max(limit, 1), POI_PAGE_MAX)
+        cursor = request.args.get("cursor")
+        try:
+            rows = index.page(poi_type, limit, _decode_poi_cursor(cursor) if cursor else None)
+        except (ValueError, TypeError):
+            return jsonify({"message": "cursor 参数无效"}), 400
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return jsonify({
+            "pois": [_poi_row(r) for r in rows],
+            "next_cursor": _encode_poi_cursor(rows[-1]) if has_more else None,
+        }), 200
+
+    return jsonify({"pois": [_poi_row(r) for r in index.select(poi_type)]}), 200
 
 
 @app.route("/api/poi", methods=["GET"])
 def get_poi_data():
-    """获取POI数据"""
+    """
+    获取POI数据
+
+    - 默认：一次性返回 {"pois": [...]}（兼容旧前端）
+    - ?format=ndjson：流式返回，每行一个POI，首字节立即发出；最后一行为 {"done": true, "count": N}
+      （中途出错时为 {"error": ..., "count": N}）
+    - ?limit=N[&cursor=...]：键集分页，返回 {"pois": [...], "next_cursor": ...}
+    """
     city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
     poi_type = request.args.get("type")  # 可选：按类型筛选
-    
+
+    if file_repository is not None:
+        try:
+            return _poi_from_files(city_code, poi_type)
+        except Exception as e:
+            logger.error(f"[get_poi_data] 错误: {e}")
+            return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+    if request.args.get("format") == "ndjson":
+        use_gzip = "gzip" in (request.headers.get("Accept-Encoding") or "")
+        resp = Response(_stream_poi_ndjson(city_code, poi_type, use_gzip),
+                        mimetype="application/x-ndjson")
+        if use_gzip:
+            resp.headers["Content-Encoding"] = "gzip"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    limit = request.args.get("limit", type=int)
+    if limit:
+        try:
+            page = _get_poi_page(city_code, poi_type, min(max(limit, 1), POI_PAGE_MAX),
+                                 request.args.get("cursor"))
+            return jsonify(page), 200
+        except (ValueError, TypeError):
+            return jsonify({"message": "cursor 参数无效"}), 400
+        except Exception as e:
+            logger.error(f"[get_poi_data] 错误: {e}")
+            return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
     conn = cur = None
     try:
         conn = get_conn()
@@ -715,14 +1343,7 @@ def get_poi_data():
         pois = cur.fetchall()
         
         # 转换格式（兼容前端）
-        result_pois = []
-        for poi in pois:
-            poi_dict = dict(poi)
-            # 合并 properties 到主对象
-            if poi_dict.get('properties'):
-                props = poi_dict.pop('properties')
-                poi_dict.update(props)
-            result_pois.append(poi_dict)
+        result_pois = [_poi_row(poi) for poi in pois]
         
         result = {
             "pois": result_pois
@@ -731,7 +1352,7 @@ def get_poi_data():
         return jsonify(result), 200
         
     except Exception as e:
-        print(f"[get_poi_data] 错误: {e}")
+        logger.error(f"[get_poi_data] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -740,51 +1361,115 @@ def get_poi_data():
             conn.close()
 
 
+POI_NEARBY_LIMIT = 500
+POI_NEARBY_MAX_RADIUS = int(os.getenv("POI_NEARBY_MAX_RADIUS", "5000"))  # 米
+POI_NEARBY_FIELDS = ("id", "name", "type", "type_code", "lon", "lat", "address", "tel", "business_area")
+POI_NEARBY_BACKEND = os.getenv("POI_NEARBY_BACKEND", "db")  # db：PostGIS 查询；memory：进程内网格索引
+POI_GRID_CELL_DEG = float(os.getenv("POI_GRID_CELL_DEG", "0.005"))
+
+# 先用 location && 查询点外扩的矩形（可走 location 上的 GiST 索引）筛出候选，
+# 再用 geography 计算精确距离；不在 WHERE 中对列做 ::geography 转换，否则索引无法使用
+POI_NEARBY_SQL = """
+    WITH q AS (SELECT ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326) AS pt)
+    SELECT
+        external_id as id,
+        poi_name as name,
+        poi_type as type,
+        type_code,
+        lon,
+        lat,
+        address,
+        tel,
+        business_area,
+        ST_Distance(location::geography, q.pt::geography) as distance
+    FROM poi, q
+    WHERE city_code = %(city)s
+        AND location && ST_Expand(q.pt, %(d_lon)s, %(d_lat)s)
+        AND ST_DWithin(location::geography, q.pt::geography, %(radius)s)
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+
+def get_poi_index(city_code):
+    """获取城市的内存 POI 网格索引（首次使用时从 poi 表构建，poi 表有改动后自动重建）"""
+    index = _metro_data_cache.get("poi", city_code, variant="grid")
+    if index is not None:
+        return index
+
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        version = fetch_dataset_version("poi", city_code, cur)
+        cur.execute("""
+            SELECT external_id as id, poi_name as name, poi_type as type, type_code,
+                   lon, lat, address, tel, business_area
+            FROM poi WHERE city_code = %s AND lon IS NOT NULL AND lat IS NOT NULL
+        """, (city_code,))
+        rows = cur.fetchall()
+
+    t0 = time.perf_counter()
+    index = PoiGridIndex(rows, cell_deg=POI_GRID_CELL_DEG)
+    _metro_data_cache.put("poi", city_code, index, version=version, variant="grid", size=index.approx_size)
+    logger.info(f"[POI索引] {city_code}: {len(index)}个POI, 耗时{(time.perf_counter() - t0) * 1000:.1f}ms")
+    return index
+
+
+def _nearby_from_index(city_code, lon, lat, radius):
+    result_pois = []
+    for row, distance in get_poi_index(city_code).query_radius(lon, lat, radius, POI_NEARBY_LIMIT):
+        poi_dict = dict(row)
+        poi_dict['distance'] = round(distance, 2)
+        result_pois.append(poi_dict)
+    return result_pois
+
+
 @app.route("/api/poi/nearby", methods=["GET"])
 def get_nearby_poi():
-    """获取站点附近的POI（使用PostGIS空间查询）"""
+    """获取站点附近的POI（PostGIS 索引 + 精确距离，或 POI_NEARBY_BACKEND=memory 时使用内存网格索引）"""
     city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
     lon = request.args.get("lon", type=float)
     lat = request.args.get("lat", type=float)
     radius = request.args.get("radius", 300, type=int)  # 半径（米）
     
     if not lon or not lat:
         return jsonify({"message": "缺少经纬度参数"}), 400
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        return jsonify({"message": "经纬度超出范围"}), 400
+    if not 0 < radius <= POI_NEARBY_MAX_RADIUS:
+        return jsonify({"message": f"radius 取值范围为 1-{POI_NEARBY_MAX_RADIUS} 米"}), 400
+
+    if file_repository is not None:
+        try:
+            result_pois = [
+                {**{k: row[k] for k in POI_NEARBY_FIELDS}, "distance": round(distance, 2)}
+                for row, distance in file_repository.pois(city_code).nearby(lon, lat, radius, POI_NEARBY_LIMIT)
+            ]
+            return jsonify({"pois": result_pois, "total": len(result_pois)}), 200
+        except Exception as e:
+            logger.error(f"[get_nearby_poi] 错误: {e}")
+            return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+    if POI_NEARBY_BACKEND == "memory" and poi_index_available():
+        try:
+            result_pois = _nearby_from_index(city_code, lon, lat, radius)
+            return jsonify({"pois": result_pois, "total": len(result_pois)}), 200
+        except Exception as e:
+            logger.warning(f"[get_nearby_poi] 内存索引查询失败，改用数据库: {e}")
     
     conn = cur = None
     try:
         conn = get_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 使用 PostGIS 的 ST_DWithin 进行空间查询
-        # ST_DWithin 的第三个参数是距离，需要转换为度（大约1度≈111km）
-        radius_degrees = radius / 111000.0
-        
-        cur.execute("""
-            SELECT 
-                external_id as id,
-                poi_name as name,
-                poi_type as type,
-                type_code,
-                lon,
-                lat,
-                address,
-                tel,
-                business_area,
-                ST_Distance(
-                    location::geography, 
-                    ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-                ) as distance
-            FROM poi
-            WHERE city_code = %s
-                AND ST_DWithin(
-                    location::geography,
-                    ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
-                    %s
-                )
-            ORDER BY distance
-            LIMIT 500
-        """, (lon, lat, city_code, lon, lat, radius))
+
+        # 外扩矩形的半边长（度）：纬度方向 1 度约 111.32km，经度方向再除以 cos(纬度)，略放大保证不漏
+        d_lat = radius / 111320.0 * 1.01
+        d_lon = d_lat / max(math.cos(math.radians(lat)), 0.01)
+        cur.execute(POI_NEARBY_SQL, {
+            "lon": lon, "lat": lat, "city": city_code, "radius": radius,
+            "d_lon": d_lon, "d_lat": d_lat, "limit": POI_NEARBY_LIMIT,
+        })
         
         pois = cur.fetchall()
         
@@ -797,9 +1482,7 @@ def get_nearby_poi():
         return jsonify({"pois": result_pois, "total": len(result_pois)}), 200
         
     except Exception as e:
-        print(f"[get_nearby_poi] 错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"[get_nearby_poi] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -808,8 +1491,452 @@ def get_nearby_poi():
             conn.close()
 
 
+# ========== POI 搜索 ==========
+POI_SEARCH_DEFAULT_LIMIT = 20
+POI_SEARCH_PAGE_MAX = 100  # 单页上限
+POI_SEARCH_MAX_RESULTS = int(os.getenv("POI_SEARCH_MAX_RESULTS", "1000"))  # 一次搜索最多可翻到的结果数
+POI_SEARCH_TIMEOUT_MS = int(os.getenv("POI_SEARCH_TIMEOUT_MS", "2000"))  # 单次查询的 statement_timeout
+POI_SEARCH_MAX_RADIUS = 20000  # 米
+
+# 被搜索的文本，与 添加POI搜索索引.sql 中 GIN(gin_trgm_ops) 表达式索引的表达式保持一致，否则索引无法使用
+POI_SEARCH_TEXT = "(poi_name || ' ' || coalesce(address, '') || ' ' || coalesce(business_area, ''))"
+
+# 排序：名称完全相同 > 名称前缀 > 名称包含 > 仅地址 / 商圈包含，同一级别中名称相似度高的优先
+POI_SEARCH_RANK = """
+    CASE WHEN poi_name = %(q)s THEN 0
+         WHEN poi_name ILIKE %(prefix)s THEN 1
+         WHEN poi_name ILIKE %(like)s THEN 2
+         ELSE 3 END
+"""
+
+
+def _like_escape(text):
+    """转义 LIKE 中的通配符"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _encode_search_cursor(row, seen):
+    raw = json.dumps([row["rank"], str(row["score"]), row["id"], seen]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_search_cursor(token):
+    rank, score, poi_id, seen = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    return int(rank), str(score), poi_id, int(seen)
+
+
+def _parse_bbox(value):
+    """bbox=minLon,minLat,maxLon,maxLat"""
+    min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(","))
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError("bbox 范围无效")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def search_poi(city_code, query, limit, cursor=None, fuzzy=False, poi_type=None,
+               center=None, radius=None, bbox=None):
+    """
+    POI 关键字搜索，返回 {"pois", "next_cursor", "truncated"}。
+
+    - 名称 / 地址 / 商圈包含关键字（ILIKE），fuzzy=True 时改为按词相似度（<%）匹配，容忍错别字；
+      两者都走 POI_SEARCH_TEXT 上的 trigram 索引；
+    - center=(lon, lat) 且给出 radius（米）时只返回范围内的 POI 并附带 distance，bbox 限定矩形范围；
+    - 按 (rank, score DESC, id) 键集分页，cursor 中记录已返回的条数，超过 POI_SEARCH_MAX_RESULTS 后不再翻页。
+    """
+    params = {
+        "city": city_code, "q": query,
+        "like": f"%{_like_escape(query)}%", "prefix": f"{_like_escape(query)}%",
+    }
+    where = ["city_code = %(city)s"]
+    if fuzzy:
+        where.append(f"%(q)s <%% {POI_SEARCH_TEXT}")
+        score = "round(word_similarity(%(q)s, poi_name)::numeric, 4)"
+    else:
+        where.append(f"{POI_SEARCH_TEXT} ILIKE %(like)s")
+        score = "round(similarity(poi_name, %(q)s)::numeric, 4)"
+    if poi_type:
+        where.append("poi_type = %(type)s")
+        params["type"] = poi_type
+
+    distance = "NULL::float8"
+    if center is not None:
+        params["lon"], params["lat"] = center
+        distance = "ST_Distance(location::geography, ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography)"
+        if radius:
+            # 与附近 POI 查询相同：先用外扩矩形走 GiST 索引，再按 geography 精确过滤
+            params["radius"] = radius
+            params["d_lat"] = radius / 111320.0 * 1.01
+            params["d_lon"] = params["d_lat"] / max(math.cos(math.radians(center[1])), 0.01)
+            where.append("location && ST_Expand(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326), %(d_lon)s, %(d_lat)s)")
+            where.append("ST_DWithin(location::geography, "
+                         "ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography, %(radius)s)")
+    if bbox is not None:
+        params["min_lon"], params["min_lat"], params["max_lon"], params["max_lat"] = bbox
+        where.append("location && ST_MakeEnvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326)")
+
+    seen = 0
+    after = ""
+    if cursor:
+        params["c_rank"], params["c_score"], params["c_id"], seen = _decode_search_cursor(cursor)
+        after = "WHERE (rank, -score, id) > (%(c_rank)s, -(%(c_score)s::numeric), %(c_id)s)"
+
+    limit = min(limit, POI_SEARCH_MAX_RESULTS - seen)
+    if limit <= 0:
+        return {"pois": [], "next_cursor": None, "truncated": True}
+    params["limit"] = limit + 1
+
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # 关键字过短（如单个常用字）时匹配行数可能很多，用 statement_timeout 兜底
+        cur.execute(f"SET LOCAL statement_timeout = {int(POI_SEARCH_TIMEOUT_MS)}")
+        cur.execute(f"""
+            WITH m AS (
+                SELECT external_id as id, poi_name as name, poi_type as type, type_code,
+                       lon, lat, address, tel, business_area,
+                       {POI_SEARCH_RANK} AS rank,
+                       {score} AS score,
+                       {distance} AS distance
+                FROM poi
+                WHERE {" AND ".join(where)}
+            )
+            SELECT * FROM m
+            {after}
+            ORDER BY rank, score DESC, id
+            LIMIT %(limit)s
+        """, params)
+        rows = cur.fetchall()
+        conn.rollback()  # 结束事务，statement_timeout 随之恢复
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    seen += len(rows)
+    truncated = has_more and seen >= POI_SEARCH_MAX_RESULTS
+    pois = []
+    for row in rows:
+        poi = dict(row)
+        poi["score"] = float(poi["score"])
+        if poi["distance"] is None:
+            poi.pop("distance")
+        else:
+            poi["distance"] = round(poi["distance"], 2)
+        pois.append(poi)
+    return {
+        "pois": pois,
+        "next_cursor": _encode_search_cursor(rows[-1], seen) if has_more and not truncated else None,
+        "truncated": truncated,
+    }
+
+
+@app.route("/api/poi/search", methods=["GET"])
+def search_poi_api():
+    """
+    POI 关键字搜索（名称、地址、商圈）
+
+    参数：city、q（必填）、limit、cursor、fuzzy=1、type、
+    lon + lat（返回距离）+ radius（米，限定范围）、bbox=minLon,minLat,maxLon,maxLat
+    """
+    city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"message": "缺少搜索关键字"}), 400
+
+    limit = min(max(request.args.get("limit", POI_SEARCH_DEFAULT_LIMIT, type=int), 1), POI_SEARCH_PAGE_MAX)
+    lon = request.args.get("lon", type=float)
+    lat = request.args.get("lat", type=float)
+    radius = request.args.get("radius", type=int)
+    center = (lon, lat) if lon is not None and lat is not None else None
+    if radius is not None and (center is None or not 0 < radius <= POI_SEARCH_MAX_RADIUS):
+        return jsonify({"message": f"radius 需要配合 lon、lat 使用，且不超过 {POI_SEARCH_MAX_RADIUS} 米"}), 400
+
+    try:
+        bbox = _parse_bbox(request.args["bbox"]) if request.args.get("bbox") else None
+    except ValueError:
+        return jsonify({"message": "bbox 参数无效，格式为 minLon,minLat,maxLon,maxLat"}), 400
+
+    try:
+        t0 = time.perf_counter()
+        result = search_poi(
+            city_code, query, limit,
+            cursor=request.args.get("cursor"),
+            fuzzy=request.args.get("fuzzy") in ("1", "true"),
+            poi_type=request.args.get("type"),
+            center=center, radius=radius, bbox=bbox,
+        )
+        result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return jsonify(result), 200
+    except (ValueError, TypeError):
+        return jsonify({"message": "cursor 参数无效"}), 400
+    except QueryCanceled:
+        return jsonify({"message": "搜索范围过大，请输入更具体的关键字或缩小范围"}), 503
+    except Exception as e:
+        logger.error(f"[search_poi] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+
+# ========== 站点服务范围（批量） ==========
+CATCHMENT_MAX_RADIUS = int(os.getenv("CATCHMENT_MAX_RADIUS", "1000"))  # 预计算的最大半径（米）
+CATCHMENT_MAX_STATIONS = 500  # 单次请求最多的站点数
+
+# 站点坐标取同名站点（换乘站有多条线路的记录）的平均值；用 && 外扩矩形走 poi.location 的 GiST 索引
+CATCHMENT_REFRESH_SQL = """
+    INSERT INTO station_poi_catchment (city_code, station_name, poi_id, distance)
+    SELECT s.city_code, s.station_name, p.external_id,
+           ST_Distance(p.location::geography, s.pt::geography)
+    FROM (
+        SELECT city_code, station_name, AVG(lat) AS lat,
+               ST_SetSRID(ST_MakePoint(AVG(lon), AVG(lat)), 4326) AS pt
+        FROM metro_station
+        WHERE city_code = %(city)s
+        GROUP BY city_code, station_name
+    ) s
+    JOIN poi p ON p.city_code = s.city_code
+        AND p.location && ST_Expand(s.pt, %(d_lat)s / GREATEST(cos(radians(s.lat)), 0.01), %(d_lat)s)
+        AND ST_DWithin(p.location::geography, s.pt::geography, %(radius)s)
+    ON CONFLICT (city_code, station_name, poi_id) DO NOTHING
+"""
+
+_catchment_checked = {}  # city_code -> 上次确认服务范围表为最新的时间
+_catchment_locks = {}  # city_code -> 进程内该城市的刷新锁（不同城市可以同时刷新）
+_catchment_locks_guard = threading.Lock()
+
+
+def _catchment_lock(city_code):
+    with _catchment_locks_guard:
+        return _catchment_locks.setdefault(city_code, threading.Lock())
+
+
+def _catchment_state(cur, city_code):
+    """返回 (当前的 (站点版本, POI版本, 最大半径), 表中记录的状态行, 是否最新)"""
+    current = (fetch_dataset_version("stations", city_code, cur),
+               fetch_dataset_version("poi", city_code, cur),
+               CATCHMENT_MAX_RADIUS)
+    cur.execute("""
+        SELECT station_version, poi_version, max_radius
+        FROM station_poi_catchment_state WHERE city_code = %s
+    """, (city_code,))
+    state = cur.fetchone()
+    fresh = state is not None and (state["station_version"], state["poi_version"], state["max_radius"]) == current
+    return current, state, fresh
+
+
+def _refresh_catchment(city_code):
+    """重新计算该城市的服务范围数据；多个进程同时刷新时用 advisory lock 串行化，拿到锁后已是最新则直接返回"""
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        try:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"catchment:{city_code}",))
+            (station_version, poi_version, _), _, fresh = _catchment_state(cur, city_code)
+            if fresh:
+                conn.rollback()
+                _catchment_checked[city_code] = time.monotonic()
+                return
+
+            t0 = time.perf_counter()
+            cur.execute("DELETE FROM station_poi_catchment WHERE city_code = %s", (city_code,))
+            cur.execute(CATCHMENT_REFRESH_SQL, {
+                "city": city_code,
+                "radius": CATCHMENT_MAX_RADIUS,
+                "d_lat": CATCHMENT_MAX_RADIUS / 111320.0 * 1.01,
+            })
+            rows = cur.rowcount
+            cur.execute("""
+                INSERT INTO station_poi_catchment_state (city_code, station_version, poi_version, max_radius, refreshed_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (city_code) DO UPDATE SET
+                    station_version = EXCLUDED.station_version,
+                    poi_version = EXCLUDED.poi_version,
+                    max_radius = EXCLUDED.max_radius,
+                    refreshed_at = EXCLUDED.refreshed_at
+            """, (city_code, station_version, poi_version, CATCHMENT_MAX_RADIUS))
+            conn.commit()
+            _catchment_checked[city_code] = time.monotonic()
+            logger.info(f"[服务范围] {city_code}: 重新计算 {rows} 条站点-POI记录, 耗时{(time.perf_counter() - t0) * 1000:.0f}ms")
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _refresh_catchment_background(city_code, lock):
+    try:
+        _refresh_catchment(city_code)
+    except Exception as e:
+        logger.error(f"[服务范围] {city_code}: 后台重新计算失败: {e}")
+    finally:
+        lock.release()
+
+
+def ensure_catchment(city_code):
+    """
+    确认服务范围表与 poi / metro_station 当前版本一致，每隔 METRO_CACHE_VERSION_INTERVAL 秒才检查一次。
+    - 已有该城市的旧数据（且最大半径相同）：在后台线程中重新计算，本次请求继续读取旧数据
+      （重新计算在一个事务中完成，提交前其他连接看到的仍是旧数据）；
+    - 还没有数据：同步计算。
+    进程内按城市加锁，同一城市同一时间只有一个刷新，不同城市互不阻塞。
+    """
+    now = time.monotonic()
+    if now - _catchment_checked.get(city_code, float("-inf")) < _cache_options["version_interval"]:
+        return
+
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        _, state, fresh = _catchment_state(cur, city_code)
+        conn.rollback()
+    if fresh:
+        _catchment_checked[city_code] = now
+        return
+
+    lock = _catchment_lock(city_code)
+    if state is not None and state["max_radius"] == CATCHMENT_MAX_RADIUS:
+        if lock.acquire(blocking=False):  # 已有刷新在进行时不再重复启动
+            threading.Thread(target=_refresh_catchment_background, args=(city_code, lock),
+                             name=f"catchment-{city_code}", daemon=True).start()
+        return
+    with lock:
+        _refresh_catchment(city_code)
+
+
+def _catchment_station_names(city_code, data):
+    """请求中的站点列表；给出 line 时取该线路（去掉括号说明后的线路名）上的全部站点"""
+    names = [str(n).strip() for n in (data.get("stations") or []) if str(n).strip()]
+    line = (data.get("line") or "").strip()
+    if line:
+        graph = get_route_graph(city_code)
+        line_clean = clean_line_name(line)
+        for info in graph.node_info:
+            if info["lineName"] == line_clean:
+                names.append(info["name"])
+    return list(dict.fromkeys(names))  # 去重并保持顺序
+
+
+@app.route("/api/poi/catchment", methods=["POST"])
+def get_station_catchment():
+    """
+    批量查询站点周边 POI（读取预计算的站点服务范围表）
+
+    请求体：{"city": "nj", "stations": [...站名] 或 "line": "地铁1号线", "radius": 300,
+            "types": [...可选，按 POI 类型过滤], "include_pois": true}
+    返回：每个站点的 POI 列表（按距离排序）、总数和分类统计，以及所有站点合计的分类统计（同一 POI 只计一次）
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"message": "请求体须为 JSON 对象"}), 400
+    city_code = data.get("city") or request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    if not isinstance(data.get("stations") or [], list):
+        return jsonify({"message": "stations 须为数组"}), 400
+    if not isinstance(data.get("line") or "", str):
+        return jsonify({"message": "line 须为字符串"}), 400
+    poi_types = data.get("types") or None
+    if poi_types is not None and not (isinstance(poi_types, list) and all(isinstance(t, str) for t in poi_types)):
+        return jsonify({"message": "types 须为字符串数组"}), 400
+    include_pois = data.get("include_pois", True)
+    if not isinstance(include_pois, bool):
+        return jsonify({"message": "include_pois 须为 true 或 false"}), 400
+    try:
+        radius = int(data.get("radius", 300))
+    except (TypeError, ValueError):
+        return jsonify({"message": "radius 参数无效"}), 400
+    if not 0 < radius <= CATCHMENT_MAX_RADIUS:
+        return jsonify({"message": f"radius 取值范围为 1-{CATCHMENT_MAX_RADIUS} 米"}), 400
+
+    try:
+        station_names = _catchment_station_names(city_code, data)
+        if not station_names:
+            return jsonify({"message": "缺少站点或线路参数"}), 400
+        if len(station_names) > CATCHMENT_MAX_STATIONS:
+            return jsonify({"message": f"单次最多查询 {CATCHMENT_MAX_STATIONS} 个站点"}), 400
+
+        ensure_catchment(city_code)
+
+        stations = {name: {"total": 0, "counts": {}, **({"pois": []} if include_pois else {})}
+                    for name in station_names}
+        overall = {}
+        seen = set()
+        with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT c.station_name, c.distance,
+                       p.external_id as id, p.poi_name as name, p.poi_type as type
+                       {", p.type_code, p.lon, p.lat, p.address, p.tel, p.business_area" if include_pois else ""}
+                FROM station_poi_catchment c
+                JOIN poi p ON p.city_code = c.city_code AND p.external_id = c.poi_id
+                WHERE c.city_code = %s AND c.station_name = ANY(%s) AND c.distance <= %s
+                    {"AND p.poi_type = ANY(%s)" if poi_types else ""}
+                ORDER BY c.station_name, c.distance
+            """, (city_code, station_names, radius, *([list(poi_types)] if poi_types else [])))
+            rows = cur.fetchall()
+
+        for row in rows:
+            station = stations[row.pop("station_name")]
+            poi_type = row["type"] or "其他"
+            station["total"] += 1
+            station["counts"][poi_type] = station["counts"].get(poi_type, 0) + 1
+            if row["id"] not in seen:
+                seen.add(row["id"])
+                overall[poi_type] = overall.get(poi_type, 0) + 1
+            if include_pois:
+                row["distance"] = round(row["distance"], 2)
+                station["pois"].append(row)
+
+        return jsonify({
+            "city": city_code,
+            "radius": radius,
+            "stations": stations,
+            "counts": overall,
+            "total": len(seen),
+        }), 200
+    except Exception as e:
+        logger.error(f"[get_station_catchment] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+
 # ========== 收藏站点相关接口 ==========
 
+# 每个用户的收藏列表缓存：user_id -> (写入时间, 上次确认时间, 收藏版本, 收藏列表)，按 LRU 保留 FAVORITE_CACHE_SIZE 个用户，
+# 本进程内添加 / 取消收藏时直接删掉该用户的条目。
+# 其他进程（多 worker 部署）的改动通过收藏版本发现：距上次确认超过 FAVORITE_CACHE_RECHECK 秒时先查该用户收藏的
+# 「条数:最大 fav_id」（走 (user_id, ...) 唯一索引，只读索引），与缓存时的版本不同则重新查询完整列表；
+# 确认间隔内的请求不访问数据库
+FAVORITE_VERSION_SQL = """
+    SELECT COUNT(*) AS n, COALESCE(MAX(fav_id), 0) AS max_id
+    FROM user_favorite_station WHERE user_id = %s
+"""
+FAVORITE_CACHE_SIZE = int(os.getenv("FAVORITE_CACHE_SIZE", "10000"))
+FAVORITE_CACHE_TTL = int(os.getenv("FAVORITE_CACHE_TTL", "60"))
+FAVORITE_CACHE_RECHECK = float(os.getenv("FAVORITE_CACHE_RECHECK", "5"))
+_favorite_cache = OrderedDict()
+_favorite_cache_lock = threading.Lock()
+
+
+def _cached_favorites(user_id):
+    """返回 (是否需要确认版本, 版本, 收藏列表)；没有缓存或已过期时返回 None"""
+    now = time.monotonic()
+    with _favorite_cache_lock:
+        entry = _favorite_cache.get(user_id)
+        if entry is None:
+            return None
+        if now - entry[0] > FAVORITE_CACHE_TTL:
+            del _favorite_cache[user_id]
+            return None
+        _favorite_cache.move_to_end(user_id)
+        return now - entry[1] > FAVORITE_CACHE_RECHECK, entry[2], entry[3]
+
+
+def _store_favorites(user_id, version, favorites):
+    now = time.monotonic()
+    with _favorite_cache_lock:
+        _favorite_cache[user_id] = (now, now, version, favorites)
+        _favorite_cache.move_to_end(user_id)
+        while len(_favorite_cache) > FAVORITE_CACHE_SIZE:
+            _favorite_cache.popitem(last=False)
+
+
+def invalidate_favorites(user_id):
+    with _favorite_cache_lock:
+        _favorite_cache.pop(str(user_id), None)
+
+
 @app.route("/api/favorite/add", methods=["POST"])
 def add_favorite_station():
     """添加收藏站点"""
@@ -826,29 +1953,29 @@ def add_favorite_station():
         conn = get_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
-        # 检查是否已收藏
-        cur.execute(
-            """
-            SELECT fav_id FROM user_favorite_station
-            WHERE user_id = %s AND city_code = %s AND station_id = %s
-            """,
-            (user_id, city_code, station_id),
-        )
-        existing = cur.fetchone()
-        if existing:
-            return jsonify({"message": "该站点已收藏", "fav_id": existing["fav_id"]}), 200
-
-        # 添加收藏（只存储基本信息）
+        # 添加收藏（只存储基本信息）；已收藏时 ON CONFLICT 不插入，避免先查后插在重复点击时的竞争
         cur.execute(
             """
             INSERT INTO user_favorite_station (user_id, city_code, station_id)
             VALUES (%s, %s, %s)
+            ON CONFLICT (user_id, city_code, station_id) DO NOTHING
             RETURNING fav_id, created_at
             """,
             (user_id, city_code, station_id),
         )
         result = cur.fetchone()
         conn.commit()
+        invalidate_favorites(user_id)
+        if not result:
+            cur.execute(
+                """
+                SELECT fav_id FROM user_favorite_station
+                WHERE user_id = %s AND city_code = %s AND station_id = %s
+                """,
+                (user_id, city_code, station_id),
+            )
+            existing = cur.fetchone()
+            return jsonify({"message": "该站点已收藏", "fav_id": existing["fav_id"] if existing else None}), 200
 
         return jsonify({
             "message": "收藏成功",
@@ -859,7 +1986,7 @@ def add_favorite_station():
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[add_favorite_station] 错误: {e}")
+        logger.error(f"[add_favorite_station] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -895,6 +2022,7 @@ def remove_favorite_station():
         )
         deleted = cur.fetchone()
         conn.commit()
+        invalidate_favorites(user_id)
 
         if deleted:
             return jsonify({"message": "已取消收藏"}), 200
@@ -904,7 +2032,7 @@ def remove_favorite_station():
     except Exception as e:
         if conn:
             conn.rollback()
-        print(f"[remove_favorite_station] 错误: {e}")
+        logger.error(f"[remove_favorite_station] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -923,41 +2051,46 @@ def get_favorite_stations():
 
     conn = cur = None
     try:
+        cached = _cached_favorites(user_id)
+        if cached is not None and not cached[0]:
+            favorites = cached[2]
+            return jsonify({"favorites": favorites, "total": len(favorites)}), 200
+
         conn = get_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
-        # 查询收藏列表，并关联metro_station表获取站点详情
+        cur.execute(FAVORITE_VERSION_SQL, (user_id,))
+        row = cur.fetchone()
+        version = f"{row['n']}:{row['max_id']}"
+        if cached is not None and cached[1] == version:
+            favorites = cached[2]
+            with _favorite_cache_lock:
+                entry = _favorite_cache.get(user_id)
+                if entry is not None and entry[2] == version:
+                    # 版本未变：只更新确认时间，写入时间不变，TTL 到期后仍会完整重查
+                    _favorite_cache[user_id] = (entry[0], time.monotonic(), version, entry[3])
+            return jsonify({"favorites": favorites, "total": len(favorites)}), 200
+
+        # 查询收藏列表，LATERAL 关联 metro_station 取一条同名站点的线路和坐标
         # station_id存储的是站点名称
         cur.execute(
             """
-            SELECT DISTINCT 
-                f.fav_id, 
-                f.city_code, 
+            SELECT
+                f.fav_id,
+                f.city_code,
                 f.station_id,
                 f.station_id as station_name,
                 f.created_at,
-                COALESCE(
-                    (SELECT ms.line_name FROM metro_station ms 
-                     WHERE ms.city_code = f.city_code 
-                     AND ms.station_name = f.station_id 
-                     LIMIT 1),
-                    '未知线路'
-                ) as line_name,
-                COALESCE(
-                    (SELECT ms.lon FROM metro_station ms 
-                     WHERE ms.city_code = f.city_code 
-                     AND ms.station_name = f.station_id 
-                     LIMIT 1),
-                    0
-                ) as lon,
-                COALESCE(
-                    (SELECT ms.lat FROM metro_station ms 
-                     WHERE ms.city_code = f.city_code 
-                     AND ms.station_name = f.station_id 
-                     LIMIT 1),
-                    0
-                ) as lat
+                COALESCE(ms.line_name, '未知线路') as line_name,
+                COALESCE(ms.lon, 0) as lon,
+                COALESCE(ms.lat, 0) as lat
             FROM user_favorite_station f
+            LEFT JOIN LATERAL (
+                SELECT line_name, lon, lat
+                FROM metro_station
+                WHERE city_code = f.city_code AND station_name = f.station_id
+                LIMIT 1
+            ) ms ON true
             WHERE f.user_id = %s
             ORDER BY f.created_at DESC
             """,
@@ -971,12 +2104,11 @@ def get_favorite_stations():
             fav["lon"] = float(fav["lon"]) if fav["lon"] else 0
             fav["lat"] = float(fav["lat"]) if fav["lat"] else 0
 
+        _store_favorites(user_id, version, favorites)
         return jsonify({"favorites": favorites, "total": len(favorites)}), 200
 
     except Exception as e:
-        print(f"[get_favorite_stations] 错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"[get_favorite_stations] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -1015,7 +2147,7 @@ def check_favorite_station():
         }), 200
 
     except Exception as e:
-        print(f"[check_favorite_station] 错误: {e}")
+        logger.error(f"[check_favorite_station] 错误: {e}")
         return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
@@ -1024,74 +2156,117 @@ def check_favorite_station():
             conn.close()
 
 
-@app.route("/api/cache/warm", methods=["POST"])
-def warm_cache():
-    """预热缓存 - 预加载所有城市的地铁数据"""
-    city_codes = ["nj", "bj", "sh", "wh"]
-    results = {}
-    
+FAVORITE_BATCH_MAX = 1000  # 批量接口单次最多处理的站点数
+
+
+def _favorite_items(data):
+    """
+    批量接口的站点参数，两种写法：
+    - {"items": [{"city_code": "nj", "station_id": "新街口"}, ...]}
+    - {"city_code": "nj", "station_ids": ["新街口", ...]}
+    返回去重后的 [(city_code, station_id)]
+    """
+    items = []
+    for item in data.get("items") or []:
+        if isinstance(item, dict):
+            items.append(((item.get("city_code") or "").strip(), (item.get("station_id") or "").strip()))
+    city_code = (data.get("city_code") or "").strip()
+    for station_id in data.get("station_ids") or []:
+        items.append((city_code, str(station_id).strip()))
+    return list(dict.fromkeys(i for i in items if i[0] and i[1]))
+
+
+def _favorite_batch_request():
+    """解析批量请求，返回 (user_id, items, 错误响应)"""
+    data = request.get_json(silent=True) or {}
+    user_id = data.get("user_id")
+    items = _favorite_items(data)
+    if not user_id or not items:
+        return None, None, (jsonify({"message": "缺少必要参数"}), 400)
+    if len(items) > FAVORITE_BATCH_MAX:
+        return None, None, (jsonify({"message": f"单次最多处理 {FAVORITE_BATCH_MAX} 个站点"}), 400)
+    return user_id, items, None
+
+
+@app.route("/api/favorite/check_batch", methods=["POST"])
+def check_favorite_stations_batch():
+    """批量检查站点是否已收藏（一次查询），返回顺序与请求一致"""
+    user_id, items, error = _favorite_batch_request()
+    if error:
+        return error
+
     conn = cur = None
     try:
         conn = get_conn()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        for city_code in city_codes:
-            # 预热线路数据
-            lines_cache_key = f"lines_{city_code}"
-            if lines_cache_key not in _metro_data_cache:
-                cur.execute("""
-                    SELECT line_id, city_code, line_name,
-                           ST_AsGeoJSON(line_geom) as geometry, properties
-                    FROM metro_line WHERE city_code = %s ORDER BY line_name
-                """, (city_code,))
-                lines = cur.fetchall()
-                features = []
-                for line in lines:
-                    features.append({
-                        "type": "Feature",
-                        "properties": {"name": line["line_name"], "line_id": line["line_id"], **(line["properties"] or {})},
-                        "geometry": json.loads(line["geometry"]) if line["geometry"] else None
-                    })
-                _metro_data_cache[lines_cache_key] = {"type": "FeatureCollection", "features": features}
-                results[f"{city_code}_lines"] = f"已缓存 {len(lines)} 条线路"
-            else:
-                results[f"{city_code}_lines"] = "已存在缓存"
-            
-            # 预热站点数据
-            stations_cache_key = f"stations_{city_code}"
-            if stations_cache_key not in _metro_data_cache:
-                cur.execute("""
-                    SELECT station_id, city_code, station_name as name, line_name as linename,
-                           line_number, lon, lat, station_num as num, direction, properties
-                    FROM metro_station WHERE city_code = %s ORDER BY line_name, station_num
-                """, (city_code,))
-                stations = cur.fetchall()
-                result = {"name": {}, "linename": {}, "lon": {}, "lat": {}, "num": {}, "direction": {}, "x": {}}
-                for idx, station in enumerate(stations):
-                    str_idx = str(idx * 2)
-                    result["name"][str_idx] = station["name"]
-                    result["linename"][str_idx] = station["linename"]
-                    result["lon"][str_idx] = float(station["lon"])
-                    result["lat"][str_idx] = float(station["lat"])
-                    result["num"][str_idx] = station["num"]
-                    result["direction"][str_idx] = station["direction"]
-                    line_num = station.get("line_number")
-                    if line_num:
-                        try:
-                            result["x"][str_idx] = int(line_num)
-                        except (ValueError, TypeError):
-                            result["x"][str_idx] = line_num
-                    else:
-                        result["x"][str_idx] = 0
-                _metro_data_cache[stations_cache_key] = result
-                results[f"{city_code}_stations"] = f"已缓存 {len(stations)} 个站点"
-            else:
-                results[f"{city_code}_stations"] = "已存在缓存"
-        
-        return jsonify({"message": "缓存预热完成", "results": results}), 200
+        cur.execute(
+            """
+            SELECT f.city_code, f.station_id, f.fav_id
+            FROM user_favorite_station f
+            JOIN unnest(%s::text[], %s::text[]) AS q(city_code, station_id)
+              ON f.city_code = q.city_code AND f.station_id = q.station_id
+            WHERE f.user_id = %s
+            """,
+            ([c for c, _ in items], [s for _, s in items], user_id),
+        )
+        found = {(r["city_code"], r["station_id"]): r["fav_id"] for r in cur.fetchall()}
+
+        return jsonify({
+            "favorites": [
+                {"city_code": c, "station_id": s, "is_favorite": (c, s) in found, "fav_id": found.get((c, s))}
+                for c, s in items
+            ],
+            "total": len(found),
+        }), 200
+
     except Exception as e:
-        print(f"[warm_cache] 错误: {e}")
-        return jsonify({"message": f"缓存预热失败: {str(e)}"}), 500
+        logger.error(f"[check_favorite_stations_batch] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+@app.route("/api/favorite/add_batch", methods=["POST"])
+def add_favorite_stations_batch():
+    """批量添加收藏（一条 INSERT ... ON CONFLICT DO NOTHING，已收藏的站点跳过）"""
+    user_id, items, error = _favorite_batch_request()
+    if error:
+        return error
+
+    conn = cur = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """
+            INSERT INTO user_favorite_station (user_id, city_code, station_id)
+            SELECT %s, q.city_code, q.station_id
+            FROM unnest(%s::text[], %s::text[]) AS q(city_code, station_id)
+            ON CONFLICT (user_id, city_code, station_id) DO NOTHING
+            RETURNING fav_id, city_code, station_id, created_at
+            """,
+            (user_id, [c for c, _ in items], [s for _, s in items]),
+        )
+        added = cur.fetchall()
+        conn.commit()
+        invalidate_favorites(user_id)
+
+        for fav in added:
+            fav["created_at"] = format_ts(fav["created_at"])
+        return jsonify({
+            "message": "收藏成功",
+            "added": added,
+            "skipped": len(items) - len(added),  # 原本已收藏
+        }), 200
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"[add_favorite_stations_batch] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
     finally:
         if cur:
             cur.close()
@@ -1099,27 +2274,626 @@ def warm_cache():
             conn.close()
 
 
+@app.route("/api/favorite/remove_batch", methods=["POST"])
+def remove_favorite_stations_batch():
+    """批量取消收藏（一条 DELETE）"""
+    user_id, items, error = _favorite_batch_request()
+    if error:
+        return error
+
+    conn = cur = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """
+            DELETE FROM user_favorite_station f
+            USING unnest(%s::text[], %s::text[]) AS q(city_code, station_id)
+            WHERE f.user_id = %s AND f.city_code = q.city_code AND f.station_id = q.station_id
+            RETURNING f.fav_id, f.city_code, f.station_id
+            """,
+            ([c for c, _ in items], [s for _, s in items], user_id),
+        )
+        removed = cur.fetchall()
+        conn.commit()
+        invalidate_favorites(user_id)
+
+        return jsonify({
+            "message": "已取消收藏",
+            "removed": removed,
+            "not_found": len(items) - len(removed),
+        }), 200
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"[remove_favorite_stations_batch] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+# 路网和站点搜索索引共用的站点查询
+STATION_INDEX_SQL = """
+    SELECT station_name as name, line_name as linename, line_number as x,
+           lon, lat, station_num as num, direction
+    FROM metro_station WHERE city_code = %s
+"""
+
+
+def _fetch_station_rows(city_code):
+    """查询构建路网 / 搜索索引所需的站点数据，返回 (数据版本, 行)"""
+    if file_repository is not None:
+        rows = [{"name": r["name"], "linename": r["linename"], "x": r["line_number"], "lon": r["lon"],
+                 "lat": r["lat"], "num": r["num"], "direction": r["direction"]}
+                for r in file_repository.stations(city_code)]
+        return file_repository.version("stations", city_code), rows
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        version = fetch_dataset_version("stations", city_code, cur)
+        cur.execute(STATION_INDEX_SQL, (city_code,))
+        return version, cur.fetchall()
+
+
+def get_route_graph(city_code):
+    """获取城市路网（首次使用时从 metro_station 构建，之后常驻内存）"""
+    graph = _metro_data_cache.get("stations", city_code, variant="graph")
+    if graph is not None:
+        return graph
+
+    version, rows = _fetch_station_rows(city_code)
+    graph, build_ms = build_route_graph(rows)
+    # 与站点数据共用版本号，metro_station 变化时路网随之重建
+    _metro_data_cache.put("stations", city_code, graph, version=version, variant="graph",
+                          size=graph.approx_size)
+    logger.info(f"[路网构建] {city_code}: {graph.node_count}个节点, 耗时{build_ms:.1f}ms")
+    return graph
+
+
+def get_station_search_index(city_code):
+    """获取城市站点搜索索引（与路网一样按 metro_station 的数据版本缓存）"""
+    index = _metro_data_cache.get("stations", city_code, variant="search")
+    if index is not None:
+        return index
+
+    version, rows = _fetch_station_rows(city_code)
+    t0 = time.perf_counter()
+    index = StationSearchIndex(rows)
+    _metro_data_cache.put("stations", city_code, index, version=version, variant="search",
+                          size=index.approx_size)
+    logger.info(f"[站点索引] {city_code}: {len(index)}个站点, 耗时{(time.perf_counter() - t0) * 1000:.1f}ms")
+    return index
+
+
+STATION_SEARCH_DEFAULT_LIMIT = 10
+STATION_SEARCH_MAX_LIMIT = 50
+
+
+@app.route("/api/metro/stations/search", methods=["GET"])
+def search_metro_stations():
+    """站点名称搜索（自动补全）：支持站名前缀 / 包含、拼音全拼和首字母，只返回排名靠前的结果"""
+    city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    query = (request.args.get("q") or "").strip()
+    limit = min(max(request.args.get("limit", STATION_SEARCH_DEFAULT_LIMIT, type=int), 1),
+                STATION_SEARCH_MAX_LIMIT)
+
+    if not query:
+        return jsonify({"results": [], "total": 0}), 200
+
+    try:
+        index = get_station_search_index(city_code)
+        t0 = time.perf_counter()
+        results = index.search(query, limit)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        return jsonify({"results": results, "total": len(results), "elapsed_ms": round(elapsed_ms, 3)}), 200
+    except Exception as e:
+        logger.error(f"[search_metro_stations] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+
+@app.route("/api/route/plan", methods=["GET"])
+def plan_route():
+    """地铁路径规划（服务端多准则搜索，返回耗时最短 / 换乘最少的 k 条方案）"""
+    city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    start_name = (request.args.get("from") or "").strip()
+    end_name = (request.args.get("to") or "").strip()
+    k = min(max(request.args.get("k", DEFAULT_K, type=int), 1), MAX_K)
+    max_transfers = request.args.get("max_transfers", DEFAULT_MAX_TRANSFERS, type=int)
+
+    if not start_name or not end_name:
+        return jsonify({"message": "缺少起点或终点"}), 400
+
+    try:
+        graph = get_route_graph(city_code)
+        t0 = time.perf_counter()
+        result = graph.plan(start_name, end_name, k=k, max_transfers=max_transfers)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        if result is None:
+            return jsonify({"message": "未找到起点或终点站"}), 404
+
+        return jsonify({
+            "from": start_name,
+            "to": end_name,
+            "by_time": result["by_time"],
+            "by_transfers": result["by_transfers"],
+            "elapsed_ms": round(elapsed_ms, 2),
+        }), 200
+    except Exception as e:
+        logger.error(f"[plan_route] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+
+# ========== 矢量切片（MVT）==========
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = 22
+TILE_MAX_AGE = int(os.getenv("TILE_MAX_AGE", "3600"))  # 浏览器缓存秒数
+
+# 图层 -> (最小缩放级别, 查询)；查询先用 && 与切片范围（转回 4326）做包围盒过滤，再裁剪、转为切片坐标
+TILE_LAYERS = {
+    "lines": (0, """
+        WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom),
+        features AS (
+            SELECT ST_AsMVTGeom(ST_Transform(t.line_geom, 3857), bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+                   t.line_id, t.line_name AS name
+            FROM metro_line t, bounds
+            WHERE t.city_code = %(city)s AND t.line_geom && ST_Transform(bounds.geom, 4326)
+        )
+        SELECT ST_AsMVT(features.*, 'lines', %(extent)s, 'geom') AS tile FROM features WHERE geom IS NOT NULL
+    """),
+    "stations": (8, """
+        WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom),
+        features AS (
+            SELECT ST_AsMVTGeom(ST_Transform(ST_SetSRID(ST_MakePoint(t.lon, t.lat), 4326), 3857),
+                                bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+                   t.station_name AS name, t.line_name AS linename, t.line_number,
+                   t.station_num AS num, t.direction
+            FROM metro_station t, bounds
+            WHERE t.city_code = %(city)s
+              AND ST_SetSRID(ST_MakePoint(t.lon, t.lat), 4326) && ST_Transform(bounds.geom, 4326)
+        )
+        SELECT ST_AsMVT(features.*, 'stations', %(extent)s, 'geom') AS tile FROM features WHERE geom IS NOT NULL
+    """),
+    "poi": (12, """
+        WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom),
+        features AS (
+            SELECT ST_AsMVTGeom(ST_Transform(t.location, 3857), bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+                   t.external_id AS id, t.poi_name AS name, t.poi_type AS type, t.type_code
+            FROM poi t, bounds
+            WHERE t.city_code = %(city)s AND t.location && ST_Transform(bounds.geom, 4326)
+        )
+        SELECT ST_AsMVT(features.*, 'poi', %(extent)s, 'geom') AS tile FROM features WHERE geom IS NOT NULL
+    """),
+}
+
+# 图层 -> 该城市数据包围盒的查询；切片范围与之不相交时不查库，直接返回空切片
+TILE_BOUNDS_SQL = {
+    "lines": "SELECT ST_XMin(e) AS x0, ST_YMin(e) AS y0, ST_XMax(e) AS x1, ST_YMax(e) AS y1 "
+             "FROM (SELECT ST_Extent(line_geom) AS e FROM metro_line WHERE city_code = %s) s",
+    "stations": "SELECT MIN(lon) AS x0, MIN(lat) AS y0, MAX(lon) AS x1, MAX(lat) AS y1 "
+                "FROM metro_station WHERE city_code = %s",
+    "poi": "SELECT ST_XMin(e) AS x0, ST_YMin(e) AS y0, ST_XMax(e) AS x1, ST_YMax(e) AS y1 "
+           "FROM (SELECT ST_Extent(location) AS e FROM poi WHERE city_code = %s) s",
+}
+
+
+def fetch_tile_bounds(layer, city_code):
+    """某图层某城市数据的经纬度包围盒 (min_lon, min_lat, max_lon, max_lat)，没有数据时为 None"""
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(TILE_BOUNDS_SQL[layer], (city_code,))
+        row = cur.fetchone()
+    if not row or row["x0"] is None:
+        return None
+    return float(row["x0"]), float(row["y0"]), float(row["x1"]), float(row["y1"])
+
+
+# 切片缓存：内存 LRU + 磁盘目录，键中包含数据版本，表有改动后自动换用新切片
+_tile_cache = TileCache(
+    root=os.getenv("TILE_CACHE_DIR") or None,
+    max_bytes=int(os.getenv("TILE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    ttl=_cache_options["ttl"],
+    version_interval=_cache_options["version_interval"],
+    version_fn=fetch_dataset_version,
+    bounds_fn=fetch_tile_bounds,
+    disk_max_bytes=int(os.getenv("TILE_CACHE_DISK_MAX_MB", "512")) * 1024 * 1024,
+)
+
+
+def render_tile(layer, city_code, z, x, y):
+    """用 PostGIS 生成一张切片，返回 bytes（范围内没有数据时为 b""）"""
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(TILE_LAYERS[layer][1], {
+            "z": z, "x": x, "y": y, "city": city_code,
+            "extent": TILE_EXTENT, "buffer": TILE_BUFFER,
+        })
+        row = cur.fetchone()
+    return bytes(row[0]) if row and row[0] else b""
+
+
+@app.route("/api/tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"])
+def get_tile(layer, z, x, y):
+    """矢量切片（Mapbox Vector Tile），图层 lines / stations / poi，城市通过 ?city= 指定"""
+    city_code = request.args.get("city", "nj")
+    invalid = check_city(city_code)
+    if invalid:
+        return invalid
+    if layer not in TILE_LAYERS:
+        return jsonify({"message": f"未知图层: {layer}"}), 404
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"message": "切片坐标无效"}), 400
+
+    try:
+        if z < TILE_LAYERS[layer][0]:
+            tile = b""  # 低缩放级别不显示该图层
+        else:
+            tile = _tile_cache.get_or_render(layer, city_code, z, x, y,
+                                             lambda: render_tile(layer, city_code, z, x, y))
+    except Exception as e:
+        logger.error(f"[get_tile] 错误: {e}")
+        return jsonify({"message": "服务器错误，请稍后重试"}), 500
+
+    resp = Response(tile, status=200 if tile else 204, mimetype="application/vnd.mapbox-vector-tile")
+    resp.headers["Cache-Control"] = f"public, max-age={TILE_MAX_AGE}"
+    return resp
+
+
+DEFAULT_CITY_CODES = ["nj", "bj", "sh", "wh"]  # city 表不可用时的兜底
+CACHE_WARM_WORKERS = int(os.getenv("CACHE_WARM_WORKERS", "4"))
+
+# 预热状态：city_code -> {"status": pending/warming/ready/failed, 各数据集耗时, ...}
+# 同一时间只允许一轮预热（_warm_running），开始时重置本轮各城市的状态
+_warm_status = {}
+_warm_running = False
+_warm_lock = threading.Lock()
+
+
+class WarmInProgressError(Exception):
+    """已有一轮预热正在进行"""
+
+
+def list_city_codes():
+    """城市列表：city 表加上已导入站点的城市（文件模式下按数据文件列出）"""
+    if file_repository is not None:
+        return file_repository.cities() or DEFAULT_CITY_CODES
+    try:
+        with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT city_code FROM city
+                UNION
+                SELECT DISTINCT city_code FROM metro_station
+                ORDER BY city_code
+            """)
+            codes = [row["city_code"] for row in cur.fetchall()]
+        return codes or DEFAULT_CITY_CODES
+    except Exception as e:
+        logger.warning(f"[warm_cache] 读取城市列表失败，使用默认城市列表: {e}")
+        return DEFAULT_CITY_CODES
+
+
+# ========== 城市参数校验 ==========
+# ?city= 会进入缓存键、版本记录、磁盘路径和指标标签，只接受已知城市，
+# 避免任意取值让这些按城市保存的结构无限增长
+CITY_LIST_TTL = int(os.getenv("CITY_LIST_TTL", "300"))  # 秒，城市列表的缓存时间
+CITY_LIST_MISS_INTERVAL = 5  # 秒，遇到列表中没有的城市时最多这么久重新读取一次（新导入的城市很快可用）
+
+_city_codes = frozenset()
+_city_codes_loaded_at = float("-inf")
+_city_codes_refreshing = False
+_city_codes_cond = threading.Condition()
+
+
+def known_city_codes(max_age=CITY_LIST_TTL):
+    """
+    已知城市集合（缓存 max_age 秒）。过期时只由一个线程在锁外重新读取，
+    其他线程继续使用旧列表（首次加载时才等待），读取完成后在锁内替换。
+    """
+    global _city_codes, _city_codes_loaded_at, _city_codes_refreshing
+    with _city_codes_cond:
+        if time.monotonic() - _city_codes_loaded_at < max_age:
+            return _city_codes
+        if _city_codes_refreshing:
+            while _city_codes_refreshing and not _city_codes:
+                _city_codes_cond.wait()
+            return _city_codes
+        _city_codes_refreshing = True
+
+    codes = None
+    try:
+        codes = frozenset(list_city_codes())
+    finally:
+        with _city_codes_cond:
+            if codes is not None:
+                _city_codes, _city_codes_loaded_at = codes, time.monotonic()
+            _city_codes_refreshing = False
+            _city_codes_cond.notify_all()
+    return codes
+
+
+def is_known_city(city_code):
+    if not isinstance(city_code, str) or not CITY_CODE_RE.match(city_code):
+        return False
+    return city_code in known_city_codes() or city_code in known_city_codes(CITY_LIST_MISS_INTERVAL)
+
+
+def check_city(city_code):
+    """城市参数无效时返回 404 响应，否则返回 None"""
+    if is_known_city(city_code):
+        return None
+    return jsonify({"message": f"未知城市: {str(city_code)[:20]}"}), 404
+
+
+def _set_warm_status(city_code, **fields):
+    with _warm_lock:
+        _warm_status.setdefault(city_code, {}).update(fields)
+
+
+def warm_city(city_code):
+    """预热单个城市（线路、站点、路网、站点搜索索引，以及启用时的内存 POI 索引），使用独立的连接，返回结果说明"""
+    started = time.perf_counter()
+    _set_warm_status(city_code, status="warming", error=None,
+                     started_at=format_ts(datetime.datetime.now().astimezone()))
+    results = {}
+    timings = {}
+    try:
+        with metro_cursor() as cur:
+            for dataset, unit in (("lines", "条线路"), ("stations", "个站点")):
+                t0 = time.perf_counter()
+                # contains() 不看版本：先查一次数据版本，有变化的数据集会被丢弃并重新构建
+                _metro_data_cache.check_version(dataset, city_code)
+                if not _metro_data_cache.contains(dataset, city_code):
+                    payload = _load_once(dataset, city_code, cur)
+                    results[f"{city_code}_{dataset}"] = f"已缓存 {payload.meta['count']} {unit}"
+                else:
+                    results[f"{city_code}_{dataset}"] = "已存在缓存"
+                timings[f"{dataset}_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        t0 = time.perf_counter()
+        get_route_graph(city_code)
+        timings["route_graph_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        t0 = time.perf_counter()
+        get_station_search_index(city_code)
+        timings["search_index_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        if file_repository is not None:
+            t0 = time.perf_counter()
+            file_repository.pois(city_code)
+            timings["poi_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        elif POI_NEARBY_BACKEND == "memory" and poi_index_available():
+            t0 = time.perf_counter()
+            get_poi_index(city_code)
+            timings["poi_index_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        _set_warm_status(city_code, status="ready", timings=timings,
+                         elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+    except Exception as e:
+        logger.error(f"[warm_cache] {city_code} 预热失败: {e}")
+        _set_warm_status(city_code, status="failed", error=str(e), timings=timings,
+                         elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+        results[city_code] = f"预热失败: {e}"
+    return results
+
+
+def _begin_warm():
+    """占用预热标志并把本轮城市的状态重置为 pending；已有预热在进行时抛出 WarmInProgressError"""
+    global _warm_running
+    city_codes = list_city_codes()
+    with _warm_lock:
+        if _warm_running:
+            raise WarmInProgressError("缓存预热正在进行中")
+        _warm_running = True
+        _warm_status.clear()
+        for city_code in city_codes:
+            _warm_status[city_code] = {"status": "pending"}
+    return city_codes
+
+
+def _end_warm():
+    global _warm_running
+    with _warm_lock:
+        _warm_running = False
+
+
+def _warm_cities(city_codes):
+    """在有界线程池上并发预热，单个城市慢或失败不影响其他城市"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(CACHE_WARM_WORKERS, len(city_codes))),
+                            thread_name_prefix="cache-warm") as executor:
+        for city_results in executor.map(warm_city, city_codes):
+            results.update(city_results)
+    return results
+
+
+def warm_all_cities():
+    """同步预热所有城市；已有预热在进行时抛出 WarmInProgressError"""
+    city_codes = _begin_warm()
+    try:
+        return _warm_cities(city_codes)
+    finally:
+        _end_warm()
+
+
+@app.route("/api/cache/warm", methods=["POST"])
+def warm_cache():
+    """预热缓存 - 并发预加载 city 表中所有城市的地铁数据；?async=1 时后台执行、立即返回"""
+    try:
+        if request.args.get("async") in ("1", "true"):
+            start_background_warm()
+            return jsonify({"message": "缓存预热已在后台开始"}), 202
+
+        results = warm_all_cities()
+        failed = [c for c, st in warm_status().items() if st.get("status") == "failed"]
+        if failed:
+            return jsonify({"message": f"部分城市缓存预热失败: {', '.join(failed)}", "results": results}), 500
+        return jsonify({"message": "缓存预热完成", "results": results}), 200
+    except WarmInProgressError as e:
+        return jsonify({"message": str(e), "cities": warm_status()}), 409
+    except Exception as e:
+        logger.error(f"[warm_cache] 错误: {e}")
+        return jsonify({"message": f"缓存预热失败: {str(e)}"}), 500
+
+
+def warm_status():
+    """每个城市的预热状态和耗时（副本）"""
+    with _warm_lock:
+        return {code: dict(st) for code, st in _warm_status.items()}
+
+
+@app.route("/api/ready", methods=["GET"])
+def readiness():
+    """就绪检查：所有城市预热完成返回 200，否则 503；附带每个城市的状态和耗时"""
+    cities = warm_status()
+    ready = bool(cities) and all(st.get("status") == "ready" for st in cities.values())
+    return jsonify({"ready": ready, "cities": cities}), 200 if ready else 503
+
+
 @app.route("/api/cache/clear", methods=["POST"])
 def clear_cache():
-    """清除所有缓存"""
-    _metro_data_cache.clear()
-    return jsonify({"message": "缓存已清除"}), 200
-
+    """清除缓存（含矢量切片）：可选参数 city / dataset（lines、stations、poi）只清除指定部分，不传则清除全部"""
+    data = request.get_json(silent=True) or {}
+    city_code = data.get("city") or request.args.get("city")
+    dataset = data.get("dataset") or request.args.get("dataset")
+    if dataset and dataset not in DATASET_TABLES:
+        return jsonify({"message": f"未知数据集: {dataset}"}), 400
+    if city_code and not is_known_city(city_code):
+        return jsonify({"message": f"未知城市: {str(city_code)[:20]}"}), 404
+
+    removed = _metro_data_cache.invalidate(city_code=city_code, dataset=dataset)
+    removed += _tile_cache.invalidate(city_code=city_code, layer=dataset)
+    return jsonify({"message": "缓存已清除", "removed": removed}), 200
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    """缓存状态（条目数、占用字节、命中 / 未命中 / 淘汰 / 过期次数），tiles 为矢量切片缓存"""
+    return jsonify({**_metro_data_cache.stats(), "tiles": _tile_cache.stats()}), 200
+
+
+@app.route("/api/db/pool", methods=["GET"])
+def db_pool_stats():
+    """数据库连接池状态（借出 / 空闲 / 等待 / 累计新建 / 回收）"""
+    return jsonify(pool_stats()), 200
+
+
+@app.route("/api/db/queries", methods=["GET"])
+def db_query_stats():
+    """
+    按语句指纹汇总的 SQL 耗时（慢查询日志）
+    参数：sort=total/p99/mean/max/calls（默认 total），limit（默认 20），plans=0 时不返回完整执行计划。
+    missing_indexes 汇总执行计划中的顺序扫描，按被过滤掉的行数排序。
+    """
+    sort = request.args.get("sort", "total")
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 200)
+    include_plans = request.args.get("plans", "1") not in ("0", "false")
+    return jsonify({
+        **query_log.stats(),
+        "queries": query_log.top(limit, sort=sort, include_plans=include_plans),
+        "missing_indexes": query_log.missing_index_hints(),
+    }), 200
+
+
+@app.route("/api/db/queries/reset", methods=["POST"])
+def reset_db_query_stats():
+    """清空慢查询统计"""
+    query_log.reset()
+    return jsonify({"message": "已清空"}), 200
+
+
+@app.route("/api/audit/stats", methods=["GET"])
+def login_audit_stats():
+    """登录审计写入队列状态（排队中 / 已写入 / 队列满丢弃 / 写入失败）"""
+    return jsonify(login_audit.stats()), 200
+
+
+def _stats_samples(stats, keys, **labels):
+    return [({**labels, "kind": key}, stats[key]) for key in keys if key in stats]
+
+
+def _collect_component_metrics():
+    """抓取时从各组件已有的 stats() 读取：缓存按城市 / 数据集的事件计数、连接池、登录审计、哈希队列、日志队列"""
+    # city 标签只用已知城市，其他取值合并为 "other"，避免标签组合数量随请求参数增长
+    known = known_city_codes()
+    events = {}
+
+    def add_event(event, dataset, city_code, n):
+        key = (dataset, city_code if city_code in known else "other")
+        counts = events.setdefault(event, {})
+        counts[key] = counts.get(key, 0) + n
+
+    for (event, dataset, city_code), n in _metro_data_cache.event_counts().items():
+        add_event(event, dataset, city_code, n)
+    for (event, layer, city_code), n in _tile_cache.memory.event_counts().items():
+        add_event(event, f"tiles:{layer}", city_code, n)
+    for event in ("hits", "misses", "evictions", "expirations", "invalidations", "version_changes"):
+        samples = [({"dataset": dataset, "city": city}, n)
+                   for (dataset, city), n in events.get(event, {}).items()]
+        yield (f"metro_cache_{event}_total", "counter", f"地铁数据缓存 {event} 次数", samples)
+
+    cache = _metro_data_cache.stats()
+    yield ("metro_cache_bytes", "gauge", "地铁数据缓存占用字节数", [({}, cache["bytes"])])
+    yield ("metro_cache_entries", "gauge", "地铁数据缓存条目数", [({}, cache["entries"])])
+
+    pool = pool_stats()
+    yield ("db_pool_connections", "gauge", "连接池连接数",
+           _stats_samples(pool, ("size", "in_use", "idle", "waiting", "max_size")))
+    yield ("db_pool_events_total", "counter", "连接池累计事件",
+           _stats_samples(pool, ("created", "recycled", "checkouts", "timeouts")))
+    yield ("login_audit_events_total", "counter", "登录审计写入",
+           _stats_samples(login_audit.stats(), ("queued", "written", "dropped", "failed", "batches")))
+    yield ("login_audit_pending", "gauge", "登录审计待写入条数", [({}, login_audit.stats()["pending"])])
+    yield ("password_hash_pending", "gauge", "密码哈希排队任务数", [({}, password_hasher.stats()["pending"])])
+    logs = log_queue.stats()
+    yield ("log_queue_pending", "gauge", "日志队列中待写出条数", [({}, logs["queued"])])
+    yield ("log_queue_dropped_total", "counter", "队列满丢弃的日志条数", [({}, logs["dropped"])])
+
+
+metrics.register_collector(_collect_component_metrics)
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus 文本格式的指标：请求延迟直方图 / 处理中请求数 / 状态码计数、缓存、数据库连接和查询耗时"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 
-def preload_cache():
-    """服务启动时预加载缓存"""
-    print("[启动] 开始预热缓存...")
+def start_background_warm():
+    """在后台线程中预热缓存，不阻塞服务启动；已有预热在进行时抛出 WarmInProgressError"""
+    city_codes = _begin_warm()
+    thread = threading.Thread(target=_background_warm, args=(city_codes,), name="cache-warm-main", daemon=True)
+    thread.start()
+    return thread
+
+
+def _background_warm(city_codes):
+    started = time.perf_counter()
     try:
-        with app.test_client() as client:
-            client.post('/api/cache/warm')
-        print("[启动] 缓存预热完成")
+        user_filter.ensure_loaded(wait=True)
+        _warm_cities(city_codes)
+        logger.info(f"[启动] 缓存预热完成，耗时{(time.perf_counter() - started):.1f}s")
     except Exception as e:
-        print(f"[启动] 缓存预热失败: {e}")
+        logger.error(f"[启动] 缓存预热失败: {e}")
+    finally:
+        _end_warm()
+
+
+def preload_cache():
+    """服务启动时预加载缓存（后台进行，可通过 /api/ready 查看进度）"""
+    logger.info("[启动] 开始后台预热缓存...")
+    start_background_warm()
 
 
 if __name__ == "__main__":
+    user_filter.sole_writer = True  # 开发服务器只有一个进程
     # 预热缓存（首次加载后，后续请求将使用缓存）
     preload_cache()
-    # 在本地开发环境使用，生产需替换为更安全的部署方式
+    # 在本地开发环境使用，生产环境使用 python serve.py（gunicorn 多进程，主进程预热后 fork）
     app.run(host="0.0.0.0", port=5000, debug=True)
 
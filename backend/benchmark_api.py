@@ -0,0 +1,561 @@
+"""
+API 基准测试 / 压测
+
+生成指定规模的合成城市数据，启动后端（独立子进程，werkzeug 多线程服务器），
+对 app.py 中的每个接口依次施加并发负载，记录 p50 / p95 / p99 延迟、吞吐量和服务进程的峰值内存，
+输出 JSON 报告；compare 子命令对比两份报告，延迟 / 吞吐量变差超过阈值时标记为回归并返回非零退出码。
+
+- --mode memory（默认）：合成数据写入临时目录，后端以 METRO_DATA_BACKEND=file 运行，不需要数据库；
+  需要数据库的接口（用户、收藏、POI 搜索、矢量切片等）记为 skipped；
+- --mode db：用 import_metro_data.py 把合成数据导入 .env 配置的数据库（城市代码以 zz 开头，
+  不影响真实城市），并注册若干测试用户，覆盖全部接口。
+
+用法：
+    cd backend && python benchmark_api.py run --cities 2 --pois 20000 --duration 5 --concurrency 8 --out base.json
+    python benchmark_api.py run --mode db --out new.json
+    python benchmark_api.py compare base.json new.json --threshold 0.1
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CITY_PREFIX = "zz"  # 合成城市代码前缀：zza, zzb, ...
+POI_TYPES = ["餐饮服务", "购物服务", "生活服务", "体育休闲服务", "医疗保健服务", "科教文化服务", "金融保险服务"]
+POI_WORDS = ["星巴克", "肯德基", "便利店", "超市", "药房", "银行", "书店", "健身房", "咖啡", "面馆"]
+BENCH_PASSWORD = "Bench#2024pass"
+
+
+# ========== 合成数据 ==========
+def city_codes(n):
+    return [CITY_PREFIX + string.ascii_lowercase[i] for i in range(n)]
+
+
+def generate_city(data_dir, city_code, index, lines, stations, pois, seed=0):
+    """
+    生成一个城市的线路 / 站点 / POI 文件（格式与 frontend/data 相同）。
+    线路为 m 条横线 + m 条竖线组成的网格，交点是换乘站；每段之间插入若干中间站，使站点总数接近 stations。
+    """
+    rng = random.Random(f"{seed}-{city_code}")
+    m = max(lines // 2, 1)
+    per_line = max(stations / (2 * m), m)
+    between = max(int(round((per_line - m) / max(m - 1, 1))), 0)
+    lon0, lat0, step = 100.0 + index, 30.0, 0.02 * (between + 1)
+
+    names, linenames, lons, lats, nums, xs, directions = {}, {}, {}, {}, {}, {}, {}
+    features = []
+    key = 0
+    for line_no in range(2 * m):
+        horizontal = line_no < m
+        fixed = line_no % m
+        linename = f"地铁{line_no + 1}号线"
+        coords = []
+        num = 0
+        for pos in range(m):
+            for sub in range(between + 1 if pos < m - 1 else 1):
+                t = pos + sub / (between + 1)
+                lon = lon0 + (t if horizontal else fixed) * step
+                lat = lat0 + (fixed if horizontal else t) * step
+                name = (f"{city_code}站{fixed}-{pos}" if horizontal else f"{city_code}站{pos}-{fixed}") \
+                    if sub == 0 else f"{city_code}{linename}{pos}-{sub}站"
+                num += 1
+                names[str(key)], linenames[str(key)] = name, linename
+                lons[str(key)], lats[str(key)] = round(lon, 6), round(lat, 6)
+                nums[str(key)], xs[str(key)], directions[str(key)] = num, line_no + 1, 1
+                coords.append([round(lon, 6), round(lat, 6)])
+                key += 2
+        features.append({"type": "Feature", "properties": {"name": linename},
+                         "geometry": {"type": "LineString", "coordinates": coords}})
+
+    span = step * (m - 1) or step
+    poi_rows = [{
+        "id": f"{city_code.upper()}{i:07d}",
+        "name": f"{rng.choice(POI_WORDS)}{i % 997}号店",
+        "type": rng.choice(POI_TYPES),
+        "typecode": "050000",
+        "lon": round(lon0 + rng.random() * span, 6),
+        "lat": round(lat0 + rng.random() * span, 6),
+        "address": f"{city_code}路{rng.randint(1, 999)}号",
+        "tel": "",
+        "business_area": f"商圈{rng.randint(1, 30)}",
+    } for i in range(pois)]
+
+    os.makedirs(os.path.join(data_dir, "POI"), exist_ok=True)
+    with open(os.path.join(data_dir, f"{city_code}_line.geojson"), "w", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "name": f"{city_code}_line", "features": features}, f,
+                  ensure_ascii=False)
+    with open(os.path.join(data_dir, f"{city_code}_stop.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": names, "linename": linenames, "lon": lons, "lat": lats, "x": xs,
+                   "num": nums, "direction": directions}, f, ensure_ascii=False)
+    with open(os.path.join(data_dir, "POI", f"{city_code}_poi.json"), "w", encoding="utf-8") as f:
+        json.dump({"pois": poi_rows}, f, ensure_ascii=False)
+
+    station_names = list(dict.fromkeys(names.values()))
+    return {
+        "stations": station_names,
+        "transfers": [n for n in station_names if "-" in n and "号线" not in n],
+        "center": (lon0 + span / 2, lat0 + span / 2),
+        "poi_names": [p["name"] for p in poi_rows[:200]],
+    }
+
+
+# ========== 场景 ==========
+class Context:
+    """场景参数生成所需的数据：合成城市、测试用户"""
+
+    def __init__(self, cities, users):
+        self.cities = cities  # {city_code: generate_city 的返回值}
+        self.users = users  # [{"user_id", "username"}]
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def city(self, rng):
+        code = rng.choice(sorted(self.cities))
+        return code, self.cities[code]
+
+    def user(self, rng):
+        return rng.choice(self.users) if self.users else {"user_id": 1, "username": "bench"}
+
+
+def _get(path, **params):
+    return "GET", f"{path}?{urlencode(params)}" if params else path, None
+
+
+def _post(path, body):
+    return "POST", path, body
+
+
+def _tile(ctx, rng):
+    code, city = ctx.city(rng)
+    lon, lat = city["center"]
+    z = 12
+    x = int((lon + 180) / 360 * 2 ** z)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** z)
+    return _get(f"/api/tiles/{rng.choice(['lines', 'stations', 'poi'])}/{z}/{x}/{y}.pbf", city=code)
+
+
+def _register(ctx, rng):
+    n = ctx.next_id()
+    name = f"bench_{os.getpid()}_{n}_{rng.randint(0, 1 << 30)}"
+    return _post("/api/register", {"username": name, "password": BENCH_PASSWORD,
+                                   "email": f"{name}@bench.local", "safe_question": "bench"})
+
+
+def _favorite_body(ctx, rng, batch=False):
+    code, city = ctx.city(rng)
+    user = ctx.user(rng)
+    if batch:
+        return {"user_id": user["user_id"], "city_code": code, "station_ids": rng.sample(city["stations"], 10)}
+    return {"user_id": user["user_id"], "city_code": code, "station_id": rng.choice(city["stations"])}
+
+
+# (名称, 路由规则, 是否需要数据库, 参数生成函数)；按顺序执行，会清空缓存的场景放在最后
+SCENARIOS = [
+    ("metro_lines", "/api/metro/lines", False, lambda c, r: _get("/api/metro/lines", city=c.city(r)[0])),
+    ("metro_lines_lod", "/api/metro/lines", False,
+     lambda c, r: _get("/api/metro/lines", city=c.city(r)[0], zoom=10, format="compact")),
+    ("metro_stations", "/api/metro/stations", False, lambda c, r: _get("/api/metro/stations", city=c.city(r)[0])),
+    ("metro_stations_columnar", "/api/metro/stations", False,
+     lambda c, r: _get("/api/metro/stations", city=c.city(r)[0], format="columnar")),
+    ("station_search", "/api/metro/stations/search", False,
+     lambda c, r: (lambda code, city: _get("/api/metro/stations/search", city=code,
+                                           q=r.choice(city["stations"])[:r.randint(2, 4)]))(*c.city(r))),
+    ("route_plan", "/api/route/plan", False,
+     lambda c, r: (lambda code, city: _get("/api/route/plan", city=code, **dict(zip(
+         ("from", "to"), r.sample(city["transfers"] or city["stations"], 2)))))(*c.city(r))),
+    ("poi_page", "/api/poi", False, lambda c, r: _get("/api/poi", city=c.city(r)[0], limit=500)),
+    ("poi_type", "/api/poi", False,
+     lambda c, r: _get("/api/poi", city=c.city(r)[0], type=r.choice(POI_TYPES), limit=200)),
+    ("poi_nearby", "/api/poi/nearby", False,
+     lambda c, r: (lambda code, city: _get("/api/poi/nearby", city=code, lon=city["center"][0] + r.uniform(-0.02, 0.02),
+                                           lat=city["center"][1] + r.uniform(-0.02, 0.02),
+                                           radius=r.choice([300, 500, 1000])))(*c.city(r))),
+    ("poi_search", "/api/poi/search", True,
+     lambda c, r: (lambda code, city: _get("/api/poi/search", city=code,
+                                           q=r.choice(city["poi_names"])[:3], limit=20))(*c.city(r))),
+    ("poi_catchment", "/api/poi/catchment", True,
+     lambda c, r: (lambda code, city: _post("/api/poi/catchment", {
+         "city": code, "stations": r.sample(city["stations"], 5), "radius": 500, "include_pois": False}))(*c.city(r))),
+    ("tiles", "/api/tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf", True, _tile),
+    ("check_user", "/api/check_user", True,
+     lambda c, r: _post("/api/check_user", {"username": f"nobody_{r.randint(0, 1 << 30)}"})),
+    ("check_user_stats", "/api/check_user/stats", False, lambda c, r: _get("/api/check_user/stats")),
+    ("register", "/api/register", True, _register),
+    ("login", "/api/login", True,
+     lambda c, r: _post("/api/login", {"username": c.user(r)["username"], "password": BENCH_PASSWORD})),
+    ("profile", "/api/profile", True, lambda c, r: _get("/api/profile", user_id=c.user(r)["user_id"])),
+    ("logout", "/api/logout", True, lambda c, r: _post("/api/logout", {"user_id": c.user(r)["user_id"]})),
+    ("get_security_question", "/api/get_security_question", True,
+     lambda c, r: _get("/api/get_security_question", identifier=c.user(r)["username"])),
+    ("verify_security_answer", "/api/verify_security_answer", True,
+     lambda c, r: _post("/api/verify_security_answer", {"user_id": c.user(r)["user_id"], "answer": "bench"})),
+    ("reset_password", "/api/reset_password", True,
+     lambda c, r: _post("/api/reset_password", {"identifier": c.user(r)["username"], "answer": "bench",
+                                                "new_password": BENCH_PASSWORD})),
+    ("change_password", "/api/change_password", True,
+     lambda c, r: _post("/api/change_password", {"user_id": c.user(r)["user_id"], "answer": "bench",
+                                                 "new_password": BENCH_PASSWORD})),
+    ("change_security_answer", "/api/change_security_answer", True,
+     lambda c, r: _post("/api/change_security_answer", {"user_id": c.user(r)["user_id"], "old_answer": "bench",
+                                                        "new_answer": "bench"})),
+    ("favorite_add", "/api/favorite/add", True, lambda c, r: _post("/api/favorite/add", _favorite_body(c, r))),
+    ("favorite_check", "/api/favorite/check", True,
+     lambda c, r: (lambda b: _get("/api/favorite/check", user_id=b["user_id"], city_code=b["city_code"],
+                                  station_id=b["station_id"]))(_favorite_body(c, r))),
+    ("favorite_list", "/api/favorite/list", True, lambda c, r: _get("/api/favorite/list", user_id=c.user(r)["user_id"])),
+    ("favorite_remove", "/api/favorite/remove", True, lambda c, r: _post("/api/favorite/remove", _favorite_body(c, r))),
+    ("favorite_check_batch", "/api/favorite/check_batch", True,
+     lambda c, r: _post("/api/favorite/check_batch", _favorite_body(c, r, batch=True))),
+    ("favorite_add_batch", "/api/favorite/add_batch", True,
+     lambda c, r: _post("/api/favorite/add_batch", _favorite_body(c, r, batch=True))),
+    ("favorite_remove_batch", "/api/favorite/remove_batch", True,
+     lambda c, r: _post("/api/favorite/remove_batch", _favorite_body(c, r, batch=True))),
+    ("ready", "/api/ready", False, lambda c, r: _get("/api/ready")),
+    ("cache_stats", "/api/cache/stats", False, lambda c, r: _get("/api/cache/stats")),
+    ("db_pool", "/api/db/pool", False, lambda c, r: _get("/api/db/pool")),
+    ("audit_stats", "/api/audit/stats", False, lambda c, r: _get("/api/audit/stats")),
+    ("metrics", "/metrics", False, lambda c, r: _get("/metrics")),
+    ("db_queries", "/api/db/queries", False, lambda c, r: _get("/api/db/queries", plans=0)),
+    ("db_queries_reset", "/api/db/queries/reset", False, lambda c, r: _post("/api/db/queries/reset", {})),
+    ("cache_warm", "/api/cache/warm", False, lambda c, r: _post("/api/cache/warm", {})),
+    ("cache_clear", "/api/cache/clear", False, lambda c, r: _post("/api/cache/clear", {})),
+]
+
+
+# ========== 负载生成 ==========
+def percentile(sorted_values, p):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(int(math.ceil(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[rank]
+
+
+def run_scenario(port, ctx, build, concurrency, duration, max_requests, seed):
+    """concurrency 个线程各自保持一条 HTTP 连接，持续 duration 秒（或共 max_requests 次）发送请求"""
+    latencies = []
+    statuses = {}
+    errors = [0]
+    sent = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        rng = random.Random(f"{seed}-{n}")
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and sent[0] >= max_requests:
+                    break
+                sent[0] += 1
+            method, path, body = build(ctx, rng)
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            headers = {"Accept-Encoding": "gzip"}
+            if data is not None:
+                headers["Content-Type"] = "application/json"
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, quote(path, safe="/?=&%.:-_"), body=data, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                status = "error"
+            elapsed = (time.perf_counter() - t0) * 1000
+            local.append(elapsed)
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == "error" or status >= 500:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "status": statuses,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) or 0, 3),
+            "p95": round(percentile(latencies, 95) or 0, 3),
+            "p99": round(percentile(latencies, 99) or 0, 3),
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            "max": round(latencies[-1], 3) if latencies else 0,
+        },
+    }
+
+
+# ========== 服务进程 ==========
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    """进程的峰值常驻内存（Linux 读取 /proc/<pid>/status 的 VmHWM，其他平台返回 None）"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def serve(port):
+    """子进程入口：预热后用多线程 werkzeug 服务器提供 app"""
+    from werkzeug.serving import make_server
+
+    import app as backend
+
+    backend.preload_cache()
+    make_server("127.0.0.1", port, backend.app, threaded=True).serve_forever()
+
+
+def start_server(env, port, timeout=300):
+    """启动服务子进程，等待 /api/ready 返回 200（预热完成）"""
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+                            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务进程已退出（返回码 {proc.returncode}）")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/ready")
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("等待服务预热超时")
+
+
+def _request_json(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    conn.request(method, path, body=data, headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    payload = resp.read()
+    conn.close()
+    return resp.status, json.loads(payload or b"null")
+
+
+def create_users(port, n):
+    """db 模式：注册 n 个测试用户，返回 [{"user_id", "username"}]"""
+    users = []
+    for i in range(n):
+        name = f"bench_user_{i}"
+        status, body = _request_json(port, "POST", "/api/register", {
+            "username": name, "password": BENCH_PASSWORD, "email": f"{name}@bench.local", "safe_question": "bench"})
+        if status != 201:  # 已存在：登录取 user_id
+            status, body = _request_json(port, "POST", "/api/login", {"username": name, "password": BENCH_PASSWORD})
+        if status in (200, 201) and (body or {}).get("user_id"):
+            users.append({"user_id": body["user_id"], "username": name})
+    return users
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ========== run / compare ==========
+def cmd_run(args):
+    data_dir = tempfile.mkdtemp(prefix="metro_bench_")
+    codes = city_codes(args.cities)
+    t0 = time.perf_counter()
+    cities = {code: generate_city(data_dir, code, i, args.lines, args.stations, args.pois, args.seed)
+              for i, code in enumerate(codes)}
+    seed_info = {"data_dir": data_dir, "generate_s": round(time.perf_counter() - t0, 2)}
+    print(f"[基准] 已生成 {len(codes)} 个合成城市 -> {data_dir}")
+
+    env = dict(os.environ, METRO_CACHE_BACKEND="memory")
+    if args.mode == "memory":
+        env.update(METRO_DATA_BACKEND="file", METRO_DATA_DIR=data_dir)
+    else:
+        import import_metro_data
+
+        t0 = time.perf_counter()
+        if import_metro_data.main(["--data-dir", data_dir, "--cities", ",".join(codes), "--prune"]) != 0:
+            raise SystemExit("导入合成数据失败")
+        seed_info["import_s"] = round(time.perf_counter() - t0, 2)
+
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = start_server(env, port)
+    seed_info["startup_s"] = round(time.perf_counter() - t0, 2)
+    report = {
+        "meta": {
+            "started_at": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "mode": args.mode, "cities": args.cities, "lines": args.lines, "stations": args.stations,
+            "pois": args.pois, "concurrency": args.concurrency, "duration": args.duration,
+            "max_requests": args.requests, "seed": args.seed, "git_commit": _git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        },
+        "seed": seed_info,
+        "scenarios": {},
+        "skipped": {},
+    }
+    try:
+        users = create_users(port, args.users) if args.mode == "db" else []
+        ctx = Context(cities, users)
+        from app import app as flask_app  # 只用于列出路由
+        rules = {r.rule for r in flask_app.url_map.iter_rules() if r.endpoint != "static"}
+        report["uncovered_routes"] = sorted(rules - {rule for _, rule, _, _ in SCENARIOS})
+
+        for name, rule, needs_db, build in SCENARIOS:
+            if args.only and not any(pattern in name for pattern in args.only.split(",")):
+                continue
+            if needs_db and args.mode != "db":
+                report["skipped"][name] = "需要数据库（--mode db）"
+                continue
+            result = run_scenario(port, ctx, build, args.concurrency, args.duration, args.requests, args.seed)
+            result["route"] = rule
+            result["peak_rss_mb"] = peak_rss_mb(proc.pid)
+            report["scenarios"][name] = result
+            lat = result["latency_ms"]
+            print(f"[基准] {name:<26}{result['requests']:>7}次 {result['throughput_rps']:>9.1f}/s  "
+                  f"p50 {lat['p50']:>8.2f}ms  p95 {lat['p95']:>8.2f}ms  p99 {lat['p99']:>8.2f}ms  "
+                  f"错误 {result['errors']}")
+    finally:
+        report["peak_rss_mb"] = peak_rss_mb(proc.pid)
+        proc.terminate()
+        proc.wait(10)
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[基准] 报告已写入 {args.out}，服务进程峰值内存 {report['peak_rss_mb']} MB")
+    if report["uncovered_routes"]:
+        print(f"[基准] 未覆盖的路由: {', '.join(report['uncovered_routes'])}")
+    return 0
+
+
+def compare_reports(base, new, threshold):
+    """逐个场景对比 p95 / p99 延迟和吞吐量（以及服务进程峰值内存），返回 [(场景, 指标, 旧值, 新值, 变化比例, 是否回归)]"""
+    rows = []
+    for name, b in base["scenarios"].items():
+        n = new["scenarios"].get(name)
+        if n is None:
+            continue
+        for metric, old, cur, higher_is_worse in (
+            ("p95_ms", b["latency_ms"]["p95"], n["latency_ms"]["p95"], True),
+            ("p99_ms", b["latency_ms"]["p99"], n["latency_ms"]["p99"], True),
+            ("throughput_rps", b["throughput_rps"], n["throughput_rps"], False),
+        ):
+            change = (cur - old) / old if old else 0.0
+            worse = change > threshold if higher_is_worse else change < -threshold
+            rows.append((name, metric, old, cur, change, worse))
+        if n["errors"] > b["errors"]:
+            rows.append((name, "errors", b["errors"], n["errors"], 0.0, True))
+    old, cur = base.get("peak_rss_mb"), new.get("peak_rss_mb")
+    if old and cur:
+        change = (cur - old) / old
+        rows.append(("(服务进程)", "peak_rss_mb", old, cur, change, change > threshold))
+    return rows
+
+
+def cmd_compare(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    keys = ("mode", "cities", "lines", "stations", "pois", "concurrency", "seed")
+    differ = [k for k in keys if base["meta"].get(k) != new["meta"].get(k)]
+    if differ:
+        print(f"[基准] 注意：两次运行的参数不同（{', '.join(differ)}），结果不完全可比")
+
+    rows = compare_reports(base, new, args.threshold)
+    regressions = [r for r in rows if r[5]]
+    print(f"{'场景':<26}{'指标':<16}{'基准':>12}{'本次':>12}{'变化':>9}")
+    for name, metric, old, cur, change, worse in rows:
+        flag = "  <- 回归" if worse else ""
+        print(f"{name:<26}{metric:<16}{old:>12}{cur:>12}{change:>+9.1%}{flag}")
+    for label, report in (("基准", base), ("本次", new)):
+        print(f"{label}: {report['meta'].get('git_commit')} 峰值内存 {report.get('peak_rss_mb')} MB")
+    print(f"\n{len(regressions)} 项回归（阈值 {args.threshold:.0%}）")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API 基准测试 / 压测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="生成合成数据并压测所有接口")
+    run.add_argument("--mode", choices=("memory", "db"), default="memory")
+    run.add_argument("--cities", type=int, default=2, help="合成城市数")
+    run.add_argument("--lines", type=int, default=10, help="每个城市的线路数")
+    run.add_argument("--stations", type=int, default=500, help="每个城市的站点记录数（近似）")
+    run.add_argument("--pois", type=int, default=20000, help="每个城市的 POI 数")
+    run.add_argument("--users", type=int, default=20, help="db 模式下注册的测试用户数")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=5.0, help="每个场景的压测秒数")
+    run.add_argument("--requests", type=int, default=0, help="每个场景最多请求数（0 表示只按时间）")
+    run.add_argument("--only", help="只运行名称包含这些关键字的场景（逗号分隔）")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", default="benchmark_report.json")
+    run.add_argument("--keep-data", action="store_true", help="保留生成的合成数据目录")
+
+    compare = sub.add_parser("compare", help="对比两份报告，标记回归")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.10, help="变化超过该比例视为回归（默认 10%%）")
+
+    srv = sub.add_parser("serve", help=argparse.SUPPRESS)
+    srv.add_argument("--port", type=int, required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        serve(args.port)
+        return 0
+    return cmd_run(args) if args.command == "run" else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
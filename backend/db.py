@@ -7,29 +7,372 @@
 2) pip install -r backend/requirements.txt
 3) cd backend && python app.py
 前端调试：直接用浏览器打开 frontend 目录下的 login.html / index.html，API 基地址 http://127.0.0.1:5000
+
+连接池（线程安全）：
+- get_conn() 从池中借出连接，conn.close() 归还到池中（不会真正断开），原有写法无需改动；
+- 也可以使用上下文管理器：with connection() as conn: ...
+- 池大小 / 超时通过 .env 配置：DB_POOL_MIN、DB_POOL_MAX、DB_POOL_TIMEOUT、
+  DB_POOL_CHECK_IDLE（空闲超过该秒数借出前先 SELECT 1 检查）、DB_POOL_MAX_LIFETIME（连接最长存活秒数）
+
+计时（见 /metrics）：新建连接耗时、借连接等待时间，以及每条 SQL 的执行时间（按语句类型分组）。
+连接使用 TimedConnection，conn.cursor(cursor_factory=RealDictCursor) 等原有写法得到的游标都会计时，
+并按语句指纹汇总到 query_log（慢查询日志和自动 EXPLAIN，见 slow_query.py）：
+SLOW_QUERY_MS（超过该毫秒数采集执行计划）、SLOW_QUERY_EXPLAIN（analyze / plain / off）、
+SLOW_QUERY_EXPLAIN_INTERVAL（同一语句两次采集的最小间隔秒数）、SLOW_QUERY_MAX_FINGERPRINTS。
 """
 
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
 from dotenv import load_dotenv
 
+from metrics import registry
+from slow_query import QueryLog
+
+
+logger = logging.getLogger(__name__)
+
 
 # 在 backend 目录下加载 .env
 load_dotenv()
 
 
-def get_conn():
-    """获取 PostgreSQL 连接，不直接暴露密码给代码。"""
+class PoolTimeoutError(Exception):
+    """在 DB_POOL_TIMEOUT 秒内没有借到连接。"""
+
+
+DB_CONNECT_SECONDS = registry.histogram("db_connect_seconds", "新建数据库连接耗时（秒）")
+DB_POOL_WAIT_SECONDS = registry.histogram("db_pool_wait_seconds", "从连接池借出连接的等待时间（秒）")
+DB_QUERY_SECONDS = registry.histogram("db_query_duration_seconds", "SQL 执行耗时（秒）", ("statement",))
+DB_QUERY_ERRORS = registry.counter("db_query_errors_total", "执行失败的 SQL 条数", ("statement",))
+
+# 语句类型标签只取这些关键字，其余记为 OTHER，避免标签数量无限增长
+STATEMENT_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY", "SET", "CREATE", "ALTER",
+                   "DROP", "TRUNCATE", "ANALYZE", "EXPLAIN", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def statement_kind(query):
+    """SQL 的第一个关键字（SELECT / INSERT ...），用作指标标签"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    if not isinstance(query, str):
+        return "OTHER"  # psycopg2.sql.Composed 等
+    head = query.lstrip(" \t\r\n(").split(None, 1)
+    kind = head[0].upper() if head else ""
+    return kind if kind in STATEMENT_KINDS else "OTHER"
+
+
+class _TimedCursorMixin:
+    """execute / executemany / copy_expert 计时，并记录到 query_log（只有 execute 的语句会采集执行计划）"""
+
+    def _timed(self, method, args, query, params=None, explainable=False):
+        kind = statement_kind(query)
+        failed = False
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception:
+            failed = True
+            DB_QUERY_ERRORS.inc(statement=kind)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.observe(elapsed, statement=kind)
+            try:
+                text = query if isinstance(query, str) else (
+                    query.decode("utf-8", "replace") if isinstance(query, bytes) else query.as_string(self))
+                query_log.record(text, params, elapsed, kind, failed,
+                                 mogrify=self.mogrify if explainable else None)
+            except Exception:
+                pass  # 统计失败不影响查询本身
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, (query, vars), query, vars, explainable=True)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, (query, vars_list), query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, (sql, file, size), sql)
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(factory):
+    cls = _timed_cursor_classes.get(factory)
+    if cls is None:
+        cls = _timed_cursor_classes[factory] = type(f"Timed{factory.__name__}", (_TimedCursorMixin, factory), {})
+    return cls
+
+
+class TimedConnection(extensions.connection):
+    """cursor() 返回的游标（包括指定了 cursor_factory 的）都会计时"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.pop("cursor_factory", None) or self.cursor_factory or extensions.cursor
+        return super().cursor(*args, cursor_factory=_timed_cursor_class(factory), **kwargs)
+
+
+def _connect():
+    """新建一条 PostgreSQL 连接，不直接暴露密码给代码。"""
+    start = time.perf_counter()
     try:
-        conn = psycopg2.connect(
+        return psycopg2.connect(
             host=os.getenv("DB_HOST"),
             port=os.getenv("DB_PORT"),
             dbname=os.getenv("DB_NAME"),
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PASSWORD"),
+            connection_factory=TimedConnection,
         )
-        return conn
     except Exception as e:
-        print(f"[DB] 数据库连接失败: {e}")
+        logger.error(f"[DB] 数据库连接失败: {e}")
         raise
+    finally:
+        DB_CONNECT_SECONDS.observe(time.perf_counter() - start)
+
+
+class PooledConnection:
+    """借出的连接：属性和方法透传给 psycopg2 连接，close() 改为归还到池中。"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise psycopg2.InterfaceError("连接已归还到连接池")
+        return getattr(raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.putconn(raw)
+
+
+class ConnectionPool:
+    """
+    线程安全的 psycopg2 连接池。
+
+    - 最少保持 min_size 条连接，最多 max_size 条；
+    - 借连接时池已满则等待，超过 timeout 秒抛出 PoolTimeoutError；
+    - 借出前检查：连接已断开 / 超过最长存活时间则重建，空闲过久则先 SELECT 1；
+    - 归还时回滚未提交的事务，避免下一个请求继承脏状态。
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=5.0, check_idle=30.0,
+                 max_lifetime=3600.0, connect=_connect):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(raw_conn, 归还时间)]，后进先出
+        self._born = {}  # id(raw_conn) -> 创建时间
+        self._size = 0  # 已打开的连接数（空闲 + 借出）
+        self._waiting = 0
+        self._stats = {"created": 0, "recycled": 0, "checkouts": 0, "timeouts": 0}
+        self._filled = False
+
+    # ---------- 内部工具 ----------
+    def _open(self):
+        raw = self._connect()
+        with self._cond:
+            self._born[id(raw)] = time.monotonic()
+            self._stats["created"] += 1
+        return raw
+
+    def _discard(self, raw, recycled=True):
+        """关闭连接并释放名额（调用方不持有锁）。"""
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(raw), None)
+            self._size -= 1
+            if recycled:
+                self._stats["recycled"] += 1
+            self._cond.notify()
+
+    def _healthy(self, raw, idle_since):
+        if raw.closed:
+            return False
+        if time.monotonic() - self._born.get(id(raw), 0) > self.max_lifetime:
+            return False
+        if time.monotonic() - idle_since > self.check_idle:
+            try:
+                with raw.cursor() as cur:
+                    cur.execute("SELECT 1")
+                raw.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _fill(self):
+        """首次使用时预建 min_size 条连接。"""
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for _ in range(missing):
+            try:
+                raw = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                continue
+            with self._cond:
+                self._idle.append((raw, time.monotonic()))
+                self._cond.notify()
+
+    # ---------- 对外接口 ----------
+    def getconn(self, timeout=None):
+        """借出一条连接（PooledConnection）。"""
+        self._fill()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            raw = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(f"{timeout}秒内未获取到数据库连接（最大连接数 {self.max_size}）")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    raw, idle_since = self._idle.pop()
+                else:
+                    self._size += 1  # 先占名额，锁外建连接
+
+            if raw is None:
+                try:
+                    raw = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(raw, idle_since):
+                self._discard(raw)
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+            DB_POOL_WAIT_SECONDS.observe(time.monotonic() - started)
+            return PooledConnection(self, raw)
+
+    def putconn(self, raw):
+        """归还连接：未结束的事务回滚，已断开或过期的连接直接关闭。"""
+        if isinstance(raw, PooledConnection):
+            raw.close()
+            return
+        if raw.closed:
+            self._discard(raw)
+            return
+        try:
+            if raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        if time.monotonic() - self._born.get(id(raw), 0) > self.max_lifetime:
+            self._discard(raw)
+            return
+        with self._cond:
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """with pool.connection() as conn: ... 退出时自动归还。"""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self):
+        """连接池状态：借出 / 空闲 / 等待中的线程数，以及累计新建、回收、超时次数。"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._size - idle,
+                "idle": idle,
+                "waiting": self._waiting,
+                **self._stats,
+            }
+
+    def after_fork(self):
+        """fork 出的子进程中调用：丢弃从父进程继承的连接状态（不关闭，socket 仍属于父进程），重新建连"""
+        self._cond = threading.Condition()
+        self._idle = []
+        self._born = {}
+        self._size = 0
+        self._waiting = 0
+        self._filled = False
+
+    def closeall(self):
+        """关闭所有空闲连接（借出中的连接归还时会被正常处理）。"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw, _ in idle:
+            self._discard(raw, recycled=False)
+
+
+pool = ConnectionPool(
+    min_size=int(os.getenv("DB_POOL_MIN", "1")),
+    max_size=int(os.getenv("DB_POOL_MAX", "10")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    check_idle=float(os.getenv("DB_POOL_CHECK_IDLE", "30")),
+    max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+)
+
+
+query_log = QueryLog(
+    connection_fn=pool.connection,
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "200")),
+    explain_mode=os.getenv("SLOW_QUERY_EXPLAIN", "analyze"),
+    explain_interval=float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300")),
+    max_fingerprints=int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "500")),
+)
+
+
+def get_conn():
+    """从连接池获取 PostgreSQL 连接，用完调用 conn.close() 归还。"""
+    return pool.getconn()
+
+
+def connection(timeout=None):
+    """上下文管理器：with connection() as conn: ..."""
+    return pool.connection(timeout)
+
 
+def pool_stats():
+    return pool.stats()
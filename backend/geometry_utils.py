@@ -0,0 +1,97 @@
+"""
+线路几何处理：简化、坐标量化、差分编码
+
+/api/metro/lines 的多级细节（LOD）在预热时由同一份全精度几何一次性生成，
+不需要为每个级别再查一次数据库：
+- simplify_line：Douglas-Peucker 简化（容差单位为度）；
+- quantize：坐标保留 precision 位小数；
+- delta_encode：坐标乘以 10^precision 取整后，首点存绝对值、其余点存与上一点的差，
+  展平为 [x0, y0, dx1, dy1, ...]，相邻点的差通常只有几位数，JSON 体积和解析量都明显减小。
+"""
+
+import math
+
+
+def zoom_to_tolerance(zoom):
+    """缩放级别 -> 简化容差（度）：约为该级别下半个像素（256px 瓦片）对应的经度跨度"""
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+def _point_segment_dist(p, a, b):
+    """点 p 到线段 ab 的距离（平面近似，单位与坐标相同）"""
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(p[0] - ax, p[1] - ay)
+    t = ((p[0] - ax) * dx + (p[1] - ay) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(p[0] - (ax + t * dx), p[1] - (ay + t * dy))
+
+
+def simplify_line(coords, tolerance):
+    """Douglas-Peucker 简化（非递归），保留首尾点；tolerance <= 0 时原样返回"""
+    if tolerance <= 0 or len(coords) <= 2:
+        return list(coords)
+
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            dist = _point_segment_dist(coords[i], coords[first], coords[last])
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, k in zip(coords, keep) if k]
+
+
+def quantize(coords, precision):
+    """坐标保留 precision 位小数，并去掉量化后重复的相邻点"""
+    result = []
+    for x, y, *_ in coords:
+        point = [round(x, precision), round(y, precision)]
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+def delta_encode(coords, precision):
+    """量化为整数后差分编码，返回展平的 [x0, y0, dx1, dy1, ...]"""
+    scale = 10 ** precision
+    flat = []
+    prev_x = prev_y = 0
+    for x, y, *_ in coords:
+        ix, iy = round(x * scale), round(y * scale)
+        if flat and ix == prev_x and iy == prev_y:
+            continue
+        flat.append(ix - prev_x)
+        flat.append(iy - prev_y)
+        prev_x, prev_y = ix, iy
+    return flat
+
+
+def transform_geometry(geometry, tolerance=0.0, precision=6, compact=False):
+    """
+    对 GeoJSON 的 LineString / MultiLineString 做简化 + 量化，compact=True 时输出差分编码；
+    其他类型的几何原样返回。
+    """
+    if not geometry:
+        return geometry
+    geom_type = geometry["type"]
+    if geom_type == "LineString":
+        parts, multi = [geometry["coordinates"]], False
+    elif geom_type == "MultiLineString":
+        parts, multi = geometry["coordinates"], True
+    else:
+        return geometry
+
+    out = []
+    for part in parts:
+        simplified = simplify_line(part, tolerance)
+        out.append(delta_encode(simplified, precision) if compact else quantize(simplified, precision))
+    return {"type": geom_type, "coordinates": out if multi else out[0]}
@@ -0,0 +1,389 @@
+"""
+地铁线路 / 站点 / POI 数据导入
+
+扫描 frontend/data/ 下的数据文件，按城市导入 PostgreSQL：
+- {city}_line.geojson -> metro_line，{city}_stop.json -> metro_station，POI/{city}_poi.json -> poi；
+- 逐条解析文件（GeoJSON 的 features、POI 文件的 pois 数组），不把整个文件读入内存，
+  行数据经 COPY 写入临时表，再用一条 INSERT ... ON CONFLICT 合并进正式表；
+- 每行带内容哈希（content_hash），重复导入时只更新内容有变化的行，未变化的行不会被改写
+  （影响 0 行的语句不会改变 dataset_version 中的数据版本，缓存不会被整体刷新）；
+- --prune 时删除文件中已不存在的行；
+- 多个城市在独立进程中并行导入（--workers），结束时输出每张表的行数和导入速度。
+
+使用前先执行 添加数据导入合并键.sql（content_hash 列和合并用的唯一索引）。
+
+用法：
+    cd backend && python import_metro_data.py
+    python import_metro_data.py --cities nj,sh --tables stations,poi --workers 2 --prune
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from db import connection
+
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "data")
+TABLE_ORDER = ("lines", "stations", "poi")
+READ_CHUNK = 1 << 20  # 流式解析每次读取的字符数
+COPY_BUFFER = 1 << 16  # COPY 每次从行迭代器取出的字节数
+
+
+# ========== 流式读取 ==========
+def iter_json_array(path, key):
+    """
+    逐个产出 JSON 文件中顶层 key 对应数组的元素（如 GeoJSON 的 "features"），内存占用与文件大小无关。
+    用 json.JSONDecoder.raw_decode 从滚动缓冲区中依次解码，元素跨越缓冲区边界时继续读取。
+    """
+    decoder = json.JSONDecoder()
+    start_re = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    with open(path, encoding="utf-8") as f:
+        buf = ""
+        while True:
+            chunk = f.read(READ_CHUNK)
+            buf += chunk
+            match = start_re.search(buf)
+            if match:
+                buf = buf[match.end():]
+                break
+            if not chunk:
+                raise ValueError(f"{path} 中没有 {key} 数组")
+            buf = buf[-len(key) - 16:]  # 保留末尾，防止键名被切断
+
+        pos = 0
+        eof = False
+        while True:
+            # 跳过空白和逗号
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_CHUNK)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+            pos = end
+            if pos > READ_CHUNK:
+                buf, pos = buf[pos:], 0
+
+
+def content_hash(values):
+    """一行数据的内容哈希（值按固定顺序序列化）"""
+    raw = json.dumps(values, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def _copy_value(value):
+    """COPY text 格式的字段：None -> \\N，转义反斜杠、制表符和换行"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class CopyStream:
+    """把行迭代器包装成 copy_expert 可读的文件对象，按需生成 COPY 数据，不拼出整个文件"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = b""
+        self.count = 0
+
+    def read(self, size=-1):
+        size = COPY_BUFFER if size is None or size < 0 else size
+        parts = [self._buf]
+        length = len(self._buf)
+        for row in self._rows:
+            line = ("\t".join(_copy_value(v) for v in row) + "\n").encode("utf-8")
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+            if length >= size:
+                break
+        data = b"".join(parts)
+        self._buf = data[size:]
+        return data[:size]
+
+
+# ========== 各表的行数据 ==========
+def line_rows(path, city_code):
+    # 支线和主线可能同名（如上海 5 号线有两段），line_part 为同名线路在文件中的序号
+    parts = {}
+    for feature in iter_json_array(path, "features"):
+        props = dict(feature.get("properties") or {})
+        name = props.pop("name", None)
+        geometry = feature.get("geometry")
+        if not name or not geometry:
+            continue
+        part = parts[name] = parts.get(name, -1) + 1
+        values = [city_code, name, part, json.dumps(geometry, separators=(",", ":")), props or None]
+        yield values + [content_hash(values)]
+
+
+def station_rows(path, city_code):
+    # 站点文件是按字段组织的对象（{"name": {"0": ...}, "linename": {...}, ...}），无法逐行解析；
+    # 每个城市只有几百到一千多个站点，直接整体读取
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for key, name in data["name"].items():
+        line_number = data.get("x", {}).get(key)
+        values = [
+            city_code, name, data["linename"][key],
+            None if line_number is None else str(line_number),
+            data["lon"][key], data["lat"][key], data["num"][key], data["direction"][key],
+        ]
+        yield values + [content_hash(values)]
+
+
+POI_FIELDS = {"id", "name", "type", "typecode", "type_code", "search_type", "lon", "lat",
+              "address", "tel", "business_area"}
+
+
+def poi_rows(path, city_code):
+    for poi in iter_json_array(path, "pois"):
+        if poi.get("id") is None or poi.get("lon") in (None, "") or poi.get("lat") in (None, ""):
+            continue
+        extra = {k: v for k, v in poi.items() if k not in POI_FIELDS}
+        values = [
+            city_code, str(poi["id"]), poi.get("name"), poi.get("type"),
+            poi.get("type_code", poi.get("typecode")), poi.get("search_type"),
+            float(poi["lon"]), float(poi["lat"]),
+            poi.get("address") or None, poi.get("tel") or None, poi.get("business_area") or None,
+            extra or None,
+        ]
+        yield values + [content_hash(values)]
+
+
+# ========== 各表的导入配置 ==========
+# stage：临时表字段；key：合并键（文件中同一键出现多次时只取一行，计入 duplicates）；
+# merge：从临时表合并进正式表（只改写 content_hash 不同的行），
+# RETURNING (xmax = 0) 区分新增和更新；prune：删除临时表中没有的行
+TABLES = {
+    "lines": {
+        "file": "{city}_line.geojson",
+        "rows": line_rows,
+        "stage": "city_code text, line_name text, line_part smallint, geojson text, properties jsonb, content_hash text",
+        "key": "line_name, line_part",
+        "merge": """
+            INSERT INTO metro_line (city_code, line_name, line_part, line_geom, properties, content_hash)
+            SELECT DISTINCT ON (line_name, line_part)
+                   city_code, line_name, line_part, ST_SetSRID(ST_GeomFromGeoJSON(geojson), 4326),
+                   properties, content_hash
+            FROM stage
+            ORDER BY line_name, line_part
+            ON CONFLICT (city_code, line_name, line_part) DO UPDATE SET
+                line_geom = EXCLUDED.line_geom,
+                properties = EXCLUDED.properties,
+                content_hash = EXCLUDED.content_hash
+            WHERE metro_line.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            RETURNING (xmax = 0) AS inserted
+        """,
+        "prune": """
+            DELETE FROM metro_line t WHERE t.city_code = %s
+                AND NOT EXISTS (SELECT 1 FROM stage s
+                                WHERE s.line_name = t.line_name AND s.line_part = t.line_part)
+        """,
+    },
+    "stations": {
+        "file": "{city}_stop.json",
+        "rows": station_rows,
+        "stage": ("city_code text, station_name text, line_name text, line_number text, "
+                  "lon double precision, lat double precision, station_num integer, direction integer, "
+                  "content_hash text"),
+        "key": "line_name, station_num",
+        "merge": """
+            INSERT INTO metro_station (city_code, station_name, line_name, line_number, lon, lat,
+                                       station_num, direction, location, content_hash)
+            SELECT DISTINCT ON (line_name, station_num)
+                   city_code, station_name, line_name, line_number, lon, lat, station_num, direction,
+                   ST_SetSRID(ST_MakePoint(lon, lat), 4326), content_hash
+            FROM stage
+            ORDER BY line_name, station_num
+            ON CONFLICT (city_code, line_name, station_num) DO UPDATE SET
+                station_name = EXCLUDED.station_name,
+                line_number = EXCLUDED.line_number,
+                lon = EXCLUDED.lon,
+                lat = EXCLUDED.lat,
+                direction = EXCLUDED.direction,
+                location = EXCLUDED.location,
+                content_hash = EXCLUDED.content_hash
+            WHERE metro_station.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            RETURNING (xmax = 0) AS inserted
+        """,
+        "prune": """
+            DELETE FROM metro_station t WHERE t.city_code = %s
+                AND NOT EXISTS (SELECT 1 FROM stage s
+                                WHERE s.line_name = t.line_name AND s.station_num = t.station_num)
+        """,
+    },
+    "poi": {
+        "file": os.path.join("POI", "{city}_poi.json"),
+        "rows": poi_rows,
+        "stage": ("city_code text, external_id text, poi_name text, poi_type text, type_code text, "
+                  "search_type text, lon double precision, lat double precision, address text, tel text, "
+                  "business_area text, properties jsonb, content_hash text"),
+        "key": "external_id",
+        "merge": """
+            INSERT INTO poi (city_code, external_id, poi_name, poi_type, type_code, search_type,
+                             lon, lat, address, tel, business_area, properties, location, content_hash)
+            SELECT DISTINCT ON (external_id)
+                   city_code, external_id, poi_name, poi_type, type_code, search_type,
+                   lon, lat, address, tel, business_area, properties,
+                   ST_SetSRID(ST_MakePoint(lon, lat), 4326), content_hash
+            FROM stage
+            ORDER BY external_id
+            ON CONFLICT (city_code, external_id) DO UPDATE SET
+                poi_name = EXCLUDED.poi_name,
+                poi_type = EXCLUDED.poi_type,
+                type_code = EXCLUDED.type_code,
+                search_type = EXCLUDED.search_type,
+                lon = EXCLUDED.lon,
+                lat = EXCLUDED.lat,
+                address = EXCLUDED.address,
+                tel = EXCLUDED.tel,
+                business_area = EXCLUDED.business_area,
+                properties = EXCLUDED.properties,
+                location = EXCLUDED.location,
+                content_hash = EXCLUDED.content_hash
+            WHERE poi.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            RETURNING (xmax = 0) AS inserted
+        """,
+        "prune": """
+            DELETE FROM poi t WHERE t.city_code = %s
+                AND NOT EXISTS (SELECT 1 FROM stage s WHERE s.external_id = t.external_id)
+        """,
+    },
+}
+
+
+# ========== 导入 ==========
+def import_table(conn, table, city_code, path, prune=False):
+    """导入一个城市的一张表（一个事务），返回统计信息"""
+    spec = TABLES[table]
+    t0 = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE stage ({spec['stage']}) ON COMMIT DROP")
+        stream = CopyStream(spec["rows"](path, city_code))
+        cur.copy_expert("COPY stage FROM STDIN", stream, size=COPY_BUFFER)
+        copy_s = time.perf_counter() - t0
+
+        cur.execute(f"SELECT COUNT(*) - COUNT(DISTINCT ({spec['key']})) FROM stage")
+        duplicates = cur.fetchone()[0]
+        cur.execute(spec["merge"])
+        flags = [row[0] for row in cur.fetchall()]
+        deleted = 0
+        if prune:
+            cur.execute(spec["prune"], (city_code,))
+            deleted = cur.rowcount
+    conn.commit()
+
+    elapsed = time.perf_counter() - t0
+    inserted = sum(1 for f in flags if f)
+    return {
+        "city": city_code,
+        "table": table,
+        "rows": stream.count,
+        "inserted": inserted,
+        "updated": len(flags) - inserted,
+        "unchanged": stream.count - duplicates - len(flags),
+        "duplicates": duplicates,
+        "deleted": deleted,
+        "copy_s": round(copy_s, 3),
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(stream.count / elapsed) if elapsed > 0 else 0,
+    }
+
+
+def import_city(data_dir, city_code, tables, prune=False):
+    """导入一个城市的各张表（在独立进程中运行），返回统计信息列表；缺少的文件跳过"""
+    results = []
+    with connection() as conn:
+        for table in tables:
+            path = os.path.join(data_dir, TABLES[table]["file"].format(city=city_code))
+            if not os.path.exists(path):
+                continue
+            try:
+                stats = import_table(conn, table, city_code, path, prune)
+            except Exception as e:
+                conn.rollback()
+                print(f"[导入] {city_code}/{table} 失败: {e}")
+                results.append({"city": city_code, "table": table, "error": str(e)})
+                continue
+            print(f"[导入] {city_code}/{table}: {stats['rows']}行, 新增{stats['inserted']}, "
+                  f"更新{stats['updated']}, 未变{stats['unchanged']}, 重复{stats['duplicates']}, 删除{stats['deleted']}, "
+                  f"耗时{stats['seconds']}s ({stats['rows_per_s']}行/s)")
+            results.append(stats)
+    return results
+
+
+def discover_cities(data_dir):
+    """按数据文件名找出所有城市（如 nj_line.geojson、nj_stop.json -> nj）"""
+    cities = set()
+    for name in os.listdir(data_dir):
+        match = re.match(r"^([a-z]+)_(line\.geojson|stop\.json)$", name)
+        if match:
+            cities.add(match.group(1))
+    return sorted(cities)
+
+
+def print_summary(results, elapsed):
+    """按表汇总行数和速度"""
+    print("\n表            行数      新增      更新      未变      重复      删除    行/秒")
+    for table in TABLE_ORDER:
+        items = [r for r in results if r["table"] == table and "error" not in r]
+        if not items:
+            continue
+        total = {k: sum(r[k] for r in items)
+                 for k in ("rows", "inserted", "updated", "unchanged", "duplicates", "deleted")}
+        seconds = sum(r["seconds"] for r in items)
+        rate = round(total["rows"] / seconds) if seconds > 0 else 0
+        print(f"{table:<10}{total['rows']:>10}{total['inserted']:>10}{total['updated']:>10}"
+              f"{total['unchanged']:>10}{total['duplicates']:>10}{total['deleted']:>10}{rate:>9}")
+    errors = [r for r in results if "error" in r]
+    print(f"共耗时 {elapsed:.1f}s" + (f"，{len(errors)} 项失败" if errors else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导入地铁线路、站点和 POI 数据")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="数据目录（默认 frontend/data）")
+    parser.add_argument("--cities", help="逗号分隔的城市代码，默认按数据文件自动识别")
+    parser.add_argument("--tables", default=",".join(TABLE_ORDER), help="逗号分隔：lines,stations,poi")
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 4), help="并行导入的城市数")
+    parser.add_argument("--prune", action="store_true", help="删除数据文件中已不存在的行")
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.abspath(args.data_dir)
+    cities = args.cities.split(",") if args.cities else discover_cities(data_dir)
+    tables = [t for t in TABLE_ORDER if t in args.tables.split(",")]
+    print(f"[导入] 数据目录 {data_dir}，城市 {', '.join(cities)}，表 {', '.join(tables)}")
+
+    t0 = time.perf_counter()
+    results = []
+    if args.workers <= 1 or len(cities) <= 1:
+        for city in cities:
+            results.extend(import_city(data_dir, city, tables, args.prune))
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(cities))) as executor:
+            futures = [executor.submit(import_city, data_dir, city, tables, args.prune) for city in cities]
+            for future in as_completed(futures):
+                results.extend(future.result())
+    print_summary(results, time.perf_counter() - t0)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
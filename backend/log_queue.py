@@ -0,0 +1,86 @@
+"""
+非阻塞日志
+
+请求线程中直接 print 是同步写 stdout，终端 / 管道阻塞时会拖慢请求。这里把 logging 的根处理器换成
+QueueHandler：请求线程只把日志记录放进有界队列（不等待），由后台 QueueListener 线程格式化并写出。
+- 队列满时丢弃该条日志并计数（dropped），不阻塞请求；
+- 日志级别由 LOG_LEVEL 配置（默认 INFO），进程退出时写完队列中剩余的日志；
+- 各模块使用 logging.getLogger(__name__)，werkzeug 的访问日志同样经过队列。
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃，不抛异常也不等待"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+_stream = None
+
+
+def setup_logging(level=None, max_queue=None):
+    """把根 logger 的输出改为经过队列（重复调用只生效一次）"""
+    global _handler, _listener, _stream
+    with _lock:
+        if _handler is not None:
+            return _handler
+        log_queue = queue.Queue(maxsize=max_queue or int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        _stream = logging.StreamHandler(sys.stdout)
+        _stream.setFormatter(logging.Formatter(LOG_FORMAT))
+        _handler = _DroppingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, _stream, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level or os.getenv("LOG_LEVEL", "INFO").upper())
+        _listener.start()
+        atexit.register(_stop_listener)
+        return _handler
+
+
+def after_fork():
+    """fork 出的子进程中调用：写出线程不会被继承，换一个新队列并重新启动写出线程"""
+    global _listener
+    with _lock:
+        if _handler is None:
+            return
+        _handler.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+        _listener = logging.handlers.QueueListener(_handler.queue, _stream, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop_listener():
+    """进程退出时写完队列中剩余的日志"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def stats():
+    """排队中 / 因队列满丢弃的日志条数"""
+    if _handler is None:
+        return {"enabled": False, "queued": 0, "dropped": 0}
+    return {"enabled": True, "queued": _handler.queue.qsize(), "dropped": _handler.dropped}
@@ -0,0 +1,178 @@
+"""
+登录审计异步写入（write-behind）
+
+登录成功后原来要在请求事务里同步执行 UPDATE app_user.last_login_at 和 INSERT user_login_log，
+这是最频繁的用户操作，两次写入加一次提交都算在响应时间里。现在请求只把登录事件放进内存队列，
+由后台线程批量写入：
+- 攒够 LOGIN_AUDIT_BATCH 条或距上次写入超过 LOGIN_AUDIT_INTERVAL 秒时写一次；
+- user_login_log 用一条多行 INSERT（execute_values）写入，last_login_at 用一条 UPDATE ... FROM (VALUES ...)
+  批量更新（同一用户取最近一次登录时间）；
+- 队列有上限 LOGIN_AUDIT_QUEUE，满了直接丢弃并计数（dropped），不阻塞登录；
+- 写入失败的批次会在下一次写入时重试，超过重试次数后丢弃并计数（failed）；
+- 进程退出时 close() 把队列中剩余的事件写完。
+
+登录时间在 record() 时取得，显式写入 user_login_log 的登录时间列（LOGIN_AUDIT_TIME_COLUMN，默认 login_at），
+和 last_login_at 一样是实际登录的时间，不受写入周期和重试的影响。
+"""
+
+import datetime
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+_COLUMN_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+class LoginAuditWriter:
+    """批量写入登录事件的后台线程；connection_fn 为返回连接上下文管理器的函数（如 db.connection）"""
+
+    def __init__(self, connection_fn, batch_size=200, interval=1.0, max_queue=10000, time_column="login_at"):
+        if not _COLUMN_RE.match(time_column):
+            raise ValueError(f"无效的列名: {time_column!r}")
+        self.connection_fn = connection_fn
+        self.time_column = time_column
+        self.batch_size = batch_size
+        self.interval = interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._retry = []  # [(事件, 已尝试次数)]
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            # fork 出的子进程中继承的线程对象已不在运行，需要重新启动
+            if (self._thread is None or not self._thread.is_alive()) and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name="login-audit", daemon=True)
+                self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    # ---------- 对外接口 ----------
+    def record(self, user_id, ip_address, user_agent):
+        """登录成功时调用：只入队，不访问数据库；队列已满返回 False"""
+        self._ensure_started()
+        event = (user_id, ip_address, user_agent, datetime.datetime.now(datetime.timezone.utc))
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    def close(self, timeout=10.0):
+        """停止后台线程，并把队列中剩余的事件写入数据库"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            self._drain()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "pending": self._queue.qsize() + len(self._retry),
+                "max_queue": self._queue.maxsize,
+                "batch_size": self.batch_size,
+                "interval": self.interval,
+                **self._stats,
+            }
+
+    # ---------- 后台线程 ----------
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch and not self._flush(batch):
+                self._stop.wait(self.interval)  # 写入失败后等一个周期再重试
+        self._drain()
+
+    def _collect(self):
+        """取出一批事件：攒够 batch_size 条或等满 interval 秒"""
+        batch = self._retry
+        self._retry = []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append((self._queue.get(timeout=remaining), 0))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = self._retry
+        self._retry = []
+        while True:
+            try:
+                batch.append((self._queue.get_nowait(), 0))
+            except queue.Empty:
+                break
+        for start in range(0, len(batch), self.batch_size):
+            self._flush(batch[start:start + self.batch_size], retry=False)
+
+    def _flush(self, batch, retry=True):
+        events = [event for event, _ in batch]
+        last_login = {}
+        for user_id, _, _, logged_at in events:
+            if user_id not in last_login or logged_at > last_login[user_id]:
+                last_login[user_id] = logged_at
+
+        try:
+            with self.connection_fn() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        execute_values(cur, f"""
+                            INSERT INTO user_login_log (user_id, ip_address, user_agent, {self.time_column}) VALUES %s
+                        """, events, template="(%s, %s, %s, %s::timestamptz)", page_size=self.batch_size)
+                        execute_values(cur, """
+                            UPDATE app_user AS u SET last_login_at = v.logged_at
+                            FROM (VALUES %s) AS v(user_id, logged_at)
+                            WHERE u.user_id = v.user_id
+                              AND (u.last_login_at IS NULL OR u.last_login_at < v.logged_at)
+                        """, list(last_login.items()), template="(%s, %s::timestamptz)",
+                            page_size=self.batch_size)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            logger.error(f"[登录审计] 批量写入 {len(events)} 条失败: {e}")
+            keep = [(event, attempts + 1) for event, attempts in batch if attempts + 1 < MAX_ATTEMPTS]
+            if retry:
+                self._retry = keep + self._retry
+            self._count("failed", len(batch) - (len(keep) if retry else 0))
+            return False
+
+        self._count("written", len(events))
+        self._count("batches")
+        return True
+
+
+def create_writer(connection_fn):
+    return LoginAuditWriter(
+        connection_fn,
+        batch_size=int(os.getenv("LOGIN_AUDIT_BATCH", "200")),
+        interval=float(os.getenv("LOGIN_AUDIT_INTERVAL", "1")),
+        max_queue=int(os.getenv("LOGIN_AUDIT_QUEUE", "10000")),
+        time_column=os.getenv("LOGIN_AUDIT_TIME_COLUMN", "login_at"),
+    )
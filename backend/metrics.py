@@ -0,0 +1,194 @@
+"""
+进程内指标（Prometheus 文本格式，GET /metrics）
+
+- Counter / Gauge / Histogram 三种指标，按标签组合分别计数，线程安全，记录一次只是一次加锁的加法；
+- 已有 stats() 的组件（连接池、缓存、登录审计等）不重复计数，通过 register_collector 在抓取时读取；
+- 不依赖 prometheus_client，输出格式与其一致（text/plain; version=0.0.4），可直接被 Prometheus 抓取。
+
+多进程部署时每个 worker 各自计数，由 Prometheus 按实例分别抓取后汇总。
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 秒；覆盖从缓存命中（约 1ms）到慢查询（数秒）的范围
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # 标签值元组 -> 数值（直方图为 [各桶计数..., 总和]）
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    kind = "counter"
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(k), v) for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """可增可减的当前值（如处理中的请求数）"""
+
+    kind = "gauge"
+
+    def dec(self, n=1, **labels):
+        self.inc(-n, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """按固定桶统计分布，输出 _bucket（累计）/ _sum / _count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        result = []
+        for key, counts in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                result.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            result.append((f"{self.name}_sum", labels, round(counts[-1], 6)))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+class Registry:
+    """指标注册表；collector() 返回 [(名称, 类型, 说明, [(标签 dict, 数值)])]，在每次抓取时调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # 模块被重复导入时复用同一指标
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def reset(self):
+        """清空所有指标的数值（保留指标定义）；fork 出的 worker 中调用，不继承主进程的计数"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:  # 某个组件读取失败不影响其他指标
+                lines.append(f"# collector error: {_escape(e)}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,268 @@
+"""
+地铁数据缓存
+
+- 线路 / 站点数据在写入缓存时一次性完成 JSON 序列化和压缩（identity / gzip / brotli 三份），
+  并用内容哈希作为 ETag。命中缓存时只需按 Accept-Encoding 取出对应字节直接返回，
+  不再重复 jsonify 和 gzip；
+- MetroCache 负责容量上限（LRU）、过期时间、按城市 / 数据集失效，以及按数据库版本自动刷新。
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import brotli  # flask-compress 的依赖，通常已安装
+except ImportError:  # pragma: no cover - 未安装时只提供 gzip
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+GZIP_LEVEL = 9  # 只在写缓存时压缩一次，用最高压缩率
+BROTLI_QUALITY = 11
+# 城市代码的合法格式；城市代码会进入缓存键和磁盘缓存的目录名，各缓存写盘前都先校验
+CITY_CODE_RE = re.compile(r"^[a-z]{2,10}$")
+
+
+class EncodedPayload:
+    """一份数据的多种编码：bodies = {"identity": bytes, "gzip": bytes, "br": bytes}"""
+
+    __slots__ = ("bodies", "etag", "created_at", "meta")
+
+    def __init__(self, bodies, etag, meta=None):
+        self.bodies = bodies
+        self.etag = etag
+        self.created_at = time.time()
+        self.meta = meta or {}
+
+    @property
+    def size(self):
+        return sum(len(b) for b in self.bodies.values())
+
+    def choose(self, accept_encoding):
+        """按客户端 Accept-Encoding 选择编码，返回 (编码名, 字节)"""
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, 0) > 0:
+                return encoding, self.bodies[encoding]
+        return "identity", self.bodies["identity"]
+
+    def etag_for(self, encoding):
+        """不同编码是不同的表示，ETag 加上编码后缀（比较时只看哈希部分）"""
+        if encoding == "identity":
+            return f'"{self.etag}"'
+        return f'"{self.etag}-{encoding}"'
+
+    def matches(self, if_none_match):
+        """If-None-Match 是否命中当前内容"""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            tag = tag.removeprefix("W/").strip('"')
+            if tag.split("-", 1)[0] == self.etag:
+                return True
+        return False
+
+
+def _parse_accept_encoding(header):
+    """解析 Accept-Encoding，返回 {编码: q值}"""
+    result = {}
+    for part in (header or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name.strip().lower()] = q
+    return result
+
+
+def encode_payload(data, meta=None):
+    """序列化 + 预压缩，返回 EncodedPayload"""
+    identity = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return encode_bytes(identity, meta)
+
+
+def encode_bytes(identity, meta=None):
+    """已序列化的字节（如 MessagePack / Arrow）预压缩，返回 EncodedPayload；meta["mimetype"] 为响应类型"""
+    bodies = {
+        "identity": identity,
+        "gzip": gzip.compress(identity, compresslevel=GZIP_LEVEL, mtime=0),
+    }
+    if brotli is not None:
+        bodies["br"] = brotli.compress(identity, quality=BROTLI_QUALITY)
+    etag = hashlib.sha1(identity).hexdigest()[:20]
+    return EncodedPayload(bodies, etag, meta)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "version", "expires_at")
+
+    def __init__(self, value, size, version, expires_at):
+        self.value = value
+        self.size = size
+        self.version = version
+        self.expires_at = expires_at
+
+
+class MetroCache:
+    """
+    有容量上限、带版本的地铁数据缓存。
+
+    - 键为 (dataset, city_code, variant)，dataset 如 "lines" / "stations"，
+      variant 用于同一数据的不同形式（如简化级别），默认 ""；
+    - 总字节数超过 max_bytes 时按 LRU 淘汰；每个条目 ttl 秒后过期；
+    - 每个 (dataset, city) 记录写入时的数据版本，每隔 version_interval 秒
+      调用 version_fn(dataset, city_code) 取一次最新版本，不一致则丢弃该城市该数据集的全部条目，
+      数据库中 metro_line / metro_station 有改动后无需重启即可自动刷新。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=3600, version_interval=30, version_fn=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.version_fn = version_fn
+
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._checked = {}  # (dataset, city_code) -> (上次检查时间, 最新版本)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                       "invalidations": 0, "version_changes": 0}
+        self._events = {}  # (计数名, dataset, city_code) -> 次数，供 /metrics 按城市 / 数据集输出
+
+    # ---------- 内部工具 ----------
+    def _count(self, counter, key, n=1):
+        """累加总计数和按 (dataset, city) 的计数（调用方持有锁）"""
+        self._stats[counter] += n
+        event = (counter, key[0], key[1])
+        self._events[event] = self._events.get(event, 0) + n
+
+    def _drop(self, key, counter=None):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            if counter:
+                self._count(counter, key)
+        return entry is not None
+
+    def _check_version(self, dataset, city_code, force=False):
+        """到期（或 force=True）时查询一次数据版本，版本变化则失效该城市该数据集的所有条目"""
+        if self.version_fn is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            last = self._checked.get((dataset, city_code))
+            if not force and last is not None and now - last[0] < self.version_interval:
+                return
+            # 先记下检查时间，避免并发请求同时查库
+            self._checked[(dataset, city_code)] = (now, last[1] if last else None)
+        try:
+            version = self.version_fn(dataset, city_code)
+        except Exception as e:
+            logger.warning(f"[缓存] 获取数据版本失败 {dataset}/{city_code}: {e}")
+            return
+        with self._lock:
+            self._checked[(dataset, city_code)] = (now, version)
+            changed = self._drop_stale(dataset, city_code, version)
+        changed = self._drop_stale_unlocked(dataset, city_code, version) or changed
+        if changed:
+            with self._lock:
+                self._count("version_changes", (dataset, city_code))
+
+    def _drop_stale(self, dataset, city_code, version):
+        """删除版本与 version 不一致的条目，返回是否有删除（调用方持有锁）"""
+        stale = [k for k, e in self._entries.items()
+                 if k[0] == dataset and k[1] == city_code and e.version != version]
+        for key in stale:
+            self._drop(key)
+        return bool(stale)
+
+    def _drop_stale_unlocked(self, dataset, city_code, version):
+        """在锁外执行的过期清理（子类用于共享目录等需要 I/O 的存储），返回是否有删除"""
+        return False
+
+    # ---------- 对外接口 ----------
+    def get(self, dataset, city_code, variant=""):
+        self._check_version(dataset, city_code)
+        key = (dataset, city_code, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count("misses", key)
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key, "expirations")
+                self._count("misses", key)
+                return None
+            self._entries.move_to_end(key)
+            self._count("hits", key)
+            return entry.value
+
+    def put(self, dataset, city_code, value, version=None, variant="", size=None):
+        """写入缓存；size 默认取 value.size（EncodedPayload 的字节数）"""
+        size = value.size if size is None else size
+        key = (dataset, city_code, variant)
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                return  # 单个条目超过总预算，不缓存
+            self._entries[key] = _Entry(value, size, version, time.monotonic() + self.ttl)
+            self._bytes += size
+            if version is not None:
+                self._checked.setdefault((dataset, city_code), (time.monotonic(), version))
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest, "evictions")
+
+    def check_version(self, dataset, city_code):
+        """立即查询一次数据版本（不等 version_interval），丢弃旧版本的条目；预热前调用，避免把旧数据当作已缓存"""
+        self._check_version(dataset, city_code, force=True)
+
+    def contains(self, dataset, city_code, variant=""):
+        with self._lock:
+            entry = self._entries.get((dataset, city_code, variant))
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def invalidate(self, city_code=None, dataset=None):
+        """按城市 / 数据集失效，均为 None 时清空全部；返回删除的条目数"""
+        with self._lock:
+            keys = [k for k in self._entries
+                    if (city_code is None or k[1] == city_code) and (dataset is None or k[0] == dataset)]
+            for key in keys:
+                self._drop(key, "invalidations")
+            for checked in [k for k in self._checked
+                            if (city_code is None or k[1] == city_code) and (dataset is None or k[0] == dataset)]:
+                del self._checked[checked]
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "keys": ["/".join(filter(None, k)) for k in self._entries],
+                **self._stats,
+            }
+
+    def event_counts(self):
+        """{(计数名, dataset, city_code): 次数}，计数名为 hits / misses / evictions / expirations 等"""
+        with self._lock:
+            return dict(self._events)
@@ -0,0 +1,228 @@
+"""
+文件数据源（METRO_DATA_BACKEND=file）
+
+地铁线路、站点本质上是静态数据，frontend/data/ 中已经附带了全部文件。CI 和边缘节点上
+不必为了读取这些数据部署 PostgreSQL / PostGIS：文件模式下 /api/metro/lines、/api/metro/stations、
+/api/poi、/api/poi/nearby 直接从文件读取，返回与数据库模式完全相同的结构，不访问数据库。
+
+- 每个城市的文件在第一次使用时读取一次，按「修改时间:大小」作为数据版本，文件被替换后自动重新读取
+  （缓存层的版本检查同样适用）；
+- 行数据与数据库查询结果字段一致（线路的 geometry 为 GeoJSON 文本，与 ST_AsGeoJSON 相同），
+  后续的 GeoJSON / 列式编码、路网和搜索索引构建都复用数据库模式的代码；
+- POI 预先按 (名称, id) 排序并按类型分组，附近查询复用内存 POI 网格索引（poi_index.PoiGridIndex，
+  需要 numpy；未安装时按外扩矩形逐条过滤）；
+- 只接受 data_dir 中有站点文件的城市（cities()，目录列表缓存 city_ttl 秒），其他城市代码抛出 UnknownCityError，
+  不会拼出数据目录以外的路径。
+
+用户、收藏等其余接口仍然需要数据库；矢量切片、POI 关键字搜索等依赖 PostGIS 的接口在文件模式下不可用。
+"""
+
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from import_metro_data import POI_FIELDS, iter_json_array
+from metro_cache import CITY_CODE_RE
+from poi_index import METERS_PER_DEGREE, PoiGridIndex, available as grid_index_available
+
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6371008.8
+GRID_CELL_DEG = 0.005
+
+DATASET_FILES = {
+    "lines": "{city}_line.geojson",
+    "stations": "{city}_stop.json",
+    "poi": os.path.join("POI", "{city}_poi.json"),
+}
+
+
+class UnknownCityError(ValueError):
+    """数据目录中没有该城市的数据文件"""
+
+
+def _haversine(lon1, lat1, lon2, lat2):
+    lat1, lat2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class PoiFileIndex:
+    """单个城市的 POI：按 (名称, id) 排序的列表、按类型分组，附近查询用 PoiGridIndex"""
+
+    def __init__(self, rows, cell_deg=GRID_CELL_DEG):
+        self.rows = sorted(rows, key=lambda r: (r["name"] or "", r["id"]))
+        self.keys = [(r["name"] or "", r["id"]) for r in self.rows]
+        self.by_type = {}  # 类型 -> 下标列表（保持排序）
+        self.type_keys = {}  # 类型 -> 对应的 (名称, id) 列表，供分页二分查找
+        for i, row in enumerate(self.rows):
+            self.by_type.setdefault(row["type"], []).append(i)
+            self.type_keys.setdefault(row["type"], []).append(self.keys[i])
+        self.grid = PoiGridIndex(self.rows, cell_deg) if grid_index_available() else None
+
+    def select(self, poi_type=None):
+        """按 (名称, id) 排序的 POI（可按类型筛选）"""
+        if poi_type is None:
+            return self.rows
+        return [self.rows[i] for i in self.by_type.get(poi_type, [])]
+
+    def page(self, poi_type, limit, after=None):
+        """键集分页：(名称, id) 大于 after 的前 limit + 1 条（多取一条用于判断是否还有下一页）"""
+        if poi_type is None:
+            start = bisect.bisect_right(self.keys, tuple(after)) if after else 0
+            return self.rows[start:start + limit + 1]
+        indexes = self.by_type.get(poi_type, [])
+        start = bisect.bisect_right(self.type_keys.get(poi_type, []), tuple(after)) if after else 0
+        return [self.rows[i] for i in indexes[start:start + limit + 1]]
+
+    def nearby(self, lon, lat, radius, limit):
+        """radius 米内的 POI，按距离升序，返回 [(row, 距离米)]"""
+        if self.grid is not None:
+            return self.grid.query_radius(lon, lat, radius, limit)
+
+        d_lat = radius / METERS_PER_DEGREE
+        d_lon = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        found = []
+        for i, row in enumerate(self.rows):
+            if abs(row["lon"] - lon) <= d_lon and abs(row["lat"] - lat) <= d_lat:
+                distance = _haversine(lon, lat, row["lon"], row["lat"])
+                if distance <= radius:
+                    found.append((distance, i))
+        found.sort()
+        return [(self.rows[i], distance) for distance, i in found[:limit]]
+
+
+class FileRepository:
+    """从 data_dir（默认 frontend/data）读取地铁线路、站点和 POI"""
+
+    def __init__(self, data_dir, city_ttl=30):
+        self.data_dir = os.path.abspath(data_dir)
+        self.city_ttl = city_ttl
+        self._lock = threading.Lock()
+        self._loaded = {}  # (dataset, city_code) -> (版本, 数据)
+        self._cities = (float("-inf"), frozenset())  # (读取时间, 城市集合)
+
+    def _path(self, dataset, city_code):
+        if not isinstance(city_code, str) or not CITY_CODE_RE.match(city_code) or city_code not in self._city_set():
+            raise UnknownCityError(f"未知城市: {city_code!r}")
+        return os.path.join(self.data_dir, DATASET_FILES[dataset].format(city=city_code))
+
+    def _city_set(self):
+        """有站点文件的城市集合；目录列表缓存 city_ttl 秒，每次请求不必 listdir"""
+        loaded_at, cities = self._cities
+        if time.monotonic() - loaded_at < self.city_ttl:
+            return cities
+        cities = frozenset(city for name in os.listdir(self.data_dir)
+                           if name.endswith("_stop.json") and CITY_CODE_RE.match(city := name[:-len("_stop.json")]))
+        self._cities = (time.monotonic(), cities)
+        return cities
+
+    def cities(self):
+        """按站点文件名列出城市"""
+        return sorted(self._city_set())
+
+    def version(self, dataset, city_code):
+        """文件的「修改时间:大小」，文件不存在时为 "0:0"（与空表的版本形式一致）"""
+        try:
+            st = os.stat(self._path(dataset, city_code))
+        except FileNotFoundError:
+            return "0:0"
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def _get(self, dataset, city_code, loader):
+        version = self.version(dataset, city_code)
+        cached = self._loaded.get((dataset, city_code))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._loaded.get((dataset, city_code))
+            if cached is None or cached[0] != version:
+                path = self._path(dataset, city_code)
+                data = loader(path, city_code) if os.path.exists(path) else loader(None, city_code)
+                cached = self._loaded[(dataset, city_code)] = (version, data)
+                logger.info(f"[文件数据] 已读取 {dataset}: {city_code}")
+        return cached[1]
+
+    # ---------- 文件解析，行格式与数据库查询结果一致 ----------
+    @staticmethod
+    def _read_lines(path, city_code):
+        if path is None:
+            return []
+        rows = []
+        for i, feature in enumerate(iter_json_array(path, "features")):
+            props = dict(feature.get("properties") or {})
+            geometry = feature.get("geometry")
+            rows.append({
+                "line_id": i + 1,
+                "city_code": city_code,
+                "line_name": props.pop("name", None),
+                "geometry": json.dumps(geometry, separators=(",", ":")) if geometry else None,
+                "properties": props or None,
+            })
+        rows.sort(key=lambda r: r["line_name"] or "")  # 与 METRO_LINES_SQL 的 ORDER BY line_name 一致
+        return rows
+
+    @staticmethod
+    def _read_stations(path, city_code):
+        if path is None:
+            return []
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        rows = []
+        for i, (key, name) in enumerate(data["name"].items()):
+            line_number = data.get("x", {}).get(key)
+            rows.append({
+                "station_id": i + 1,
+                "city_code": city_code,
+                "name": name,
+                "linename": data["linename"][key],
+                "line_number": None if line_number is None else str(line_number),
+                "lon": data["lon"][key],
+                "lat": data["lat"][key],
+                "num": data["num"][key],
+                "direction": data["direction"][key],
+                "properties": None,
+            })
+        rows.sort(key=lambda r: (r["linename"] or "", r["num"] or 0))  # ORDER BY line_name, station_num
+        return rows
+
+    @staticmethod
+    def _read_pois(path, city_code):
+        if path is None:
+            return PoiFileIndex([])
+        rows = []
+        for poi in iter_json_array(path, "pois"):
+            if poi.get("id") is None or poi.get("lon") in (None, "") or poi.get("lat") in (None, ""):
+                continue
+            props = {k: v for k, v in poi.items() if k not in POI_FIELDS}
+            rows.append({
+                "id": str(poi["id"]),
+                "name": poi.get("name"),
+                "type": poi.get("type"),
+                "type_code": poi.get("type_code", poi.get("typecode")),
+                "search_type": poi.get("search_type"),
+                "lon": float(poi["lon"]),
+                "lat": float(poi["lat"]),
+                "address": poi.get("address") or None,
+                "tel": poi.get("tel") or None,
+                "business_area": poi.get("business_area") or None,
+                "properties": props or None,
+            })
+        return PoiFileIndex(rows)
+
+    # ---------- 对外接口 ----------
+    def lines(self, city_code):
+        return self._get("lines", city_code, self._read_lines)
+
+    def stations(self, city_code):
+        return self._get("stations", city_code, self._read_stations)
+
+    def pois(self, city_code):
+        """城市的 PoiFileIndex"""
+        return self._get("poi", city_code, self._read_pois)
@@ -0,0 +1,138 @@
+"""
+密码哈希执行器
+
+generate_password_hash / check_password_hash（scrypt、PBKDF2）故意设计得很耗 CPU，
+在请求线程里直接调用时，一波登录请求就会占满所有线程，连查询地铁数据这类轻量接口也要排队。
+这里把哈希计算放到独立的进程池中：
+- 进程数 PASSWORD_HASH_WORKERS（默认 CPU 核数的一半，至少 1；设为 0 时在当前线程中计算）；
+- 排队上限 PASSWORD_HASH_QUEUE，已满时直接抛出 HashQueueFullError，接口返回 503 + Retry-After，
+  不再让请求无限堆积；
+- 排队计数在任务真正结束时（future 的完成回调中）才减少，等待超时的任务仍计入排队上限；
+- 进程池用 forkserver（没有时用 spawn）启动子进程，不从多线程的 worker 中直接 fork，
+  避免子进程继承其他线程持有的锁；
+- needs_rehash() 判断已存储的哈希是否使用旧参数，登录成功时顺便用当前参数重新哈希。
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashQueueFullError(Exception):
+    """哈希任务排队已满（或等待超时），调用方应返回 503。"""
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """
+    有界的密码哈希执行器。
+
+    method 为 werkzeug 的哈希方法（如 "scrypt"、"pbkdf2:sha256:600000"）；
+    进程池在第一次使用时才创建，gunicorn 等 fork 出的 worker 各自拥有自己的进程池。
+    """
+
+    def __init__(self, workers=1, max_pending=32, timeout=10.0, method="scrypt"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.method = method
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._current_prefix = None
+        self._stats = {"submitted": 0, "rejected": 0, "timeouts": 0, "rehashed": 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise HashQueueFullError(f"密码哈希任务排队已满（{self.max_pending}）")
+            self._pending += 1
+            self._stats["submitted"] += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._task_done(None)
+            raise
+        # 超时返回后任务仍在进程池中排队或执行，完成时才释放名额
+        future.add_done_callback(self._task_done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # 还没开始执行的任务直接取消
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise HashQueueFullError(f"密码哈希超过 {self.timeout} 秒未完成")
+
+    def _task_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    # ---------- 对外接口 ----------
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(_verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """已存储的哈希的方法和参数（"$" 之前的部分）与当前配置不同时返回 True"""
+        if self._current_prefix is None:
+            # 用一个空密码算出当前配置对应的前缀，如 "scrypt:32768:8:1"，只算一次
+            self._current_prefix = _hash("", self.method).split("$", 1)[0]
+        return (pwhash or "").split("$", 1)[0] != self._current_prefix
+
+    def mark_rehashed(self):
+        with self._lock:
+            self._stats["rehashed"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "method": self.method,
+                **self._stats,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(max((os.cpu_count() or 2) // 2, 1)))),
+    max_pending=int(os.getenv("PASSWORD_HASH_QUEUE", "32")),
+    timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "10")),
+    method=os.getenv("PASSWORD_HASH_METHOD", "scrypt"),
+)
@@ -0,0 +1,117 @@
+"""
+进程内 POI 空间索引（可选，需要 numpy）
+
+POI_NEARBY_BACKEND=memory 时 /api/poi/nearby 不再查询数据库：
+每个城市的 POI 坐标保存为 NumPy 数组，并按固定大小的经纬度网格分桶（按网格编号排序后，
+每个网格对应数组中连续的一段）。半径查询只取覆盖查询范围的几个网格，
+再用向量化的球面距离做精确过滤。
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 未安装 numpy 时只能使用数据库查询
+    np = None
+
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+
+def available():
+    return np is not None
+
+
+class PoiGridIndex:
+    """
+    单个城市的 POI 网格索引。
+
+    rows 为 POI 字典列表（需包含 lon / lat），cell_deg 为网格边长（度），
+    默认 0.005 度（约 500 米），常见的 300~1000 米查询只需读取 3×3 ~ 5×5 个网格。
+    """
+
+    def __init__(self, rows, cell_deg=0.005):
+        if np is None:
+            raise RuntimeError("内存 POI 索引需要安装 numpy")
+        self.cell_deg = cell_deg
+
+        lon = np.array([float(r["lon"]) for r in rows], dtype=np.float64)
+        lat = np.array([float(r["lat"]) for r in rows], dtype=np.float64)
+        cx = np.floor(lon / cell_deg).astype(np.int64)
+        cy = np.floor(lat / cell_deg).astype(np.int64)
+
+        # 按 (cx, cy) 排序，同一网格的 POI 在数组中连续
+        order = np.lexsort((cy, cx))
+        self.lon = lon[order]
+        self.lat = lat[order]
+        self.rows = [rows[i] for i in order]
+        cx, cy = cx[order], cy[order]
+
+        self.cells = {}  # (cx, cy) -> (start, end)
+        self.bounds = None  # 有 POI 的网格编号范围 (x_min, x_max, y_min, y_max)
+        if len(order):
+            self.bounds = (int(cx[0]), int(cx[-1]), int(cy.min()), int(cy.max()))
+            boundaries = np.flatnonzero((np.diff(cx) != 0) | (np.diff(cy) != 0)) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(order)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self.cells[(int(cx[start]), int(cy[start]))] = (start, end)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def approx_size(self):
+        """粗略估算内存占用（字节），供缓存容量统计使用"""
+        return len(self.rows) * 700 + len(self.cells) * 100
+
+    def _candidates(self, lon, lat, radius):
+        """覆盖查询范围的网格中的 POI 下标（网格范围限制在有 POI 的网格之内）"""
+        if self.bounds is None:
+            return np.empty(0, dtype=np.int64)
+        d_lat = radius / METERS_PER_DEGREE
+        d_lon = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        x_min, x_max, y_min, y_max = self.bounds
+        x0 = max(math.floor((lon - d_lon) / self.cell_deg), x_min)
+        x1 = min(math.floor((lon + d_lon) / self.cell_deg), x_max)
+        y0 = max(math.floor((lat - d_lat) / self.cell_deg), y_min)
+        y1 = min(math.floor((lat + d_lat) / self.cell_deg), y_max)
+        if x0 > x1 or y0 > y1:
+            return np.empty(0, dtype=np.int64)
+
+        ranges = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # 范围内的网格比有 POI 的网格还多：直接遍历有 POI 的网格
+            for (x, y), span in self.cells.items():
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    ranges.append(np.arange(span[0], span[1]))
+        else:
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    span = self.cells.get((x, y))
+                    if span is not None:
+                        ranges.append(np.arange(span[0], span[1]))
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(ranges)
+
+    def query_radius(self, lon, lat, radius, limit=500):
+        """返回 radius 米内的 POI（按距离升序，最多 limit 条），每项为 (row, 距离米)"""
+        idx = self._candidates(lon, lat, radius)
+        if not len(idx):
+            return []
+
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(self.lat[idx]), np.radians(self.lon[idx])
+        a = (np.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        dist = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+        inside = dist <= radius
+        idx, dist = idx[inside], dist[inside]
+        if len(idx) > limit:
+            top = np.argpartition(dist, limit)[:limit]
+            idx, dist = idx[top], dist[top]
+        order = np.argsort(dist, kind="stable")
+        return [(self.rows[i], float(d)) for i, d in zip(idx[order].tolist(), dist[order].tolist())]
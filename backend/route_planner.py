@@ -0,0 +1,272 @@
+"""
+地铁路径规划引擎（服务端）
+
+替代前端 route-planner-utils.js 中的 BFS：
+- 按城市把 metro_station 预编译成「站点 × 线路」图，只构建一次，之后常驻内存；
+- 使用带标签的多准则搜索（label-correcting，按时间出堆），同时维护 (耗时, 换乘次数)，
+  返回耗时最短的 k 条方案和换乘最少的 k 条方案；
+- 每个标签只保存父指针和一个整数位图（已访问站点），不复制路径数组和集合，也没有迭代上限。
+"""
+
+import heapq
+import math
+import re
+import time
+
+
+# 时间模型（分钟），与前端「每次换乘5分钟」保持一致
+TRAIN_SPEED_KMH = 35.0  # 含加减速的平均旅行速度
+DWELL_MIN = 0.5  # 每站停站时间
+TRANSFER_MIN = 5.0  # 换乘步行 + 候车
+MIN_HOP_MIN = 1.0  # 相邻两站最少耗时
+
+DEFAULT_K = 3
+MAX_K = 10
+DEFAULT_MAX_TRANSFERS = 5
+
+
+def normalize_station_name(name):
+    """标准化站名（与前端 normalizeStationName 一致）。"""
+    if not name:
+        return ""
+    return re.sub(r"[\s·•]", "", name).lower()
+
+
+def clean_line_name(line_name):
+    """去掉线路名中的括号说明，如 '地铁1号线(中国药科大学-八卦洲大桥南)' -> '地铁1号线'。"""
+    return re.split(r"[(（]", line_name or "", maxsplit=1)[0].strip()
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """两点间球面距离（公里）。"""
+    r = 6371.0
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2)
+    return 2 * r * math.asin(math.sqrt(a))
+
+
+class RouteGraph:
+    """
+    单个城市的预编译路网。
+
+    节点 = 某条线路（linename + direction）上的某个站，用整数编号；
+    ride_edges[node]     -> [(next_node, 耗时分钟, 距离公里)]
+    transfer_edges[node] -> [(同站其他线路的 node, 是否计为换乘)]
+    """
+
+    def __init__(self, rows):
+        self.stations = []  # 站点名（原始写法），按 station id 编号
+        self.station_index = {}  # 标准化站名 -> station id
+        self.node_station = []  # node -> station id
+        self.node_info = []  # node -> 返回给前端的站点对象
+        self.station_nodes = []  # station id -> [node]
+        self.ride_edges = []
+        self.transfer_edges = []
+        self._build(rows)
+
+    def _station_id(self, name):
+        key = normalize_station_name(name)
+        sid = self.station_index.get(key)
+        if sid is None:
+            sid = len(self.stations)
+            self.station_index[key] = sid
+            self.stations.append(name)
+            self.station_nodes.append([])
+        return sid
+
+    def _build(self, rows):
+        # 按线路 + 方向分组
+        patterns = {}
+        for row in rows:
+            key = (row["linename"] or "", row.get("direction") or 1)
+            patterns.setdefault(key, []).append(row)
+
+        # 同一条线路的两个方向在数据中线路名不同（起终点互换），按去括号后的线路名归并
+        line_directions = {}
+        for linename, direction in patterns:
+            line_directions.setdefault(clean_line_name(linename), set()).add(direction)
+
+        node_pattern = []  # node -> (原始线路名, 方向)
+        for (linename, direction), stops in patterns.items():
+            stops.sort(key=lambda s: s.get("num") or 0)
+            line_clean = clean_line_name(linename)
+            nodes = []
+            for stop in stops:
+                sid = self._station_id(stop["name"])
+                node = len(self.node_station)
+                self.node_station.append(sid)
+                node_pattern.append((linename, direction))
+                self.station_nodes[sid].append(node)
+                self.node_info.append({
+                    "id": f"{stop.get('x') or ''}-{stop['name']}-{direction}",
+                    "name": stop["name"],
+                    "lineName": line_clean,
+                    "lineId": stop.get("x") or "",
+                    "direction": direction,
+                    "lon": float(stop["lon"]),
+                    "lat": float(stop["lat"]),
+                    "num": stop.get("num") or 0,
+                })
+                self.ride_edges.append([])
+                self.transfer_edges.append([])
+                nodes.append(node)
+
+            # 只有单方向数据的线路按双向处理，否则按数据给出的方向行驶
+            bidirectional = len(line_directions[line_clean]) == 1
+            for a, b in zip(nodes, nodes[1:]):
+                ia, ib = self.node_info[a], self.node_info[b]
+                dist = haversine_km(ia["lon"], ia["lat"], ib["lon"], ib["lat"])
+                minutes = max(MIN_HOP_MIN, dist / TRAIN_SPEED_KMH * 60) + DWELL_MIN
+                self.ride_edges[a].append((b, minutes, dist))
+                if bidirectional:
+                    self.ride_edges[b].append((a, minutes, dist))
+
+        # 同站不同线路之间的换乘边；同一线路的反方向不建边（掉头无意义），
+        # 同一线路同方向的不同交路（支线）之间切换不计换乘次数
+        for nodes in self.station_nodes:
+            for a in nodes:
+                for b in nodes:
+                    if node_pattern[a] == node_pattern[b]:
+                        continue
+                    same_line = self.node_info[a]["lineName"] == self.node_info[b]["lineName"]
+                    if same_line and node_pattern[a][1] != node_pattern[b][1]:
+                        continue
+                    self.transfer_edges[a].append((b, not same_line))
+
+    @property
+    def node_count(self):
+        return len(self.node_station)
+
+    @property
+    def approx_size(self):
+        """粗略估算内存占用（字节），供缓存容量统计使用"""
+        edges = sum(len(e) for e in self.ride_edges) + sum(len(e) for e in self.transfer_edges)
+        return self.node_count * 600 + edges * 120
+
+    def find_station(self, name):
+        return self.station_index.get(normalize_station_name(name))
+
+    def plan(self, start_name, end_name, k=DEFAULT_K, max_transfers=DEFAULT_MAX_TRANSFERS):
+        """
+        多准则搜索，返回 {"by_time": [...], "by_transfers": [...]}。
+
+        标签 = (耗时, 换乘次数, 序号, node, 距离, 已访问位图, 是否刚换乘, 父标签)。
+        剪枝规则：
+        - 某 node 已有 k 个出堆标签的换乘次数 <= 当前标签，则当前标签被支配；
+        - 「按换乘」结果已满 k 条时，换乘次数不小于其中最差者的标签不可能再进入结果。
+        """
+        start = self.find_station(start_name)
+        end = self.find_station(end_name)
+        if start is None or end is None:
+            return None
+        if start == end:
+            return {"by_time": [], "by_transfers": []}
+
+        heap = []
+        seq = 0
+        for node in self.station_nodes[start]:
+            heapq.heappush(heap, (0.0, 0, seq, node, 0.0, 1 << start, True, None))
+            seq += 1
+
+        settled = {}  # node -> 已出堆标签的换乘次数列表
+        arrivals = []
+        seen_signatures = set()
+        by_transfers = []  # [(换乘次数, 耗时, 序号)]，保持最多 k 个
+
+        while heap:
+            label = heapq.heappop(heap)
+            minutes, transfers, _, node, dist, visited, just_transferred, parent = label
+
+            if len(by_transfers) >= k and transfers >= by_transfers[-1][0] and len(arrivals) >= k:
+                continue
+
+            if self.node_station[node] == end:
+                if just_transferred:
+                    continue
+                itinerary = self._to_itinerary(label)
+                signature = itinerary.pop("_signature")
+                if signature in seen_signatures:
+                    continue
+                seen_signatures.add(signature)
+                arrivals.append(itinerary)
+                by_transfers.append((transfers, minutes, len(arrivals) - 1))
+                by_transfers.sort()
+                del by_transfers[k:]
+                continue
+
+            popped = settled.setdefault(node, [])
+            if sum(1 for t in popped if t <= transfers) >= k:
+                continue
+            popped.append(transfers)
+
+            for nxt, cost, hop_dist in self.ride_edges[node]:
+                bit = 1 << self.node_station[nxt]
+                if visited & bit:
+                    continue
+                seq += 1
+                heapq.heappush(heap, (minutes + cost, transfers, seq, nxt, dist + hop_dist,
+                                      visited | bit, False, label))
+
+            # 起点不换乘（起点已展开所有线路），也不连续换乘
+            if parent is None or just_transferred:
+                continue
+            for nxt, counted in self.transfer_edges[node]:
+                new_transfers = transfers + 1 if counted else transfers
+                if new_transfers > max_transfers:
+                    continue
+                seq += 1
+                heapq.heappush(heap, (minutes + TRANSFER_MIN, new_transfers, seq, nxt, dist,
+                                      visited, True, label))
+
+        return {
+            "by_time": arrivals[:k],
+            "by_transfers": [arrivals[idx] for _, _, idx in by_transfers],
+        }
+
+    def _to_itinerary(self, label):
+        """沿父指针回溯出完整路径（格式与前端 BFS 的 path 一致：换乘站只出现一次）。"""
+        chain = []
+        while label is not None:
+            chain.append(label)
+            label = label[7]
+        chain.reverse()
+
+        path = []
+        segments = []
+        for minutes, transfers, _, node, _, _, just_transferred, _ in chain:
+            info = self.node_info[node]
+            if just_transferred and path:
+                # 换乘：沿用上一站对象，新线路从下一站开始；同名线路（支线）不拆段
+                if info["lineName"] != segments[-1]["lineName"]:
+                    segments.append({"lineName": info["lineName"], "stations": [path[-1]["name"]]})
+                continue
+            path.append(info)
+            if not segments:
+                segments.append({"lineName": info["lineName"], "stations": []})
+            segments[-1]["stations"].append(info["name"])
+
+        last = chain[-1]
+        segments = [s for s in segments if len(s["stations"]) > 1]
+        signature = tuple((s["lineName"], s["stations"][0], s["stations"][-1]) for s in segments)
+        return {
+            "path": path,
+            "transfers": last[1],
+            "duration": round(last[0], 1),
+            "distance": round(last[4], 2),
+            "stationCount": len(path),
+            "segments": [
+                {"lineName": s["lineName"], "from": s["stations"][0], "to": s["stations"][-1],
+                 "stationCount": len(s["stations"])}
+                for s in segments
+            ],
+            "_signature": signature,
+        }
+
+
+def build_route_graph(rows):
+    """由 metro_station 查询结果构建路网，返回 (graph, 构建耗时毫秒)。"""
+    t0 = time.perf_counter()
+    graph = RouteGraph(rows)
+    return graph, (time.perf_counter() - t0) * 1000
@@ -0,0 +1,149 @@
+"""
+生产环境启动（gunicorn 多进程，主进程预热后再 fork）
+
+python app.py 是单进程的 Werkzeug 开发服务器（开启调试器和自动重载），只适合本地开发。生产环境使用：
+    cd backend && python serve.py
+
+- 主进程导入 app 并同步预热缓存（线路、站点、路网、搜索索引等，与 /api/cache/warm 相同），
+  然后 gc.freeze() 再 fork 出 worker：预编码好的数据以写时复制的方式被所有 worker 共用，
+  worker 启动即可服务，不必各自查库重建；
+- fork 前关闭主进程的数据库连接，worker 中重置连接池和日志写出线程（不能继承父进程的 socket 和线程），
+  清空从主进程继承的指标数值（预热时的查询计数不算在 worker 上），并错开各 worker 的用户过滤器重建时间；
+- kill -HUP <主进程> 平滑重载：主进程重新预热（先逐个检查线路 / 站点的数据版本，只重建版本有变化的部分）后启动新 worker，
+  旧 worker 处理完手上的请求再退出；
+- 启动完成时输出最终生效的配置。
+
+配置（环境变量，括号内为默认值）：WEB_BIND(0.0.0.0:5000)、WEB_WORKERS(CPU 核数)、WEB_THREADS(4，每个 worker 的线程数)、
+WEB_KEEPALIVE(5 秒)、WEB_TIMEOUT(60 秒)、WEB_GRACEFUL_TIMEOUT(30 秒)、WEB_MAX_REQUESTS(0，不限；
+worker 处理这么多请求后自动重启)、WEB_MAX_REQUESTS_JITTER(0)、WEB_BACKLOG(2048)、WEB_ACCESS_LOG(空，不记录；"-" 输出到标准输出)、
+WEB_PRELOAD_WARM(1，设为 0 时不在主进程预热，由各 worker 在后台预热)。
+
+依赖 gunicorn（仅 Linux / macOS）。
+"""
+
+import gc
+import json
+import logging
+import os
+import sys
+import time
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover - Windows 或未安装
+    BaseApplication = None
+
+
+PRELOAD_WARM = os.getenv("WEB_PRELOAD_WARM", "1") != "0"
+
+
+logger = logging.getLogger("serve")
+
+
+def resolve_config():
+    """从环境变量读取服务器配置"""
+    threads = int(os.getenv("WEB_THREADS", "4"))
+    return {
+        "bind": os.getenv("WEB_BIND", "0.0.0.0:5000"),
+        "workers": int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1))),
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        "timeout": int(os.getenv("WEB_TIMEOUT", "60")),
+        "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", "0")),
+        "backlog": int(os.getenv("WEB_BACKLOG", "2048")),
+        "accesslog": os.getenv("WEB_ACCESS_LOG") or None,
+        "preload_app": True,
+    }
+
+
+def warm_in_master(backend):
+    """主进程中同步预热，结束后关闭数据库连接并冻结 GC，返回预热摘要"""
+    from db import pool
+
+    started = time.perf_counter()
+    if PRELOAD_WARM:
+        backend.user_filter.ensure_loaded(wait=True)
+        backend.warm_all_cities()
+    warm_s = round(time.perf_counter() - started, 2)
+
+    # 已建立的连接不能带进子进程（多个进程共用同一个 socket）
+    pool.closeall()
+    # 预热产生的对象移出 GC 跟踪，避免 worker 中的垃圾回收改写这些页面而破坏写时复制
+    gc.collect()
+    gc.freeze()
+
+    cache = backend._metro_data_cache.stats()
+    return {
+        "warm_s": warm_s,
+        "cities": {city: status.get("status") for city, status in backend.warm_status().items()},
+        "cache_entries": cache["entries"],
+        "cache_mb": round(cache["bytes"] / 1024 / 1024, 1),
+        "gc_frozen": gc.get_freeze_count(),
+    }
+
+
+class MetroServer(BaseApplication or object):
+    def __init__(self, options):
+        self.options = options
+        self.warm_summary = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+        self.cfg.set("post_fork", _post_fork)
+        self.cfg.set("when_ready", self._when_ready)
+        self.cfg.set("on_reload", self._on_reload)
+
+    def load(self):
+        import app as backend
+
+        if self.options.get("workers") == 1:
+            backend.user_filter.sole_writer = True  # 只有一个 worker 注册用户，过滤器始终可用
+        self.warm_summary = warm_in_master(backend)
+        return backend.app
+
+    def _when_ready(self, server):
+        report = {**{k: self.cfg.settings[k].get() for k in self.options if k in self.cfg.settings},
+                  "master_pid": os.getpid(), "python": sys.version.split()[0], "warm": self.warm_summary}
+        logger.info(f"[生产服务] 配置: {json.dumps(report, ensure_ascii=False, default=str)}")
+
+    def _on_reload(self, server):
+        import app as backend
+
+        logger.info("[生产服务] 收到重载信号，主进程重新预热后替换 worker")
+        gc.unfreeze()
+        self.warm_summary = warm_in_master(backend)
+        logger.info(f"[生产服务] 重新预热完成: {json.dumps(self.warm_summary, ensure_ascii=False)}")
+
+
+def _post_fork(server, worker):
+    """
+    worker 中：重置从主进程继承的连接池、日志写出线程、指标数值和用户过滤器的重建时间；
+    主进程未预热时由 worker 在后台预热
+    """
+    import app as backend
+    import log_queue
+    from db import pool
+    from metrics import registry
+
+    log_queue.after_fork()
+    pool.after_fork()
+    registry.reset()
+    backend.user_filter.after_fork()
+    if not PRELOAD_WARM:
+        backend.start_background_warm()
+
+
+def main():
+    if BaseApplication is None:
+        raise SystemExit("生产模式需要 gunicorn（pip install gunicorn，仅支持 Linux / macOS）；本地开发请使用 python app.py")
+    MetroServer(resolve_config()).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+跨进程共享的地铁数据缓存
+
+多 worker 部署时，每个进程各自构建一份线路 / 站点缓存会让启动查询量和内存都乘以 worker 数，
+且 /api/cache/clear 只能清掉当前进程。这里把预编码好的响应字节写到共享内存目录
+（默认 /dev/shm，tmpfs）下，所有 worker 读取同一份文件：
+
+    {root}/{dataset}__{city}__{variant}/
+        current -> gen-<时间戳>-<pid>      # 符号链接，指向当前代
+        gen-.../meta.json                 # etag / 版本 / 条数 / 各编码大小
+        gen-.../identity  gzip  br        # 预编码的响应字节
+
+- 发布新一代：先写完整的新目录，再用 os.replace 原子替换 current 链接，读者不会看到写了一半的数据；
+- 响应直接把文件交给 WSGI 服务器的 file_wrapper（gunicorn 下走 sendfile），
+  字节从页缓存直接进 socket，不经过 Python 进程内存；
+- 被替换或删除的一代先保留 grace 秒（默认 60）再删除，刚通过 readlink 拿到旧路径的请求仍能打开文件；
+  所有留在磁盘上的代（包括等待删除的）都计入 max_bytes，超出时从最旧的条目开始淘汰；
+- 城市代码必须符合 CITY_CODE_RE，目录名中的各部分经过 URL 编码（"_" 也编码，避免与分隔符混淆），
+  并确认最终路径位于 root 之下，请求参数无法指向缓存目录以外的位置。
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 下没有 fcntl，退化为进程内锁
+    fcntl = None
+
+from metro_cache import CITY_CODE_RE, EncodedPayload, MetroCache
+
+
+def _encode_part(value):
+    return quote(value, safe="").replace("_", "%5F")
+
+
+def _dir_bytes(path):
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return total
+
+
+def default_shared_dir():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "metro_cache")
+
+
+class SharedPayload(EncodedPayload):
+    """共享目录中的一代数据：bodies = {编码: 文件路径}"""
+
+    __slots__ = ("sizes", "generation")
+
+    def __init__(self, gen_dir, meta):
+        bodies = {enc: os.path.join(gen_dir, enc) for enc in meta["sizes"]}
+        super().__init__(bodies, meta["etag"], meta.get("meta"))
+        self.created_at = meta["created_at"]
+        self.sizes = meta["sizes"]
+        self.generation = os.path.basename(gen_dir)
+
+    @property
+    def size(self):
+        return sum(self.sizes.values())
+
+
+class SharedMetroCache(MetroCache):
+    """
+    与 MetroCache 接口一致：EncodedPayload 写入共享目录，所有 worker 共用；
+    其他对象（如路网 RouteGraph）无法跨进程共享，仍保存在本进程内存中。
+    版本检查、TTL、按城市 / 数据集失效的语义与 MetroCache 相同。
+    """
+
+    def __init__(self, root=None, grace=60, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.realpath(root or default_shared_dir())
+        self.grace = grace
+        os.makedirs(self.root, exist_ok=True)
+        self._generations = {}  # key -> (generation, SharedPayload)，避免每次请求都读 meta.json
+        self._local_lock = threading.Lock()
+
+    # ---------- 目录与锁 ----------
+    def _entry_dir(self, key):
+        dataset, city_code, variant = key
+        if not isinstance(city_code, str) or not CITY_CODE_RE.match(city_code):
+            raise ValueError(f"无效的城市代码: {city_code!r}")
+        name = "__".join(_encode_part(part) for part in (dataset, city_code, variant or "_"))
+        entry_dir = os.path.join(self.root, name)
+        if os.path.dirname(os.path.realpath(entry_dir)) != self.root:
+            raise ValueError(f"缓存路径超出缓存目录: {name}")
+        return entry_dir
+
+    @contextmanager
+    def _locked(self, entry_dir):
+        """发布 / 删除时按条目加文件锁，避免多个 worker 同时改同一个目录"""
+        os.makedirs(entry_dir, exist_ok=True)
+        if fcntl is None:
+            with self._local_lock:
+                yield
+            return
+        fd = os.open(os.path.join(entry_dir, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read_shared(self, key):
+        entry_dir = self._entry_dir(key)
+        try:
+            generation = os.readlink(os.path.join(entry_dir, "current"))
+        except OSError:
+            return None
+
+        cached = self._generations.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        try:
+            with open(os.path.join(entry_dir, generation, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        payload = SharedPayload(os.path.join(entry_dir, generation), meta)
+        payload.meta["version"] = meta.get("version")
+        self._generations[key] = (generation, payload)
+        return payload
+
+    @staticmethod
+    def _retire(entry_dir, generation):
+        """记下某一代被替换 / 删除的时间（目录 mtime），grace 秒后才会被清理（调用方持有条目锁）"""
+        try:
+            os.utime(os.path.join(entry_dir, generation))
+        except OSError:
+            pass
+
+    def _prune_generations(self, entry_dir):
+        """删除不是当前代、且退役超过 grace 秒的目录，返回释放的字节数（调用方持有条目锁）"""
+        try:
+            current = os.readlink(os.path.join(entry_dir, "current"))
+        except OSError:
+            current = None
+        deadline = time.time() - self.grace
+        freed = 0
+        for name in os.listdir(entry_dir):
+            if not name.startswith("gen-") or name == current:
+                continue
+            gen_dir = os.path.join(entry_dir, name)
+            try:
+                if os.stat(gen_dir).st_mtime > deadline:
+                    continue
+            except OSError:
+                continue
+            size = _dir_bytes(gen_dir)
+            shutil.rmtree(gen_dir, ignore_errors=True)
+            freed += size
+        return freed
+
+    def _remove_shared(self, key):
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return False
+        with self._locked(entry_dir):
+            link = os.path.join(entry_dir, "current")
+            try:
+                generation = os.readlink(link)
+                os.unlink(link)
+                self._retire(entry_dir, generation)
+                removed = True
+            except OSError:
+                removed = False
+            self._prune_generations(entry_dir)
+        self._generations.pop(key, None)
+        return removed
+
+    def _shared_keys(self):
+        keys = []
+        for name in os.listdir(self.root):
+            parts = name.split("__")
+            if len(parts) == 3:
+                dataset, city_code, variant = (unquote(p) for p in parts)
+                if CITY_CODE_RE.match(city_code):
+                    keys.append((dataset, city_code, "" if variant == "_" else variant))
+        return keys
+
+    # ---------- 覆盖 MetroCache 的存取 ----------
+    def _drop_stale_unlocked(self, dataset, city_code, version):
+        """共享目录的读 meta.json / 加文件锁都在 MetroCache._lock 之外进行"""
+        dropped = False
+        for key in self._shared_keys():
+            if key[0] == dataset and key[1] == city_code:
+                payload = self._read_shared(key)
+                if payload is not None and payload.meta.get("version") != version:
+                    dropped = self._remove_shared(key) or dropped
+        return dropped
+
+    def get(self, dataset, city_code, variant=""):
+        value = super().get(dataset, city_code, variant)
+        if value is not None:
+            return value
+        payload = self._read_shared((dataset, city_code, variant))
+        if payload is None:
+            return None
+        if time.time() - payload.created_at > self.ttl:
+            self._remove_shared((dataset, city_code, variant))
+            with self._lock:
+                self._count("expirations", (dataset, city_code))
+            return None
+        with self._lock:
+            # super().get 已记了一次未命中，这里改记为命中
+            self._count("misses", (dataset, city_code), -1)
+            self._count("hits", (dataset, city_code))
+        return payload
+
+    def put(self, dataset, city_code, value, version=None, variant="", size=None):
+        if not isinstance(value, EncodedPayload):
+            return super().put(dataset, city_code, value, version=version, variant=variant, size=size)
+
+        key = (dataset, city_code, variant)
+        entry_dir = self._entry_dir(key)
+        with self._locked(entry_dir):
+            generation = f"gen-{time.time_ns()}-{os.getpid()}"
+            gen_dir = os.path.join(entry_dir, generation)
+            os.mkdir(gen_dir)
+            for encoding, body in value.bodies.items():
+                with open(os.path.join(gen_dir, encoding), "wb") as f:
+                    f.write(body)
+            meta = {
+                "etag": value.etag,
+                "version": version,
+                "meta": value.meta,
+                "created_at": time.time(),
+                "sizes": {enc: len(body) for enc, body in value.bodies.items()},
+            }
+            with open(os.path.join(gen_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            # 原子切换到新一代；上一代记下退役时间，grace 秒后再删除
+            link = os.path.join(entry_dir, "current")
+            try:
+                previous = os.readlink(link)
+            except OSError:
+                previous = None
+            tmp_link = os.path.join(entry_dir, f".current-{generation}")
+            os.symlink(generation, tmp_link)
+            os.replace(tmp_link, link)
+            if previous is not None:
+                self._retire(entry_dir, previous)
+            self._prune_generations(entry_dir)
+
+        if version is not None:
+            with self._lock:
+                self._checked.setdefault((dataset, city_code), (time.monotonic(), version))
+        self._evict_shared()
+
+    def _disk_bytes(self):
+        """共享目录中所有代（含等待删除的旧代）占用的字节数，顺带清理已过 grace 的旧代"""
+        total = 0
+        for key in self._shared_keys():
+            entry_dir = self._entry_dir(key)
+            with self._locked(entry_dir):
+                self._prune_generations(entry_dir)
+                for name in os.listdir(entry_dir):
+                    if name.startswith("gen-"):
+                        total += _dir_bytes(os.path.join(entry_dir, name))
+        return total
+
+    def _evict_shared(self):
+        """共享目录实际占用超过 max_bytes 时，按生成时间从旧到新删除条目"""
+        total = self._disk_bytes()
+        if total <= self.max_bytes:
+            return
+        payloads = [(k, p) for k in self._shared_keys() if (p := self._read_shared(k)) is not None]
+        for key, payload in sorted(payloads, key=lambda kp: kp[1].created_at):
+            if total <= self.max_bytes:
+                break
+            # 退役的代要等 grace 秒后才真正删除，这里按即将释放的字节计
+            if self._remove_shared(key):
+                total -= payload.size
+                with self._lock:
+                    self._count("evictions", key)
+
+    def contains(self, dataset, city_code, variant=""):
+        if super().contains(dataset, city_code, variant):
+            return True
+        payload = self._read_shared((dataset, city_code, variant))
+        return payload is not None and time.time() - payload.created_at <= self.ttl
+
+    def invalidate(self, city_code=None, dataset=None):
+        removed = super().invalidate(city_code=city_code, dataset=dataset)
+        for key in self._shared_keys():
+            if (city_code is None or key[1] == city_code) and (dataset is None or key[0] == dataset):
+                if self._remove_shared(key):
+                    removed += 1
+                    with self._lock:
+                        self._count("invalidations", key)
+        return removed
+
+    def stats(self):
+        result = super().stats()
+        shared = [(k, p) for k in self._shared_keys() if (p := self._read_shared(k)) is not None]
+        result["shared"] = {
+            "root": self.root,
+            "entries": len(shared),
+            "bytes": sum(p.size for _, p in shared),
+            "disk_bytes": self._disk_bytes(),
+            "generations": {"/".join(filter(None, k)): p.generation for k, p in shared},
+        }
+        return result
@@ -0,0 +1,327 @@
+"""
+慢查询日志与自动 EXPLAIN（GET /api/db/queries）
+
+db.py 的计时游标把每条 SQL 的耗时交给 QueryLog：
+- 按「语句指纹」汇总：去掉注释、合并空白，字面量和占位符替换为 ?，IN (?, ?, ...) 合并为 IN (...)，
+  多行 VALUES (...), (...) 只保留第一行（execute_values 不同批量大小归为一组），同一条 SQL 不同参数归为一组；保存调用次数、总耗时、最大耗时、失败次数和最近 window 次耗时（用于 p99）；
+- 参数指纹只记录参数的类型和个数（如 [str, int]、list[12]），不保存参数值；
+- 耗时超过 threshold 的语句在后台线程中另借一条连接执行 EXPLAIN：只读语句用
+  EXPLAIN (ANALYZE, BUFFERS) 并在回滚的事务中执行；写语句、带 FOR UPDATE / SHARE 的语句，
+  以及调用了 volatile 函数（如 pg_advisory_xact_lock、nextval，按 pg_proc.provolatile 判断）的语句
+  只用 EXPLAIN（不实际执行），避免采集计划时加锁或产生回滚不掉的副作用。
+  同一指纹每 explain_interval 秒最多采集一次，队列满时跳过，不影响请求；
+- 计划中的条件里的字符串和数字字面量同样替换为 ?，并汇总其中的顺序扫描（Seq Scan）节点，用来发现缺少的索引；
+- 指纹数超过 max_fingerprints 时淘汰总耗时最少的一组。
+"""
+
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_ROWS = re.compile(r"(\bVALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.I)
+_SPACE = re.compile(r"\s+")
+
+READ_ONLY_KINDS = ("SELECT", "WITH")
+_WRITE_WORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.I)
+_LOCKING = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b", re.I)
+_FUNCTION_CALL = re.compile(r"([A-Za-z_][\w$]*)\s*\(")
+VOLATILE_FUNCTIONS_SQL = "SELECT DISTINCT proname FROM pg_proc WHERE proname = ANY(%s) AND provolatile = 'v'"
+MAX_CACHED_QUERY = 4096  # 字符，超过的 SQL 不缓存标准化结果
+MAX_CACHED_CHARS = 4 * 1024 * 1024  # 标准化缓存中原始 SQL 的总字符数上限
+PLAN_TEXT_KEYS = ("Filter", "Index Cond", "Recheck Cond", "Join Filter", "Hash Cond", "Merge Cond")
+
+
+def normalize(query):
+    """语句指纹用的标准化 SQL"""
+    text = _COMMENT.sub(" ", query)
+    text = _STRING.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _VALUES_ROWS.sub(r"\1", text)
+    text = _IN_LIST.sub("(...)", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def param_shape(params):
+    """参数的类型和个数，不含参数值"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: param_shape(v) if isinstance(v, (list, tuple, dict)) else type(v).__name__
+                for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if len(params) > 8 and all(not isinstance(p, (list, tuple, dict)) for p in params):
+            return f"{type(params).__name__}[{len(params)}]"
+        return [param_shape(p) if isinstance(p, (list, tuple, dict)) else type(p).__name__ for p in params]
+    return type(params).__name__
+
+
+def is_read_only(kind, normalized):
+    """不写数据、不加行锁的查询（是否调用 volatile 函数需要查询 pg_proc，见 QueryLog._explain）"""
+    return (kind in READ_ONLY_KINDS and not _WRITE_WORDS.search(normalized)
+            and not _LOCKING.search(normalized))
+
+
+def function_names(statement):
+    """语句中出现的函数调用名（小写，含 IN、EXISTS 等关键字，查询 pg_proc 时自然不会匹配）"""
+    return sorted({name.lower() for name in _FUNCTION_CALL.findall(_STRING.sub("?", statement))})
+
+
+def _scrub_plan(node, seq_scans):
+    """去掉计划条件中的字面量，收集 Seq Scan 节点"""
+    for key in PLAN_TEXT_KEYS:
+        if isinstance(node.get(key), str):
+            node[key] = _NUMBER.sub("?", _STRING.sub("?", node[key]))
+    if node.get("Node Type") == "Seq Scan":
+        seq_scans.append({
+            "relation": node.get("Relation Name"),
+            "filter": node.get("Filter"),
+            "rows": node.get("Actual Rows", node.get("Plan Rows")),
+            "rows_removed": node.get("Rows Removed by Filter"),
+        })
+    for child in node.get("Plans") or []:
+        _scrub_plan(child, seq_scans)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * p / 100), len(sorted_values) - 1)]
+
+
+class _QueryStats:
+    __slots__ = ("query", "kind", "params", "calls", "errors", "total", "max", "recent", "last_seen",
+                 "slow", "explain", "explain_at")
+
+    def __init__(self, query, kind, window):
+        self.query = query
+        self.kind = kind
+        self.params = None
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+        self.last_seen = 0.0
+        self.slow = 0
+        self.explain = None
+        self.explain_at = 0.0
+
+
+class QueryLog:
+    """
+    语句耗时汇总。connection_fn() 返回连接的上下文管理器（db.connection），用于执行 EXPLAIN；
+    explain_mode 为 analyze / plain / off。
+    """
+
+    def __init__(self, connection_fn=None, threshold_ms=200, explain_mode="analyze", explain_interval=300,
+                 max_fingerprints=500, window=1000, explain_timeout_ms=30000):
+        self.connection_fn = connection_fn
+        self.threshold = threshold_ms / 1000
+        self.explain_mode = explain_mode
+        self.explain_interval = explain_interval
+        self.max_fingerprints = max_fingerprints
+        self.window = window
+        self.explain_timeout_ms = explain_timeout_ms
+
+        self._lock = threading.Lock()
+        self._stats = {}  # 指纹 -> _QueryStats
+        self._normalized = {}  # 原始 SQL -> (指纹, 标准化 SQL)，同一条 SQL 只标准化一次
+        self._normalized_chars = 0
+        self._queue = queue.Queue(maxsize=16)
+        self._worker = None
+        self._counters = {"explained": 0, "explain_failed": 0, "explain_skipped": 0, "evicted": 0}
+
+    def _fingerprint(self, query):
+        """
+        标准化结果按原始 SQL 缓存；代入了参数的长语句（如 execute_values 的批量 INSERT）每次都不同，
+        超过 MAX_CACHED_QUERY 个字符的不缓存，缓存总字符数也有上限，避免占用大量内存
+        """
+        cached = self._normalized.get(query)
+        if cached is None:
+            normalized = normalize(query)
+            cached = (fingerprint(normalized), normalized)
+            if len(query) <= MAX_CACHED_QUERY and self._normalized_chars + len(query) <= MAX_CACHED_CHARS:
+                self._normalized[query] = cached
+                self._normalized_chars += len(query)
+        return cached
+
+    def record(self, query, params, seconds, kind, failed=False, mogrify=None):
+        """记录一次执行；mogrify(query, params) 返回代入参数后的 SQL，只在需要 EXPLAIN 时调用"""
+        if kind == "EXPLAIN" or threading.current_thread() is self._worker:
+            return  # EXPLAIN 线程自己执行的语句不计入
+        key, normalized = self._fingerprint(query)
+        explain = False
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    victim = min(self._stats, key=lambda k: self._stats[k].total)
+                    del self._stats[victim]
+                    self._counters["evicted"] += 1
+                stats = self._stats[key] = _QueryStats(normalized, kind, self.window)
+            stats.calls += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.recent.append(seconds)
+            stats.last_seen = time.time()
+            if failed:
+                stats.errors += 1
+            if stats.params is None:
+                stats.params = param_shape(params)
+            if seconds >= self.threshold and not failed:
+                stats.slow += 1
+                now = time.monotonic()
+                if (self.explain_mode != "off" and mogrify is not None and self.connection_fn is not None
+                        and now - stats.explain_at >= self.explain_interval):
+                    stats.explain_at = now
+                    explain = True
+        if explain:
+            try:
+                statement = mogrify(query, params)
+            except Exception:
+                return
+            if isinstance(statement, bytes):
+                statement = statement.decode("utf-8", "replace")
+            self._submit(key, statement, is_read_only(kind, normalized) and self.explain_mode == "analyze")
+
+    # ---------- EXPLAIN ----------
+    def _submit(self, key, statement, analyze):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((key, statement, analyze))
+        except queue.Full:
+            with self._lock:
+                self._counters["explain_skipped"] += 1
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            key, statement, analyze = self._queue.get()
+            result = self._explain(statement, analyze)
+            with self._lock:
+                stats = self._stats.get(key)
+                if stats is not None:
+                    stats.explain = result
+                self._counters["explain_failed" if "error" in result else "explained"] += 1
+
+    def _explain(self, statement, analyze):
+        started = time.perf_counter()
+        volatile = []
+        try:
+            with self.connection_fn() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        if analyze:
+                            cur.execute(VOLATILE_FUNCTIONS_SQL, (function_names(statement),))
+                            volatile = [row[0] for row in cur.fetchall()]
+                            analyze = not volatile
+                        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+                        cur.execute(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                        cur.execute(f"EXPLAIN ({options}) {statement}")
+                        plan = cur.fetchone()[0]
+                finally:
+                    conn.rollback()  # ANALYZE 真正执行了语句，一律回滚
+        except Exception as e:
+            logger.warning(f"[慢查询] EXPLAIN 失败: {e}")
+            return {"analyze": analyze, "error": str(e).strip(), "captured_at": time.time()}
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0] if isinstance(plan, list) else plan
+        seq_scans = []
+        _scrub_plan(root.get("Plan", {}), seq_scans)
+        return {
+            "analyze": analyze,
+            **({"volatile_functions": volatile} if volatile else {}),
+            "captured_at": time.time(),
+            "explain_ms": round((time.perf_counter() - started) * 1000, 1),
+            "execution_ms": root.get("Execution Time"),
+            "planning_ms": root.get("Planning Time"),
+            "seq_scans": seq_scans,
+            "plan": root.get("Plan"),
+        }
+
+    # ---------- 查询 ----------
+    def top(self, n=20, sort="total", include_plans=True):
+        """按 total / p99 / mean / max / calls 排序的前 n 组语句"""
+        with self._lock:
+            items = [(key, s, sorted(s.recent)) for key, s in self._stats.items()]
+        rows = []
+        for key, s, recent in items:
+            row = {
+                "fingerprint": key,
+                "query": s.query,
+                "kind": s.kind,
+                "params": s.params,
+                "calls": s.calls,
+                "errors": s.errors,
+                "slow_calls": s.slow,
+                "total_ms": round(s.total * 1000, 3),
+                "mean_ms": round(s.total / s.calls * 1000, 3),
+                "max_ms": round(s.max * 1000, 3),
+                "p50_ms": round(percentile(recent, 50) * 1000, 3),
+                "p99_ms": round(percentile(recent, 99) * 1000, 3),
+                "last_seen": s.last_seen,
+            }
+            if s.explain is not None:
+                explain = dict(s.explain)
+                if not include_plans:
+                    explain.pop("plan", None)
+                row["explain"] = explain
+            rows.append(row)
+        sort_key = {"total": "total_ms", "p99": "p99_ms", "mean": "mean_ms", "max": "max_ms",
+                    "calls": "calls"}.get(sort, "total_ms")
+        rows.sort(key=lambda r: r[sort_key], reverse=True)
+        return rows[:n]
+
+    def missing_index_hints(self):
+        """捕获到的计划中出现的顺序扫描，按表汇总（rows_removed 多的表通常缺少过滤条件上的索引）"""
+        hints = {}
+        with self._lock:
+            explains = [(key, s.explain) for key, s in self._stats.items() if s.explain]
+        for key, explain in explains:
+            for scan in explain.get("seq_scans", []):
+                hint = hints.setdefault(scan["relation"], {"relation": scan["relation"], "fingerprints": [],
+                                                           "filters": [], "rows_removed": 0})
+                hint["fingerprints"].append(key)
+                if scan.get("filter") and scan["filter"] not in hint["filters"]:
+                    hint["filters"].append(scan["filter"])
+                hint["rows_removed"] += scan.get("rows_removed") or 0
+        return sorted(hints.values(), key=lambda h: h["rows_removed"], reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fingerprints": len(self._stats),
+                "threshold_ms": round(self.threshold * 1000, 3),
+                "explain_mode": self.explain_mode,
+                "explain_interval": self.explain_interval,
+                "explain_pending": self._queue.qsize(),
+                **self._counters,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
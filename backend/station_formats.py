@@ -0,0 +1,104 @@
+"""
+站点数据的列式格式及二进制编码
+
+旧格式（build_stations_result）每个字段都是以 str(idx * 2) 为键的对象，七个字段重复同一批下标字符串，
+JSON 体积是数据本身的数倍，序列化和前端解析都慢。列式格式每个字段一个等长数组：
+
+    {"format": "columnar", "count": N, "columns": {"name": [...], "linename": [...], "lon": [...], ...}}
+
+同一份列数据还可以编码为 MessagePack（需要 msgpack）或 Arrow IPC 流（需要 pyarrow），两者均为可选依赖，
+未安装时对应格式不可用。
+"""
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 未安装时不提供 MessagePack
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - 未安装时不提供 Arrow
+    pa = None
+
+
+# 与旧格式的字段及顺序一致
+STATION_COLUMNS = ("name", "linename", "lon", "lat", "num", "direction", "x")
+
+MIMETYPES = {
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Accept 头中可识别的类型 -> 格式
+ACCEPT_FORMATS = {
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+
+def available_formats():
+    """当前环境可用的列式格式"""
+    formats = ["columnar"]
+    if msgpack is not None:
+        formats.append("msgpack")
+    if pa is not None:
+        formats.append("arrow")
+    return formats
+
+
+def build_columns(records):
+    """records 为与旧格式字段相同的字典列表 -> 列式数据"""
+    return {
+        "format": "columnar",
+        "count": len(records),
+        "columns": {col: [r[col] for r in records] for col in STATION_COLUMNS},
+    }
+
+
+def encode_msgpack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _arrow_array(values):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 混合类型的列（如线路编号 x 既有 1 也有 "S1"）统一转为字符串
+        array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if pa.types.is_string(array.type):
+        # 线路名、换乘站名大量重复，字典编码后每个值只存一次
+        array = array.dictionary_encode()
+    return array
+
+
+def encode_arrow(data):
+    """列式数据 -> Arrow IPC 流（单个 record batch）"""
+    columns = data["columns"]
+    table = pa.table({col: _arrow_array(columns[col]) for col in STATION_COLUMNS})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def negotiate_format(format_param, accept):
+    """
+    ?format= 优先，其次按 Accept 头选择二进制格式；都没有时返回 None（使用旧格式）。
+    请求的格式不可用时抛出 ValueError。
+    """
+    if format_param:
+        if format_param == "legacy":
+            return None
+        if format_param not in MIMETYPES:
+            raise ValueError(f"不支持的格式: {format_param}")
+        if format_param not in available_formats():
+            raise ValueError(f"服务器未安装 {format_param} 编码所需的依赖")
+        return format_param
+
+    for part in (accept or "").split(","):
+        fmt = ACCEPT_FORMATS.get(part.split(";", 1)[0].strip().lower())
+        if fmt and fmt in available_formats():
+            return fmt
+    return None
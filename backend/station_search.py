@@ -0,0 +1,127 @@
+"""
+站点名称搜索索引（服务端自动补全）
+
+按城市为站点名建立索引，/api/metro/stations/search 只返回排名靠前的几个站点，
+前端不必下载全部站点再逐个 normalizeStationName 比较：
+- 标准化站名（去空格和间隔点、小写）、拼音全拼、拼音首字母分别放入有序数组，
+  用二分查找做前缀匹配（效果等同于前缀树，内存更省）；
+- 单字和双字（bigram）倒排索引，用于站名中间的子串匹配；
+- 排序：完全匹配 > 站名前缀 > 拼音前缀 > 站名包含，同一级别中换乘线路多、名字短的站点优先。
+
+拼音依赖 pypinyin（可选），未安装时只支持汉字搜索。
+"""
+
+import bisect
+import re
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pragma: no cover - 未安装时不支持拼音搜索
+    lazy_pinyin = None
+
+from route_planner import clean_line_name, normalize_station_name
+
+
+# 匹配级别，数值越小排名越靠前
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_PINYIN = 2
+MATCH_CONTAINS = 3
+MATCH_NAMES = {MATCH_EXACT: "exact", MATCH_PREFIX: "prefix", MATCH_PINYIN: "pinyin", MATCH_CONTAINS: "contains"}
+
+
+def pinyin_keys(name):
+    """站名的拼音全拼和首字母（如 新街口 -> xinjiekou, xjk），未安装 pypinyin 时返回空列表"""
+    if lazy_pinyin is None:
+        return []
+    full = "".join(lazy_pinyin(name)).lower()
+    initials = "".join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower()
+    return [k for k in dict.fromkeys((full, initials)) if k]
+
+
+class StationSearchIndex:
+    """单个城市的站点搜索索引；rows 需要 name / linename / lon / lat"""
+
+    def __init__(self, rows):
+        self.stations = []  # [{"name", "lines", "lon", "lat"}]
+        self._keys = []  # 标准化站名，与 stations 对应
+        by_key = {}
+        for row in rows:
+            key = normalize_station_name(row["name"])
+            if not key:
+                continue
+            sid = by_key.get(key)
+            if sid is None:
+                sid = by_key[key] = len(self.stations)
+                self.stations.append({"name": row["name"], "lines": [],
+                                      "lon": float(row["lon"]), "lat": float(row["lat"])})
+                self._keys.append(key)
+            line = clean_line_name(row.get("linename"))
+            if line and line not in self.stations[sid]["lines"]:
+                self.stations[sid]["lines"].append(line)
+
+        # 前缀查找用的有序数组：(key, station id)
+        self._name_prefix = sorted((key, sid) for sid, key in enumerate(self._keys))
+        self._pinyin_prefix = sorted(
+            (py, sid) for sid, station in enumerate(self.stations) for py in pinyin_keys(station["name"])
+        )
+
+        # 子串查找用的倒排索引：单字 / 双字 -> {station id}
+        self._grams = {}
+        for sid, key in enumerate(self._keys):
+            for n in (1, 2):
+                for i in range(len(key) - n + 1):
+                    self._grams.setdefault(key[i:i + n], set()).add(sid)
+
+    def __len__(self):
+        return len(self.stations)
+
+    @property
+    def approx_size(self):
+        """粗略估算内存占用（字节），供缓存容量统计使用"""
+        postings = sum(len(s) for s in self._grams.values())
+        return len(self.stations) * 400 + len(self._pinyin_prefix) * 120 + postings * 40
+
+    @staticmethod
+    def _prefix_range(sorted_keys, prefix):
+        start = bisect.bisect_left(sorted_keys, (prefix,))
+        for i in range(start, len(sorted_keys)):
+            key, sid = sorted_keys[i]
+            if not key.startswith(prefix):
+                break
+            yield sid
+
+    def _contains(self, query):
+        grams = [query[i:i + 2] for i in range(len(query) - 1)] or [query]
+        postings = [self._grams.get(g) for g in grams]
+        if not all(postings):
+            return ()
+        candidates = min(postings, key=len)  # 从最短的倒排表开始，逐个验证
+        return (sid for sid in candidates if query in self._keys[sid])
+
+    def search(self, query, limit=10):
+        """返回按相关度排序的前 limit 个站点，每项附带 match（匹配方式）"""
+        query = normalize_station_name(query)
+        if len(query) > 1:
+            query = re.sub(r"站$", "", query)
+        if not query:
+            return []
+
+        best = {}  # station id -> 最好的匹配级别
+
+        def hit(sid, level):
+            if level < best.get(sid, MATCH_CONTAINS + 1):
+                best[sid] = level
+
+        for sid in self._prefix_range(self._name_prefix, query):
+            hit(sid, MATCH_EXACT if self._keys[sid] == query else MATCH_PREFIX)
+        if query.isascii():
+            for sid in self._prefix_range(self._pinyin_prefix, query):
+                hit(sid, MATCH_PINYIN)
+        for sid in self._contains(query):
+            hit(sid, MATCH_CONTAINS)
+
+        ranked = sorted(best.items(), key=lambda item: (
+            item[1], -len(self.stations[item[0]]["lines"]), len(self._keys[item[0]]), self._keys[item[0]]
+        ))
+        return [{**self.stations[sid], "match": MATCH_NAMES[level]} for sid, level in ranked[:limit]]
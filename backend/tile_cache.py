@@ -0,0 +1,283 @@
+"""
+矢量切片（MVT）缓存
+
+/api/tiles/<layer>/<z>/<x>/<y>.pbf 的切片由 PostGIS ST_AsMVT 生成，生成一次后缓存两级：
+- 内存：MetroCache（LRU + 过期时间），键为 (layer, city, "版本/z/x/y")；
+- 磁盘：{root}/{layer}/{city}/{版本}/{z}/{x}/{y}.pbf，进程重启或多个 worker 之间可复用。
+
+两级缓存都以数据版本（fetch_dataset_version 的结果）作为键的一部分：
+数据库中对应的表有改动后版本变化，新请求自然落到新的键上，旧版本的磁盘目录随即删除。
+城市代码必须符合 CITY_CODE_RE，拼出的磁盘路径在读写、删除前都确认位于 root 之下。
+
+为避免爬虫遍历切片坐标把数据库和磁盘拖垮：
+- 切片范围与城市数据的包围盒（bounds_fn，按版本缓存）不相交时直接返回空切片，不查库；
+- 空切片只放内存，不写磁盘；
+- 磁盘占用超过 disk_max_bytes 时按最近使用时间（mtime，磁盘命中时更新）删除最旧的切片。
+"""
+
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from metro_cache import CITY_CODE_RE, MetroCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def default_tile_dir():
+    return os.path.join(tempfile.gettempdir(), "metro_tiles")
+
+
+def tile_bounds(z, x, y, margin=0.0):
+    """切片 z/x/y 的经纬度范围 (min_lon, min_lat, max_lon, max_lat)，margin 为按切片宽度计的外扩比例"""
+    n = 2 ** z
+
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (lon(x - margin), lat(min(y + 1 + margin, n)), lon(x + 1 + margin), lat(max(y - margin, 0)))
+
+
+def _disk_size(st):
+    """文件实际占用的磁盘空间（按块计，小切片也至少占一个块）"""
+    return getattr(st, "st_blocks", 0) * 512 or st.st_size
+
+
+# 切片查询带 TILE_BUFFER / TILE_EXTENT 的缓冲区，包围盒判断时切片范围按此比例外扩
+TILE_MARGIN = 64 / 4096
+
+
+class TileCache:
+    """
+    两级切片缓存。
+
+    version_fn(layer, city_code) 返回数据版本，每隔 version_interval 秒查询一次；
+    bounds_fn(layer, city_code) 返回该图层该城市数据的包围盒 (min_lon, min_lat, max_lon, max_lat)，
+    没有数据时返回 None，数据版本变化后重新获取；
+    切片内容为 bytes（空切片为 b""，只缓存在内存中，避免反复查询没有数据的区域）。
+    """
+
+    def __init__(self, root=None, max_bytes=64 * 1024 * 1024, ttl=3600,
+                 version_interval=30, version_fn=None, bounds_fn=None,
+                 disk_max_bytes=512 * 1024 * 1024, margin=TILE_MARGIN):
+        self.root = os.path.realpath(root or default_tile_dir())
+        self.version_interval = version_interval
+        self.version_fn = version_fn
+        self.bounds_fn = bounds_fn
+        self.disk_max_bytes = disk_max_bytes
+        self.margin = margin
+        self.memory = MetroCache(max_bytes=max_bytes, ttl=ttl)
+
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._versions = {}  # (layer, city_code) -> (上次检查时间, 版本)
+        self._bounds = {}  # (layer, city_code) -> (版本, 包围盒或 None)
+        self._disk_bytes = None  # 本进程估计的磁盘占用，第一次写入时扫描目录得到
+        self._stats = {"disk_hits": 0, "disk_writes": 0, "renders": 0, "version_changes": 0,
+                       "out_of_bounds": 0, "disk_evictions": 0}
+
+    # ---------- 版本 ----------
+    def version(self, layer, city_code):
+        """当前数据版本；到期才查库，版本变化时清掉该图层该城市的旧切片"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._versions.get((layer, city_code))
+            if last is not None and now - last[0] < self.version_interval:
+                return last[1]
+        version = self.version_fn(layer, city_code) if self.version_fn else "0"
+        with self._lock:
+            self._versions[(layer, city_code)] = (now, version)
+        if last is not None and last[1] != version:
+            self.memory.invalidate(city_code=city_code, dataset=layer)
+            self._remove_old_versions(layer, city_code, version)
+            with self._lock:
+                self._stats["version_changes"] += 1
+                self._disk_bytes = None
+        return version
+
+    def _bounds_for(self, layer, city_code, version):
+        with self._lock:
+            cached = self._bounds.get((layer, city_code))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        bounds = self.bounds_fn(layer, city_code)
+        with self._lock:
+            self._bounds[(layer, city_code)] = (version, bounds)
+        return bounds
+
+    def _outside(self, layer, city_code, version, z, x, y):
+        """切片范围与城市数据包围盒不相交时返回 True；没有 bounds_fn 时不做判断"""
+        if self.bounds_fn is None:
+            return False
+        bounds = self._bounds_for(layer, city_code, version)
+        if bounds is None:
+            return True  # 该城市没有这一图层的数据
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y, self.margin)
+        return max_lon < bounds[0] or min_lon > bounds[2] or max_lat < bounds[1] or min_lat > bounds[3]
+
+    # ---------- 磁盘 ----------
+    def _inside_root(self, path):
+        """路径解析后必须位于 root 之下，否则抛出 ValueError"""
+        if not os.path.realpath(path).startswith(self.root + os.sep):
+            raise ValueError(f"切片路径超出缓存目录: {path}")
+        return path
+
+    def _city_dir(self, layer, city_code):
+        if not isinstance(city_code, str) or not CITY_CODE_RE.match(city_code):
+            raise ValueError(f"无效的城市代码: {city_code!r}")
+        return self._inside_root(os.path.join(self.root, layer, city_code))
+
+    def _tile_path(self, layer, city_code, version, z, x, y):
+        return self._inside_root(os.path.join(self._city_dir(layer, city_code), version.replace(":", "_"),
+                                              str(int(z)), str(int(x)), f"{int(y)}.pbf"))
+
+    def _remove_old_versions(self, layer, city_code, version):
+        city_dir = self._city_dir(layer, city_code)
+        if not os.path.isdir(city_dir):
+            return
+        keep = version.replace(":", "_")
+        for name in os.listdir(city_dir):
+            if name != keep:
+                shutil.rmtree(os.path.join(city_dir, name), ignore_errors=True)
+
+    def _read_disk(self, path):
+        try:
+            with open(path, "rb") as f:
+                tile = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间，清理磁盘时最后才删
+        except OSError:
+            pass
+        return tile
+
+    def _write_disk(self, path, tile):
+        """先写临时文件再 os.replace，其他进程不会读到写了一半的切片；超出磁盘上限时清理最旧的切片"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(tile)
+            os.replace(tmp, path)
+            size = _disk_size(os.stat(path))
+        except OSError as e:
+            logger.warning(f"[切片缓存] 写入磁盘失败 {path}: {e}")
+            return
+        with self._lock:
+            self._stats["disk_writes"] += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            over = self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """扫描磁盘目录得到实际占用（多个 worker 共用目录），超过上限时按 mtime 从旧到新删到上限的 90%"""
+        if not self._prune_lock.acquire(blocking=False):
+            return  # 已有线程在清理
+        try:
+            files = []
+            total = 0
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    size = _disk_size(st)
+                    files.append((st.st_mtime, size, path))
+                    total += size
+            evicted = 0
+            if total > self.disk_max_bytes:
+                target = self.disk_max_bytes * 0.9
+                files.sort()
+                for _, size, path in files:
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    evicted += 1
+                self._remove_empty_dirs()
+            with self._lock:
+                self._disk_bytes = total
+                self._stats["disk_evictions"] += evicted
+        finally:
+            self._prune_lock.release()
+
+    def _remove_empty_dirs(self):
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            if dirpath != self.root and not dirnames and not filenames:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    # ---------- 对外接口 ----------
+    def get_or_render(self, layer, city_code, z, x, y, render):
+        """依次查内存、磁盘，都未命中时调用 render() 生成切片并写入两级缓存；城市代码无效时抛出 ValueError"""
+        self._city_dir(layer, city_code)  # 先校验，再查版本（无效城市不进入 _versions）
+        version = self.version(layer, city_code)
+        variant = f"{version}/{z}/{x}/{y}"
+        tile = self.memory.get(layer, city_code, variant)
+        if tile is not None:
+            return tile
+
+        if self._outside(layer, city_code, version, z, x, y):
+            with self._lock:
+                self._stats["out_of_bounds"] += 1
+            return b""  # 不进缓存：范围外的坐标无穷多，判断本身已经足够便宜
+
+        path = self._tile_path(layer, city_code, version, z, x, y)
+        tile = self._read_disk(path)
+        if tile is not None:
+            with self._lock:
+                self._stats["disk_hits"] += 1
+        else:
+            tile = render()
+            with self._lock:
+                self._stats["renders"] += 1
+            if tile:
+                self._write_disk(path, tile)
+
+        self.memory.put(layer, city_code, tile, variant=variant, size=len(tile) + 64)
+        return tile
+
+    def invalidate(self, city_code=None, layer=None):
+        """清除内存和磁盘中的切片，返回清除的内存条目数"""
+        removed = self.memory.invalidate(city_code=city_code, dataset=layer)
+        with self._lock:
+            for key in [k for k in self._versions
+                        if (layer is None or k[0] == layer) and (city_code is None or k[1] == city_code)]:
+                del self._versions[key]
+                self._bounds.pop(key, None)
+            self._disk_bytes = None  # 下次写入时重新扫描
+        if not os.path.isdir(self.root):
+            return removed
+        for layer_name in os.listdir(self.root):
+            if layer is not None and layer_name != layer:
+                continue
+            layer_dir = os.path.join(self.root, layer_name)
+            for city_name in os.listdir(layer_dir):
+                if city_code is None or city_name == city_code:
+                    shutil.rmtree(os.path.join(layer_dir, city_name), ignore_errors=True)
+        return removed
+
+    def stats(self):
+        memory = self.memory.stats()
+        memory.pop("keys", None)
+        with self._lock:
+            return {"root": self.root, "memory": memory, "disk_bytes": self._disk_bytes,
+                    "disk_max_bytes": self.disk_max_bytes, **self._stats}
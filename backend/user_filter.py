@@ -0,0 +1,222 @@
+"""
+用户名 / 邮箱存在性过滤器（Bloom filter）
+
+注册页输入时会实时调用 /api/check_user，每次按键都是一次 app_user 查询。
+这里在进程内保存所有用户名和邮箱的 Bloom filter：
+- 过滤器判断「一定不存在」时直接返回，不访问数据库（绝大多数输入中的用户名都属于这种情况）；
+- 判断「可能存在」时才查询数据库确认，数据库始终是准确结果的来源；
+- 启动时从 app_user 全量加载，注册成功时加入新用户，并每隔 refresh_interval 秒重建一次；
+  重建期间注册的用户记录下来，新过滤器替换旧过滤器前补加进去，不会丢失；
+- 只有本进程写入用户时（sole_writer，如单进程部署），过滤器始终可用；
+  多进程部署时其他 worker 注册的用户不会经过本进程的 add()，过滤器距上次同步超过 max_staleness 秒
+  就不再用于判断（直接查询数据库），同时在后台增量同步最近注册的用户
+  （load_fn(since_seconds) 只返回最近这么多秒内注册的用户，多取一段重叠时间，覆盖提交较慢的注册事务）。
+注册接口本身始终以数据库查重为准。
+"""
+
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """按预期容量和误判率确定位数组大小和哈希个数的 Bloom filter"""
+
+    def __init__(self, capacity, fp_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits = max(int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)), 64)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # 双重哈希：一次 blake2b 得到两个 64 位值，组合出 k 个位置
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def estimated_fp_rate(self):
+        """按当前元素个数估算的误判率：(1 - e^(-kn/m))^k"""
+        k, m = self.num_hashes, self.num_bits
+        return (1 - math.exp(-k * self.count / m)) ** k
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+def _add_identity(bloom, username, email):
+    if username:
+        bloom.add(f"u:{username}")
+    if email:
+        bloom.add(f"e:{email}")
+
+
+class UserExistenceFilter:
+    """
+    用户名 / 邮箱的存在性过滤器，load_fn(since_seconds=None) 返回 [(username, email)]：
+    since_seconds 为 None 时返回全部用户，否则只返回最近 since_seconds 秒内注册的用户。
+    usable() 为 False 时（未加载，或多进程部署下过滤器不够新）调用方应直接查询数据库。
+    """
+
+    SYNC_OVERLAP = 60  # 秒，增量同步时多取的重叠时间
+
+    def __init__(self, load_fn, fp_rate=0.01, refresh_interval=300, sole_writer=False, max_staleness=5):
+        self.load_fn = load_fn
+        self.fp_rate = fp_rate
+        self.refresh_interval = refresh_interval
+        self.sole_writer = sole_writer
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._filter = None
+        self._loaded_at = 0.0  # 上次全量加载的开始时间
+        self._synced_at = 0.0  # 上次（全量或增量）同步的开始时间，此前注册的用户都已在过滤器中
+        self._loading = False
+        self._replay = None  # 全量加载期间 add() 的用户，替换过滤器前补加
+        self._stats = {"checks": 0, "negatives": 0, "possible_hits": 0, "false_positives": 0,
+                       "loads": 0, "syncs": 0, "load_ms": 0.0}
+
+    @property
+    def ready(self):
+        return self._filter is not None
+
+    def usable(self):
+        """过滤器的「一定不存在」结论此刻是否可信"""
+        if self._filter is None:
+            return False
+        return self.sole_writer or time.monotonic() - self._synced_at <= self.max_staleness
+
+    def _load(self):
+        started = time.monotonic()
+        try:
+            t0 = time.perf_counter()
+            rows = self.load_fn()
+            # 每个用户最多两个键（用户名、邮箱），再预留一倍容量给之后注册的用户；
+            # 超出后误判率升高，下次重建时会按新的数量分配
+            bloom = BloomFilter(max(len(rows), 5000) * 4, self.fp_rate)
+            for username, email in rows:
+                _add_identity(bloom, username, email)
+            with self._lock:
+                for username, email in self._replay or ():
+                    _add_identity(bloom, username, email)
+                self._filter = bloom
+                self._loaded_at = self._synced_at = started
+                self._stats["loads"] += 1
+                self._stats["load_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            logger.info(f"[用户过滤器] 已加载 {len(rows)} 个用户, 占用{bloom.memory_bytes / 1024:.0f}KB")
+        except Exception as e:
+            logger.error(f"[用户过滤器] 加载失败: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+                self._replay = None
+
+    def _sync(self):
+        """增量同步最近注册的用户（其他进程注册的用户由此进入本进程的过滤器）"""
+        started = time.monotonic()
+        try:
+            rows = self.load_fn(since_seconds=started - self._synced_at + self.SYNC_OVERLAP)
+            with self._lock:
+                for username, email in rows:
+                    _add_identity(self._filter, username, email)
+                self._synced_at = started
+                self._stats["syncs"] += 1
+        except Exception as e:
+            logger.error(f"[用户过滤器] 增量同步失败: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def ensure_loaded(self, wait=False):
+        """
+        未加载或到了重建时间时全量加载；多进程部署下过滤器快要过期时增量同步。
+        在后台线程中执行（wait=True 时在当前线程中），同一时间只有一个加载 / 同步。
+        """
+        with self._lock:
+            if self._loading:
+                return
+            now = time.monotonic()
+            if self._filter is None or now - self._loaded_at > self.refresh_interval:
+                target = self._load
+                self._replay = []
+            elif not self.sole_writer and now - self._synced_at > self.max_staleness / 2:
+                target = self._sync
+            else:
+                return
+            self._loading = True
+        if wait:
+            target()
+        else:
+            threading.Thread(target=target, name="user-filter-load", daemon=True).start()
+
+    def after_fork(self):
+        """
+        fork 出的子进程中调用：换一把新锁（父进程中其他线程可能正持有旧锁），
+        并把上次全量加载时间随机提前，各 worker 的重建时间错开，不会同时全量读取 app_user
+        """
+        self._lock = threading.Lock()
+        self._loading = False
+        self._replay = None
+        if self._filter is not None:
+            self._loaded_at = time.monotonic() - random.uniform(0, self.refresh_interval)
+
+    def add(self, username=None, email=None):
+        """注册成功后调用"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((username, email))
+            if self._filter is not None:
+                _add_identity(self._filter, username, email)
+
+    def might_exist(self, kind, value):
+        """kind 为 "u"（用户名）或 "e"（邮箱）；返回 False 表示一定不存在"""
+        bloom = self._filter
+        hit = f"{kind}:{value}" in bloom
+        with self._lock:
+            self._stats["checks"] += 1
+            self._stats["possible_hits" if hit else "negatives"] += 1
+        return hit
+
+    def record_false_positive(self, n=1):
+        """过滤器判断可能存在、数据库确认不存在时调用"""
+        with self._lock:
+            self._stats["false_positives"] += n
+
+    def stats(self):
+        with self._lock:
+            bloom = self._filter
+            result = {"ready": bloom is not None, "sole_writer": self.sole_writer,
+                      "synced_age_s": round(time.monotonic() - self._synced_at, 1) if bloom is not None else None,
+                      **self._stats}
+            if bloom is not None:
+                hits = self._stats["possible_hits"]
+                result.update({
+                    "entries": bloom.count,
+                    "capacity": bloom.capacity,
+                    "bits": bloom.num_bits,
+                    "hashes": bloom.num_hashes,
+                    "memory_bytes": bloom.memory_bytes,
+                    "estimated_fp_rate": round(bloom.estimated_fp_rate, 6),
+                    # 实际观测：判断可能存在的查询中，数据库确认不存在的比例
+                    "observed_fp_ratio": round(self._stats["false_positives"] / hits, 4) if hits else 0.0,
+                })
+            return result
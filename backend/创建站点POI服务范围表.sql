@@ -0,0 +1,33 @@
+-- ============================================
+-- 站点 -> POI 服务范围表（预计算）
+-- 说明: POST /api/poi/catchment 一次返回多个站点（或整条线路）周边的 POI 和分类统计，
+--       直接读取该表，不再对每个站点做一次空间查询。
+--       表中保存每个站点 CATCHMENT_MAX_RADIUS（默认 1000 米）范围内的全部 POI 及距离，
+--       任意不超过该值的半径都用 distance <= 半径 过滤即可。
+--       数据由后端在 poi / metro_station 的数据版本变化时自动重新计算，
+--       station_poi_catchment_state 记录计算时的版本。
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS station_poi_catchment (
+    city_code     VARCHAR(10)  NOT NULL,
+    station_name  VARCHAR(100) NOT NULL,
+    poi_id        VARCHAR(50)  NOT NULL,  -- poi.external_id
+    distance      REAL         NOT NULL,  -- 米
+    PRIMARY KEY (city_code, station_name, poi_id)
+);
+
+-- 按站点取半径内的 POI（distance 在索引中，半径过滤不回表）
+CREATE INDEX IF NOT EXISTS idx_catchment_station_distance
+    ON station_poi_catchment (city_code, station_name, distance);
+
+CREATE TABLE IF NOT EXISTS station_poi_catchment_state (
+    city_code        VARCHAR(10) PRIMARY KEY,
+    station_version  TEXT        NOT NULL,
+    poi_version      TEXT        NOT NULL,
+    max_radius       INTEGER     NOT NULL,
+    refreshed_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- 关联回 poi 表取详情时使用
+CREATE INDEX IF NOT EXISTS idx_poi_city_external_id
+    ON poi (city_code, external_id);
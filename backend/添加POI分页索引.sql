@@ -0,0 +1,15 @@
+-- ============================================
+-- POI 键集分页索引
+-- 说明: /api/poi?limit=N&cursor=... 按 (poi_name, external_id) 分页，
+--       /api/poi?format=ndjson 按同样顺序流式输出，
+--       有了该索引后每页 / 每批只需顺序扫描索引，不再对整个城市排序
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_poi_city_name_id
+    ON poi (city_code, poi_name, external_id);
+
+-- 按类型筛选时使用
+CREATE INDEX IF NOT EXISTS idx_poi_city_type_name_id
+    ON poi (city_code, poi_type, poi_name, external_id);
+
+ANALYZE poi;
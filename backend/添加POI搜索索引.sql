@@ -0,0 +1,20 @@
+-- ============================================
+-- POI 关键字搜索索引
+-- 说明: /api/poi/search 在 poi_name、address、business_area 拼接后的文本上做
+--       ILIKE '%关键字%' 和词相似度（<%）匹配，两者都可以使用 pg_trgm 的 GIN 索引；
+--       索引表达式必须与 app.py 中的 POI_SEARCH_TEXT 完全一致。
+--       中文按字切分 trigram，要求数据库的 LC_CTYPE 为 UTF-8 区域（如 zh_CN.UTF-8），
+--       C / POSIX 区域下汉字不会被当作词字符。
+--       关键字少于 3 个字时 trigram 较少，索引过滤效果变差，接口用 statement_timeout 兜底。
+-- ============================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_poi_search_text_trgm
+    ON poi USING GIN ((poi_name || ' ' || coalesce(address, '') || ' ' || coalesce(business_area, '')) gin_trgm_ops);
+
+-- 按 city_code 过滤后再与 trigram 索引做 BitmapAnd
+CREATE INDEX IF NOT EXISTS idx_poi_city_code
+    ON poi (city_code);
+
+ANALYZE poi;
@@ -0,0 +1,19 @@
+-- ============================================
+-- 收藏站点唯一索引
+-- 说明: /api/favorite/add、/api/favorite/add_batch 使用
+--       INSERT ... ON CONFLICT (user_id, city_code, station_id) DO NOTHING，
+--       需要在这三列上有唯一索引；重复点击收藏也不会再插入重复记录。
+--       批量检查 / 取消收藏按 (user_id, city_code, station_id) 查找，同样使用该索引。
+-- ============================================
+
+-- 1. 清理已存在的重复收藏（保留最早的一条）
+DELETE FROM user_favorite_station a
+USING user_favorite_station b
+WHERE a.user_id = b.user_id
+  AND a.city_code = b.city_code
+  AND a.station_id = b.station_id
+  AND a.fav_id > b.fav_id;
+
+-- 2. 创建唯一索引
+CREATE UNIQUE INDEX IF NOT EXISTS uq_user_favorite_station
+    ON user_favorite_station (user_id, city_code, station_id);
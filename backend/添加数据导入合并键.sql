@@ -0,0 +1,21 @@
+-- ============================================
+-- 数据导入合并键
+-- 说明: import_metro_data.py 先把数据 COPY 进临时表，再用 INSERT ... ON CONFLICT 合并进正式表，
+--       需要每张表有唯一的合并键；content_hash 保存每行内容的哈希，重复导入时只改写内容变化的行。
+--       metro_line 中支线可能与主线同名，line_part 为同名线路的序号。
+--       建唯一索引前请先清理重复数据（按合并键 GROUP BY ... HAVING COUNT(*) > 1 检查）。
+-- ============================================
+
+ALTER TABLE metro_line ADD COLUMN IF NOT EXISTS line_part smallint NOT NULL DEFAULT 0;
+ALTER TABLE metro_line ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE metro_station ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE poi ADD COLUMN IF NOT EXISTS content_hash text;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_metro_line_city_name_part
+    ON metro_line (city_code, line_name, line_part);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_metro_station_city_line_num
+    ON metro_station (city_code, line_name, station_num);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_poi_city_external_id
+    ON poi (city_code, external_id);
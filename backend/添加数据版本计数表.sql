@@ -0,0 +1,77 @@
+-- ============================================
+-- 数据版本计数表
+-- 说明: 后端的线路 / 站点 / POI 缓存、矢量切片、站点服务范围表都以「数据版本」判断是否需要刷新。
+--       metro_line / metro_station / poi 上的语句级触发器在每条增删改语句后把受影响城市的 version 加 1，
+--       后端只读取这一行，不再扫描数据表；version 单调递增，不会像 xmin 那样回绕或因 VACUUM FREEZE 改变。
+--       只影响 0 行的语句（如导入时内容未变化的 UPDATE）不改变版本。
+--       TRUNCATE 没有逐行信息，该表所有城市的版本都加 1。
+--       需要 PostgreSQL 11+（触发器转换表、EXECUTE FUNCTION）。
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS dataset_version (
+    table_name  VARCHAR(40)  NOT NULL,
+    city_code   VARCHAR(10)  NOT NULL,
+    version     BIGINT       NOT NULL DEFAULT 0,
+    updated_at  TIMESTAMPTZ  NOT NULL DEFAULT now(),
+    PRIMARY KEY (table_name, city_code)
+);
+
+-- 按城市代码排序后写入，多个并发事务以相同顺序加行锁，避免死锁
+CREATE OR REPLACE FUNCTION bump_dataset_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO dataset_version (table_name, city_code, version)
+        SELECT TG_TABLE_NAME, city_code, 1
+        FROM (SELECT DISTINCT city_code FROM new_rows WHERE city_code IS NOT NULL) c ORDER BY city_code
+        ON CONFLICT (table_name, city_code)
+        DO UPDATE SET version = dataset_version.version + 1, updated_at = now();
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO dataset_version (table_name, city_code, version)
+        SELECT TG_TABLE_NAME, city_code, 1
+        FROM (SELECT city_code FROM new_rows UNION SELECT city_code FROM old_rows) c
+        WHERE city_code IS NOT NULL ORDER BY city_code
+        ON CONFLICT (table_name, city_code)
+        DO UPDATE SET version = dataset_version.version + 1, updated_at = now();
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO dataset_version (table_name, city_code, version)
+        SELECT TG_TABLE_NAME, city_code, 1
+        FROM (SELECT DISTINCT city_code FROM old_rows WHERE city_code IS NOT NULL) c ORDER BY city_code
+        ON CONFLICT (table_name, city_code)
+        DO UPDATE SET version = dataset_version.version + 1, updated_at = now();
+    ELSIF TG_OP = 'TRUNCATE' THEN
+        UPDATE dataset_version SET version = version + 1, updated_at = now()
+        WHERE table_name = TG_TABLE_NAME;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['metro_line', 'metro_station', 'poi'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_version_ins ON %1$I', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_version_upd ON %1$I', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_version_del ON %1$I', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%1$s_version_trunc ON %1$I', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_ins AFTER INSERT ON %1$I '
+                       'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_dataset_version()', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_upd AFTER UPDATE ON %1$I '
+                       'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION bump_dataset_version()', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_del AFTER DELETE ON %1$I '
+                       'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION bump_dataset_version()', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_trunc AFTER TRUNCATE ON %1$I '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION bump_dataset_version()', t);
+    END LOOP;
+END $$;
+
+-- 已有数据的城市从版本 1 开始
+INSERT INTO dataset_version (table_name, city_code, version)
+SELECT 'metro_line', city_code, 1 FROM metro_line WHERE city_code IS NOT NULL GROUP BY city_code
+UNION ALL
+SELECT 'metro_station', city_code, 1 FROM metro_station WHERE city_code IS NOT NULL GROUP BY city_code
+UNION ALL
+SELECT 'poi', city_code, 1 FROM poi WHERE city_code IS NOT NULL GROUP BY city_code
+ON CONFLICT (table_name, city_code) DO NOTHING;
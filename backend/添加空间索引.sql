@@ -0,0 +1,15 @@
+-- ============================================
+-- 空间索引
+-- 说明: /api/tiles/<layer>/<z>/<x>/<y>.pbf 先用 && 按切片范围做包围盒过滤，
+--       有 GiST 索引时只读取切片范围内的线路 / POI，不再扫描整个城市；
+--       /api/poi/nearby 用 location && ST_Expand(查询点) 预筛选，同样使用 idx_poi_location
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_metro_line_geom
+    ON metro_line USING GIST (line_geom);
+
+CREATE INDEX IF NOT EXISTS idx_poi_location
+    ON poi USING GIST (location);
+
+ANALYZE metro_line;
+ANALYZE poi;
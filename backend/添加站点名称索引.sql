@@ -0,0 +1,10 @@
+-- ============================================
+-- 站点名称索引
+-- 说明: /api/favorite/list 通过 LATERAL 按 (city_code, station_name) 为每条收藏取一条站点记录，
+--       有了该索引后每条收藏只需一次索引查找
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_metro_station_city_name
+    ON metro_station (city_code, station_name);
+
+ANALYZE metro_station;
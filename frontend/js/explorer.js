@@ -163,10 +163,31 @@ function initSearchSuggestions() {
     });
 }
 
-function showSuggestions(query) {
+async function showSuggestions(query) {
     const suggestionsBox = document.getElementById('search-suggestions');
+    let matches = null;
+
+    // API模式下由服务端索引搜索（支持拼音首字母），失败时退回本地匹配
+    if (getDataSourceMode()) {
+        try {
+            const results = await searchStations(currentCity, query, 10);
+            matches = results.map(station => ({
+                key: station.name,
+                name: station.name,
+                line: station.lines.join('、') || '未知线路'
+            }));
+        } catch (error) {
+            console.warn('站点搜索接口不可用，使用本地匹配:', error);
+        }
+    }
+    // 等待期间输入已变化时丢弃过期结果
+    if (document.getElementById('station-search-input').value.trim() !== query) return;
+    if (!matches) matches = findLocalSuggestions(query);
+    renderSuggestions(suggestionsBox, query, matches);
+}
+
+function findLocalSuggestions(query) {
     const normalizedQuery = query.toLowerCase();
-    
     const matches = [];
     const seenStations = new Set(); // 用于去重
     
@@ -181,7 +202,10 @@ function showSuggestions(query) {
         }
         if (matches.length >= 10) break;
     }
-    
+    return matches;
+}
+
+function renderSuggestions(suggestionsBox, query, matches) {
     if (matches.length === 0) {
         suggestionsBox.innerHTML = '<div class="no-suggestion">未找到匹配的站点</div>';
     } else {
@@ -384,7 +408,7 @@ async function loadCityData(cityCode) {
     showLoading();
     try {
         try {
-            stopData = await loadMetroStations(cityCode);
+            stopData = await loadMetroStations(cityCode, { format: 'columnar' });
         } catch (error) {
             const stopResponse = await fetch(`${POI_BASE_PATH}/${cityCode}_stop.json`);
             if (!stopResponse.ok) throw new Error('站点数据加载失败');
@@ -869,14 +893,51 @@ function drawMetroLines() {
 
 // ==================== API加载函数 ====================
 async function loadPOIFromAPI(cityCode) {
-    const response = await fetch(`${API_BASE_URL}/poi?city=${cityCode}`);
+    // 使用 NDJSON 流式接口：边下载边解析，不必等待整个响应体
+    const response = await fetch(`${API_BASE_URL}/poi?city=${cityCode}&format=ndjson`);
     if (!response.ok) throw new Error(`API响应错误: ${response.status}`);
-    const data = await response.json();
-    return (data.pois || []).map(poi => ({
+
+    const toPOI = poi => ({
         id: poi.id || poi.external_id, name: poi.name, type: poi.type,
         lon: parseFloat(poi.lon), lat: parseFloat(poi.lat),
         description: poi.address || poi.business_area || '', address: poi.address || '', tel: poi.tel || ''
-    }));
+    });
+
+    // 最后一行是结束标记：{"done": true, "count": N} 或 {"error": ..., "count": N}
+    const pois = [];
+    let tail = null;
+    const pushLines = text => {
+        text.split('\n').forEach(line => {
+            if (!line.trim()) return;
+            const item = JSON.parse(line);
+            if (item.done || item.error) tail = item;
+            else pois.push(toPOI(item));
+        });
+    };
+    const finish = () => {
+        if (!tail?.done) throw new Error(tail?.error || 'POI 数据不完整');
+        return pois;
+    };
+
+    if (!response.body || !response.body.getReader) {
+        pushLines(await response.text());
+        return finish();
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lastNewline = buffer.lastIndexOf('\n');
+        if (lastNewline === -1) continue;
+        pushLines(buffer.slice(0, lastNewline));
+        buffer = buffer.slice(lastNewline + 1);
+    }
+    pushLines(buffer + decoder.decode());
+    return finish();
 }
 
 async function loadPOIFromLocal(cityCode) {
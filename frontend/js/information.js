@@ -90,6 +90,7 @@ document.addEventListener('DOMContentLoaded', function () {
     let currentPopup = null; // 统一的弹窗引用
     let currentPopupStationInfo = null; // 当前弹窗的站点信息
     let lastActiveLine = null; // 跟踪最后选中的线路
+    let favoriteStatus = { city: null, stations: new Map() }; // 当前城市各站点的收藏状态（批量加载）
 
     // 4. 线路颜色配置
     const lineColors = {
@@ -214,6 +215,7 @@ document.addEventListener('DOMContentLoaded', function () {
         ]).then(([railData, stopDataResult]) => {
             railwayData = railData;
             stopData = formatStopData(stopDataResult);
+            loadFavoriteStatus(cityCode);
             clearAllLines();
             clearAllStops();
             initializeLineButtons();
@@ -276,7 +278,7 @@ document.addEventListener('DOMContentLoaded', function () {
     function loadStopData(cityCode) {
         console.log('[loadStopData] 开始加载站点数据, cityCode:', cityCode);
         // 使用API加载数据
-        return loadMetroStations(cityCode).then(data => {
+        return loadMetroStations(cityCode, { format: 'columnar' }).then(data => {
             console.log('[loadStopData] API加载成功, 数据量:', Object.keys(data?.name || {}).length);
             return data;
         }).catch(error => {
@@ -666,26 +668,69 @@ document.addEventListener('DOMContentLoaded', function () {
             return;
         }
 
+        // 已批量加载过当前城市的收藏状态时直接使用，不再单独请求
+        if (favoriteStatus.city === cityCode) {
+            setFavoriteButtonState(favoriteStatus.stations.has(stationName));
+            return;
+        }
+
         try {
             const response = await fetch(
                 `http://127.0.0.1:5000/api/favorite/check?user_id=${userId}&city_code=${cityCode}&station_id=${encodeURIComponent(stationName)}`
             );
             const data = await response.json();
-
-            if (data.is_favorite) {
-                favoriteBtn.classList.add('favorited');
-                favoriteIcon.classList.add('favorited');
-                favoriteText.textContent = '已收藏';
-            } else {
-                favoriteBtn.classList.remove('favorited');
-                favoriteIcon.classList.remove('favorited');
-                favoriteText.textContent = '收藏';
-            }
+            setFavoriteButtonState(data.is_favorite);
         } catch (error) {
             console.error('检查收藏状态失败:', error);
         }
     }
 
+    // 更新弹窗中收藏按钮的显示状态
+    function setFavoriteButtonState(isFavorite) {
+        const favoriteBtn = document.getElementById('favorite-station-btn');
+        const favoriteIcon = document.getElementById('favorite-icon');
+        const favoriteText = document.getElementById('favorite-text');
+        if (!favoriteBtn || !favoriteIcon || !favoriteText) return;
+
+        if (isFavorite) {
+            favoriteBtn.classList.add('favorited');
+            favoriteIcon.classList.add('favorited');
+            favoriteText.textContent = '已收藏';
+        } else {
+            favoriteBtn.classList.remove('favorited');
+            favoriteIcon.classList.remove('favorited');
+            favoriteText.textContent = '收藏';
+        }
+    }
+
+    // 一次请求加载当前城市所有站点的收藏状态（替代每打开一个站点弹窗请求一次）
+    async function loadFavoriteStatus(cityCode) {
+        const isLoggedIn = localStorage.getItem('isLoggedIn') === 'true';
+        const userId = localStorage.getItem('userId');
+        favoriteStatus = { city: null, stations: new Map() };
+        if (!isLoggedIn || !userId || !stopData) return;
+
+        const stationIds = [...new Set(stopData.map(stop => stop.name).filter(Boolean))];
+        try {
+            const response = await fetch('http://127.0.0.1:5000/api/favorite/check_batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ user_id: userId, city_code: cityCode, station_ids: stationIds })
+            });
+            if (!response.ok) return;
+            const data = await response.json();
+            if (cityCode !== currentCity) return; // 加载期间已切换城市
+
+            const stations = new Map();
+            data.favorites.forEach(item => {
+                if (item.is_favorite) stations.set(item.station_id, item.fav_id);
+            });
+            favoriteStatus = { city: cityCode, stations };
+        } catch (error) {
+            console.error('批量加载收藏状态失败:', error);
+        }
+    }
+
     // 切换收藏状态
     async function toggleFavoriteStation(stationName, cityCode, userId) {
         const favoriteBtn = document.getElementById('favorite-station-btn');
@@ -727,6 +772,14 @@ document.addEventListener('DOMContentLoaded', function () {
                     favoriteIcon.classList.add('favorited');
                     favoriteText.textContent = '已收藏';
                 }
+                // 同步本地的收藏状态
+                if (favoriteStatus.city === cityCode) {
+                    if (isFavorited) {
+                        favoriteStatus.stations.delete(stationName);
+                    } else {
+                        favoriteStatus.stations.set(stationName, data.fav_id);
+                    }
+                }
             } else {
                 alert(data.message || '操作失败');
                 // 恢复原状态
@@ -1252,6 +1305,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
             railwayData = railData;
             stopData = formatStopData(stopDataResult);
+            loadFavoriteStatus(currentCity);
 
             console.log('[初始化] stopData数量:', stopData?.length);
 
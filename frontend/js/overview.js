@@ -309,8 +309,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // 7. 加载地铁路线数据（使用API）
     function loadRailwayData(cityCode) {
-        // 使用API加载数据
-        return loadMetroLines(cityCode).catch(error => {
+        // 使用API加载数据（总览页只需要对应缩放级别的简化几何，差分编码传输）
+        return loadMetroLines(cityCode, { zoom: cityConfig[cityCode].zoom, format: 'compact' }).catch(error => {
             console.error('API加载失败，尝试本地文件:', error);
             // 降级到本地文件
             const config = cityConfig[cityCode];
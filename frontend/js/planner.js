@@ -579,7 +579,7 @@ document.addEventListener('DOMContentLoaded', function () {
     /**
      * 规划地铁路线
      */
-    function planSubwayRoute() {
+    async function planSubwayRoute() {
         const loadingOverlay = document.getElementById('loading');
         const loadingText = document.getElementById('loading-text');
         if (loadingOverlay) {
@@ -603,8 +603,11 @@ document.addEventListener('DOMContentLoaded', function () {
         // 清除之前的路线标记（但保留起点终点标记）
         clearRouteMarkers();
         
-        // 使用 route-planner-utils.js 中的算法生成路线
-        if (typeof window.generateAllRouteOptions === 'function') {
+        // 优先使用服务端路径规划，失败时由 route-planner-utils.js 降级到本地BFS
+        if (typeof window.generateRouteOptionsFromAPI === 'function') {
+            allRouteOptions = await window.generateRouteOptionsFromAPI(currentCity, startSubwayStation.name, endSubwayStation.name);
+            console.log('生成的路线方案:', allRouteOptions);
+        } else if (typeof window.generateAllRouteOptions === 'function') {
             allRouteOptions = window.generateAllRouteOptions(startSubwayStation.name, endSubwayStation.name);
             console.log('生成的路线方案:', allRouteOptions);
         } else {
@@ -12,16 +12,25 @@ const USE_API = true;  // 设置为 true 启用API，false 使用本地文件
 /**
  * 加载地铁线路数据
  * @param {string} cityCode - 城市代码（bj, nj, sh, wh）
+ * @param {Object} options - 可选：{ zoom, tolerance, precision, format }
+ *   zoom / tolerance 指定简化级别，format 为 'compact' 时使用差分编码（自动还原为 GeoJSON）
  * @returns {Promise<Object>} GeoJSON格式的线路数据
  */
-async function loadMetroLines(cityCode) {
+async function loadMetroLines(cityCode, options = {}) {
     if (USE_API) {
         // 从API加载
-        const response = await fetch(`${API_BASE_URL}/metro/lines?city=${cityCode}`);
+        const params = new URLSearchParams({ city: cityCode });
+        ['zoom', 'tolerance', 'precision', 'format'].forEach(key => {
+            if (options[key] !== undefined && options[key] !== null) {
+                params.set(key, options[key]);
+            }
+        });
+        const response = await fetch(`${API_BASE_URL}/metro/lines?${params}`);
         if (!response.ok) {
             throw new Error(`加载线路数据失败: ${response.statusText}`);
         }
-        return await response.json();
+        const data = await response.json();
+        return data.encoding ? decodeCompactLines(data) : data;
     } else {
         // 从本地文件加载（保持兼容）
         const response = await fetch(`./data/${cityCode}_line.geojson`);
@@ -32,19 +41,56 @@ async function loadMetroLines(cityCode) {
     }
 }
 
+/**
+ * 还原差分编码的线路数据（/metro/lines?format=compact）
+ * 每条线的坐标为 [x0, y0, dx1, dy1, ...]，数值为坐标乘以 10^precision 后的整数
+ * @param {Object} data - 接口返回的数据
+ * @returns {Object} 标准 GeoJSON FeatureCollection
+ */
+function decodeCompactLines(data) {
+    const scale = Math.pow(10, data.encoding.precision);
+    const decodePart = flat => {
+        const coords = [];
+        let x = 0;
+        let y = 0;
+        for (let i = 0; i < flat.length; i += 2) {
+            x += flat[i];
+            y += flat[i + 1];
+            coords.push([x / scale, y / scale]);
+        }
+        return coords;
+    };
+
+    data.features.forEach(feature => {
+        const geometry = feature.geometry;
+        if (!geometry) return;
+        if (geometry.type === 'LineString') {
+            geometry.coordinates = decodePart(geometry.coordinates);
+        } else if (geometry.type === 'MultiLineString') {
+            geometry.coordinates = geometry.coordinates.map(decodePart);
+        }
+    });
+    delete data.encoding;
+    return data;
+}
+
 /**
  * 加载地铁站点数据
  * @param {string} cityCode - 城市代码（bj, nj, sh, wh）
- * @returns {Promise<Object>} 站点数据
+ * @param {Object} options - 可选 { format: 'columnar' }（列式传输，体积更小，返回前还原为原格式）
+ * @returns {Promise<Object>} 站点数据（原格式，可直接交给 formatStopData）
  */
-async function loadMetroStations(cityCode) {
+async function loadMetroStations(cityCode, options = {}) {
     if (USE_API) {
         // 从API加载
-        const response = await fetch(`${API_BASE_URL}/metro/stations?city=${cityCode}`);
+        const params = new URLSearchParams({ city: cityCode });
+        if (options.format) params.set('format', options.format);
+        const response = await fetch(`${API_BASE_URL}/metro/stations?${params}`);
         if (!response.ok) {
             throw new Error(`加载站点数据失败: ${response.statusText}`);
         }
-        return await response.json();
+        const data = await response.json();
+        return data.format === 'columnar' ? decodeColumnarStations(data) : data;
     } else {
         // 从本地文件加载（保持兼容）
         const response = await fetch(`./data/${cityCode}_stop.json`);
@@ -55,6 +101,23 @@ async function loadMetroStations(cityCode) {
     }
 }
 
+/**
+ * 列式站点数据（/metro/stations?format=columnar）还原为原格式（各字段按 idx * 2 索引的对象）
+ * @param {Object} data - { format: 'columnar', count, columns: { name: [...], ... } }
+ * @returns {Object} { name: {'0': ..., '2': ...}, linename: {...}, ... }
+ */
+function decodeColumnarStations(data) {
+    const result = {};
+    for (const [column, values] of Object.entries(data.columns)) {
+        const map = {};
+        values.forEach((value, idx) => {
+            map[String(idx * 2)] = value;
+        });
+        result[column] = map;
+    }
+    return result;
+}
+
 /**
  * 加载POI数据
  * @param {string} cityCode - 城市代码（bj, nj, sh, wh）
@@ -113,6 +176,64 @@ async function loadNearbyPOI(cityCode, lon, lat, radius = 300) {
     return await response.json();
 }
 
+/**
+ * 批量加载多个站点（或整条线路）周边的POI和分类统计（仅API模式支持）
+ * 一次请求代替逐站调用 loadNearbyPOI
+ * @param {string} cityCode - 城市代码
+ * @param {Object} query - { stations: [站名], line: 线路名, radius: 半径（米）, types: [POI类型], includePois: 是否返回POI列表 }
+ * @returns {Promise<Object>} { stations: {站名: {pois, total, counts}}, counts, total }
+ */
+async function loadStationCatchment(cityCode, { stations = [], line = null, radius = 300, types = null, includePois = true } = {}) {
+    const response = await fetch(`${API_BASE_URL}/poi/catchment`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ city: cityCode, stations, line, radius, types, include_pois: includePois })
+    });
+    if (!response.ok) {
+        throw new Error(`加载站点周边POI失败: ${response.statusText}`);
+    }
+    return await response.json();
+}
+
+/**
+ * 站点名称搜索（仅API模式支持），支持站名前缀/包含和拼音首字母，只返回排名靠前的站点
+ * @param {string} cityCode - 城市代码
+ * @param {string} query - 输入的关键字
+ * @param {number} limit - 最多返回的站点数，默认10
+ * @returns {Promise<Array>} [{ name, lines, lon, lat, match }]
+ */
+async function searchStations(cityCode, query, limit = 10) {
+    const params = new URLSearchParams({ city: cityCode, q: query, limit });
+    const response = await fetch(`${API_BASE_URL}/metro/stations/search?${params}`);
+    if (!response.ok) {
+        throw new Error(`站点搜索失败: ${response.statusText}`);
+    }
+    const data = await response.json();
+    return data.results;
+}
+
+/**
+ * POI关键字搜索（仅API模式支持），按名称、地址、商圈匹配并按相关度排序，分页返回
+ * @param {string} cityCode - 城市代码
+ * @param {string} query - 关键字
+ * @param {Object} options - { limit, cursor, fuzzy, type, lon, lat, radius, bbox: [minLon, minLat, maxLon, maxLat] }
+ * @returns {Promise<Object>} { pois, next_cursor, truncated }
+ */
+async function searchPOI(cityCode, query, options = {}) {
+    const params = new URLSearchParams({ city: cityCode, q: query });
+    for (const key of ['limit', 'cursor', 'type', 'lon', 'lat', 'radius']) {
+        if (options[key] != null) params.set(key, options[key]);
+    }
+    if (options.fuzzy) params.set('fuzzy', '1');
+    if (options.bbox) params.set('bbox', options.bbox.join(','));
+
+    const response = await fetch(`${API_BASE_URL}/poi/search?${params}`);
+    if (!response.ok) {
+        throw new Error(`POI搜索失败: ${response.statusText}`);
+    }
+    return await response.json();
+}
+
 /**
  * 计算两点间的距离（公里）
  * @param {number} lat1 - 纬度1
@@ -153,9 +274,14 @@ function getDataSourceMode() {
 if (typeof module !== 'undefined' && module.exports) {
     module.exports = {
         loadMetroLines,
+        decodeCompactLines,
         loadMetroStations,
+        decodeColumnarStations,
         loadPOIData,
         loadNearbyPOI,
+        loadStationCatchment,
+        searchStations,
+        searchPOI,
         setDataSourceMode,
         getDataSourceMode
     };
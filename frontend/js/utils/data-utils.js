@@ -65,7 +65,7 @@ function formatStopData(rawData) {
 // 加载地铁站数据 - 使用API
 function loadStopData(currentCity) {
     // 使用API加载数据（已在api-data-utils.js中定义）
-    return loadMetroStations(currentCity).then(rawData => {
+    return loadMetroStations(currentCity, { format: 'columnar' }).then(rawData => {
         return formatStopData(rawData);
     }).catch(error => {
         console.error('API加载失败，尝试本地文件:', error);
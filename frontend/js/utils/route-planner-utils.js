@@ -339,6 +339,36 @@ function generateAllRouteOptions(startStationName, endStationName) {
 
     console.log(`找到${allPaths.length}条可能的路径`);
 
+    return buildRouteOptions(allPaths);
+}
+
+/**
+ * 通过后端 /api/route/plan 规划路线（服务端预编译路网 + 多准则搜索）
+ * 后端不可用时降级到本地BFS
+ */
+async function generateRouteOptionsFromAPI(cityCode, startStationName, endStationName) {
+    try {
+        const url = `${API_BASE_URL}/route/plan?city=${cityCode}` +
+            `&from=${encodeURIComponent(startStationName)}&to=${encodeURIComponent(endStationName)}&k=5`;
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(`路径规划接口返回 ${response.status}`);
+        }
+        const result = await response.json();
+        console.log(`服务端路径规划耗时 ${result.elapsed_ms}ms`);
+        // 合并「最快」和「最少换乘」两组方案，后续统一去重排序
+        return buildRouteOptions([...result.by_time, ...result.by_transfers]);
+    } catch (error) {
+        console.warn('服务端路径规划失败，使用本地BFS:', error);
+        return generateAllRouteOptions(startStationName, endStationName);
+    }
+}
+
+/**
+ * 将路径列表转换为路线方案
+ * @param {Array} allPaths - [{path, transfers, duration?, distance?}]，duration/distance 由服务端给出时直接使用
+ */
+function buildRouteOptions(allPaths) {
     // 转换路径为路线方案
     const routeOptions = [];
     const routeKeys = new Set(); // 用于去重
@@ -387,8 +417,12 @@ function generateAllRouteOptions(startStationName, endStationName) {
 
         // 计算总站数和时间
         const totalStations = path.length;
-        const duration = totalStations * 2 + actualTransfers * 5; // 每站2分钟，每次换乘5分钟
-        const distance = totalStations * 1.5; // 每站约1.5公里
+        const duration = pathData.duration !== undefined ?
+            Math.round(pathData.duration) :
+            totalStations * 2 + actualTransfers * 5; // 每站2分钟，每次换乘5分钟
+        const distance = pathData.distance !== undefined ?
+            pathData.distance :
+            totalStations * 1.5; // 每站约1.5公里
 
         // 生成路线描述（去除重复的站点）
         const transferStations = segments.slice(0, -1).map(seg =>
@@ -670,6 +704,7 @@ function clearRouteFromMap(map) {
 // 导出函数
 window.initSubwayNetwork = initSubwayNetwork;
 window.generateAllRouteOptions = generateAllRouteOptions;
+window.generateRouteOptionsFromAPI = generateRouteOptionsFromAPI;
 window.displayRouteOnMap = displayRouteOnMap;
 window.clearRouteFromMap = clearRouteFromMap;
 window.findStationsByName = findStationsByName;
\ No newline at end of file